@@ -0,0 +1,384 @@
+#!/usr/bin/python
+
+"""
+This application looks for broadcast storms, a device that sends Who-Is,
+I-Am, Who-Is-Router-To-Network, I-Am-Router-To-Network, or other unconfirmed
+broadcasts much more often than it should, even if only for a short time.
+The rate of each kind of broadcast from each source is kept over sliding
+windows of capture time, and a storm starts when the rate over one of the
+windows goes over its limit and ends when the rates over all of them are
+back under.  The start and end of each storm are printed as they are found,
+with the rates when it started and the peak rates, and the report lists the
+storms that have not ended.
+
+The windows and limits are given by the --window option as the number of
+seconds and the number of packets per second, the default is 1:20, 10:10,
+and 60:5, so 20 packets in one second or 300 in a minute is a storm.
+
+This application accepts the same --source, --destination, and --host options
+as the other filters, and accepts the debugging options of other BACpypes
+applications.
+"""
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from bacpypes.analysis import strftimestamp, Tracer
+from bacpypes.pdu import Address
+from bacpypes.apdu import UnconfirmedRequestPDU
+from bacpypes.npdu import WhoIsRouterToNetwork, IAmRouterToNetwork
+
+from addrmatch import address_filter
+from parallel import trace_ranges
+from pcaptrace import add_arguments
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+filterAddress = None
+
+# window length in seconds and packets per second that is a storm
+default_windows = ((1, 20.0), (10, 10.0), (60, 5.0))
+windows = default_windows
+
+# (source, kind) to its rates
+rates = {}
+
+# (source, kind) to the storm in progress
+storms = {}
+
+# the last second that the storms were checked
+checked = None
+
+# destination address types that are broadcasts
+_broadcast_types = (
+    Address.localBroadcastAddr,
+    Address.remoteBroadcastAddr,
+    Address.globalBroadcastAddr,
+)
+
+#
+#   is_broadcast
+#
+
+
+def is_broadcast(address):
+    """Return true if the address is a broadcast.  The subnet mask is not
+    in the capture, so an IPv4 address ending in 255 is taken to be the
+    directed broadcast address."""
+    if address.addrType in _broadcast_types:
+        return True
+    return (address.addrType == Address.localStationAddr) and (
+        address.addrLen == 6 and address.addrAddr[3] == 255
+    )
+
+
+#
+#   Rates
+#
+
+
+class Rates:
+    """The number of packets in each of the last seconds, in a ring as long
+    as the longest window, and the sum for each window."""
+
+    def __init__(self, second):
+        self.slots = [0] * windows[-1][0]
+        self.sums = [0] * len(windows)
+        self.second = second
+
+    def advance(self, second):
+        """Move the windows up to a second of capture time."""
+        if second <= self.second:
+            return
+
+        # after a long gap the windows are empty
+        size = len(self.slots)
+        if second - self.second >= size:
+            self.slots = [0] * size
+            self.sums = [0] * len(windows)
+            self.second = second
+            return
+
+        slots = self.slots
+        sums = self.sums
+        while self.second < second:
+            self.second += 1
+
+            # the second that each window no longer covers
+            for i, (length, limit) in enumerate(windows):
+                sums[i] -= slots[(self.second - length) % size]
+            slots[self.second % size] = 0
+
+    def add(self, second):
+        """Count a packet."""
+        self.advance(second)
+
+        # a packet that is a little out of order counts now
+        self.slots[self.second % len(self.slots)] += 1
+        for i in range(len(self.sums)):
+            self.sums[i] += 1
+
+    def rates(self):
+        """Return the packets per second over each window."""
+        return [
+            total / float(length) for total, (length, limit) in zip(self.sums, windows)
+        ]
+
+    def storm(self):
+        """Return true if the rate over a window is over its limit."""
+        return any(
+            total > length * limit for total, (length, limit) in zip(self.sums, windows)
+        )
+
+    def quiet(self):
+        """Return the time when the rates over all of the windows are under
+        their limits if no more packets are counted, the end of the first
+        second from the last one counted where they are."""
+        quiet = Rates(self.second)
+        quiet.slots = list(self.slots)
+        quiet.sums = list(self.sums)
+
+        while quiet.storm():
+            quiet.advance(quiet.second + 1)
+
+        return float(quiet.second + 1)
+
+
+#
+#   Storm
+#
+
+
+class Storm:
+    def __init__(self, source, kind, start, rates):
+        self.source = source
+        self.kind = kind
+        self.start = start
+        self.end = None
+
+        # the time of the last packet
+        self.last = start
+
+        # the rates when it started and the highest rates
+        self.rates = list(rates)
+        self.packets = 1
+        self.peaks = list(rates)
+
+    def update(self, rates):
+        self.peaks = [max(peak, rate) for peak, rate in zip(self.peaks, rates)]
+
+    def print_event(self, when, event, detail, rates):
+        print(
+            "%s\t%s\t%s\t%s\t%s %s %s"
+            % (
+                strftimestamp(when),
+                event,
+                self.source,
+                self.kind,
+                detail,
+                " ".join("%ds" % (length,) for length, limit in windows),
+                " ".join("%.1f" % (rate,) for rate in rates),
+            )
+        )
+
+
+#
+#   broadcast_kind
+#
+
+
+def broadcast_kind(pkt):
+    """Return the name of the kind of broadcast."""
+    name = pkt.__class__.__name__
+    if name.endswith("Request"):
+        name = name[: -len("Request")]
+    return name
+
+
+#
+#   BroadcastStorm
+#
+
+
+@bacpypes_debugging
+class BroadcastStorm(Tracer):
+
+    # packets this tracer is interested in
+    pduTypes = (UnconfirmedRequestPDU, WhoIsRouterToNetwork, IAmRouterToNetwork)
+
+    # only the class, addresses and timestamp are used
+    cacheable = True
+
+    def __init__(self):
+        if _debug:
+            BroadcastStorm._debug("__init__")
+        Tracer.__init__(self, self.Filter)
+
+    def Filter(self, pkt):
+        if _debug:
+            BroadcastStorm._debug("Filter %r", pkt)
+        global checked
+
+        # check for the packet type
+        if not isinstance(pkt, self.pduTypes):
+            return
+
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                BroadcastStorm._debug("    - address filter fail")
+            return
+
+        second = int(pkt._timestamp)
+
+        # once a second see if the storms that are quiet have ended
+        if (checked is None) or (second > checked):
+            checked = second
+            check_storms(second)
+
+        if not is_broadcast(pkt.pduDestination):
+            return
+
+        key = (pkt.pduSource, broadcast_kind(pkt))
+        key_rates = rates.get(key)
+        if key_rates is None:
+            key_rates = rates[key] = Rates(second)
+        key_rates.add(second)
+
+        storm = storms.get(key)
+        if storm:
+            storm.last = pkt._timestamp
+            storm.packets += 1
+            storm.update(key_rates.rates())
+        elif key_rates.storm():
+            if _debug:
+                BroadcastStorm._debug("    - storm: %r", key)
+            storm = storms[key] = Storm(
+                key[0], key[1], pkt._timestamp, key_rates.rates()
+            )
+            storm.print_event(storm.start, "start", "rates", storm.rates)
+
+
+#
+#   check_storms
+#
+
+
+def check_storms(second=None):
+    """End the storms where the rates have dropped before the start of a
+    second, or all of them when there are no more packets.  The rates of a
+    storm only drop when there are no packets from the source, so the end is
+    found from the rates when its last packet was counted."""
+    for key, storm in list(storms.items()):
+        end = rates[key].quiet()
+        if (second is None) or (end <= second):
+            storm.end = end
+            del storms[key]
+
+            storm.print_event(
+                storm.end,
+                "end",
+                "%.0fs %d packets, peak" % (storm.end - storm.start, storm.packets),
+                storm.peaks,
+            )
+
+
+#
+#   configure
+#
+
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
+    if _debug:
+        configure._debug("configure %r", args)
+    global filterAddress, windows
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
+    if _debug:
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+    # the other applications do not have this option
+    if getattr(args, "window", None):
+        window_limits = []
+        for window in args.window:
+            length, limit = window.split(":")
+            window_limits.append((int(length), float(limit)))
+        windows = tuple(sorted(window_limits))
+    if _debug:
+        configure._debug("    - windows: %r", windows)
+
+
+#
+#   report
+#
+
+
+def report():
+    """Print the storms that have not ended."""
+    for storm in sorted(storms.values(), key=lambda storm: storm.start):
+        storm.print_event(
+            storm.start,
+            "ongoing",
+            "%.0fs %d packets, peak" % (storm.last - storm.start, storm.packets),
+            storm.peaks,
+        )
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "--window",
+        action="append",
+        type=str,
+        help="window seconds and packets per second limit, like 10:5",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of decoding processes"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    # check the windows
+    for window in args.window or ():
+        try:
+            length, limit = window.split(":")
+            if (int(length) < 1) or (float(limit) <= 0):
+                raise ValueError
+        except ValueError:
+            parser.error("invalid window: %s" % (window,))
+
+    # interpret the arguments
+    configure(args)
+
+    # trace the file(s), decoding each one in parallel when there is more
+    # than one job
+    trace_ranges(args.pcap, [BroadcastStorm], args, args.jobs, report)
+
+    # there are no more packets, the storms end
+    check_storms()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,43 @@
 #!/usr/bin/python
 
 """
+This application counts the Unconfirmed COV Notifications from each object
+and prints them, the noisiest first.  On a site with a very large number of
+points the --top option keeps a fixed number of counters and prints the
+objects with the most notifications, each count is at most --error (a
+fraction of all of the notifications, 0.001 by default) too high.
+
 This application accepts the same --source, --destination, and --host options
 as the other filters, and accepts the debugging options of other BACpypes
 applications.
 """
 
+import math
+
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
-from bacpypes.pdu import Address
-from bacpypes.analysis import trace, Tracer
+from bacpypes.analysis import Tracer
 from bacpypes.apdu import UnconfirmedCOVNotificationRequest
 
+from addrmatch import address_filter
+from parallel import trace_files
+from pcaptrace import add_arguments
+from sketch import SpaceSaving
+
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
 # globals
-filterSource = None
-filterDestination = None
-filterHost = None
+filterAddress = None
 
 # dictionary of requests
 requests = {}
 
-#
-#   Match
-#
-
-
-@bacpypes_debugging
-def Match(addr1, addr2):
-    """Return true iff addr1 matches addr2."""
-    if _debug:
-        Match._debug("Match %r %r", addr1, addr2)
-
-    if addr2.addrType == Address.localBroadcastAddr:
-        # match any local station
-        return (addr1.addrType == Address.localStationAddr) or (
-            addr1.addrType == Address.localBroadcastAddr
-        )
-    elif addr2.addrType == Address.localStationAddr:
-        # match a specific local station
-        return (addr1.addrType == Address.localStationAddr) and (
-            addr1.addrAddr == addr2.addrAddr
-        )
-    elif addr2.addrType == Address.remoteBroadcastAddr:
-        # match any remote station or remote broadcast on a matching network
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            or (addr1.addrType == Address.remoteBroadcastAddr)
-        ) and (addr1.addrNet == addr2.addrNet)
-    elif addr2.addrType == Address.remoteStationAddr:
-        # match a specific remote station
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            and (addr1.addrNet == addr2.addrNet)
-            and (addr1.addrAddr == addr2.addrAddr)
-        )
-    elif addr2.addrType == Address.globalBroadcastAddr:
-        # match a global broadcast address
-        return addr1.addrType == Address.globalBroadcastAddr
-    else:
-        raise RuntimeError("invalid match combination")
-
+# number of objects to print and the counters for them, or None for all
+top = None
+heavy = None
 
 #
 #   COVNotificationSummary
@@ -73,6 +46,10 @@ def Match(addr1, addr2):
 
 @bacpypes_debugging
 class COVNotificationSummary(Tracer):
+
+    # packets this tracer is interested in
+    pduTypes = (UnconfirmedCOVNotificationRequest,)
+
     def __init__(self):
         if _debug:
             COVNotificationSummary._debug("__init__")
@@ -83,24 +60,11 @@ class COVNotificationSummary(Tracer):
             COVNotificationSummary._debug("Filter %r", pkt)
         global requests
 
-        # apply the filters
-        if filterSource:
-            if not Match(pkt.pduSource, filterSource):
-                if _debug:
-                    COVNotificationSummary._debug("    - source filter fail")
-                return
-        if filterDestination:
-            if not Match(pkt.pduDestination, filterDestination):
-                if _debug:
-                    COVNotificationSummary._debug("    - destination filter fail")
-                return
-        if filterHost:
-            if (not Match(pkt.pduSource, filterHost)) and (
-                not Match(pkt.pduDestination, filterHost)
-            ):
-                if _debug:
-                    COVNotificationSummary._debug("    - host filter fail")
-                return
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                COVNotificationSummary._debug("    - address filter fail")
+            return
 
         # check for notifications
         if isinstance(pkt, UnconfirmedCOVNotificationRequest):
@@ -109,57 +73,150 @@ class COVNotificationSummary(Tracer):
                 pkt.initiatingDeviceIdentifier[1],
                 pkt.monitoredObjectIdentifier,
             )
-            if key in requests:
+            if heavy:
+                heavy.add(key)
+            elif key in requests:
                 requests[key] += 1
             else:
                 requests[key] = 1
 
 
 #
-#   __main__
+#   configure
 #
 
-# parse the command line arguments
-parser = ArgumentParser(description=__doc__)
-parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
-parser.add_argument(
-    "-d", "--destination", nargs="?", type=str, help="destination address"
-)
-parser.add_argument("--host", nargs="?", type=str, help="source or destination")
-parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
-args = parser.parse_args()
-
-if _debug:
-    _log.debug("initialization")
-if _debug:
-    _log.debug("    - args: %r", args)
-
-# interpret the arguments
-if args.source:
-    filterSource = Address(args.source)
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
+    if _debug:
+        configure._debug("configure %r", args)
+    global filterAddress, top, heavy
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
     if _debug:
-        _log.debug("    - filterSource: %r", filterSource)
-if args.destination:
-    filterDestination = Address(args.destination)
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+    # the other applications do not have these options
+    top = getattr(args, "top", None)
+    if top:
+        error = getattr(args, "error", None) or 0.001
+        heavy = SpaceSaving(max(top, int(math.ceil(1.0 / error))))
+        if _debug:
+            configure._debug("    - counters: %r", heavy.size)
+
+
+#
+#   state
+#
+
+
+def state():
+    """Return the notification counts so they can be merged by another
+    process."""
+    return heavy or requests
+
+
+def merge(partial):
+    """Add the notification counts from another process."""
+    if isinstance(partial, SpaceSaving):
+        # the approximate counts cannot be added to the exact ones
+        if not heavy:
+            raise RuntimeError("the checkpoint was saved with --top")
+        heavy.merge(partial)
+        return
+
+    for key, count in partial.items():
+        if heavy:
+            heavy.add(key, count)
+        else:
+            requests[key] = requests.get(key, 0) + count
+
+
+#
+#   report
+#
+
+
+def report():
+    """Print the notification counts."""
+    if heavy:
+        report_top()
+        return
+
+    # sort the result, descending order by count
+    items = sorted(requests.items(), key=lambda x: x[1], reverse=True)
+
+    # print everything out
+    print("%-20s %8s %-15s %4s %5s" % ("Address", "Device", "Object", "", "Count"))
+    for key, count in items:
+        print("%-20s %8s %-15s %4d %5d" % (key[0], key[1], key[2][0], key[2][1], count))
+
+
+def report_top():
+    """Print the counts of the objects with the most notifications."""
+    print(
+        "%-20s %8s %-15s %4s %5s %5s"
+        % ("Address", "Device", "Object", "", "Count", "Error")
+    )
+    for key, count, error in heavy.top(top):
+        print(
+            "%-20s %8s %-15s %4d %5d %5d"
+            % (key[0], key[1], key[2][0], key[2][1], count, error)
+        )
+
+    print("")
+    print(
+        "%d notifications, %d counters, a count is at most %d too high"
+        % (heavy.total, heavy.size, heavy.total // heavy.size)
+    )
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "--top", type=int, help="print the objects with the most notifications"
+    )
+    parser.add_argument(
+        "--error",
+        type=float,
+        help="largest error in a count as a fraction of the notifications",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--checkpoint", type=str, help="file to save the results and positions in"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
     if _debug:
-        _log.debug("    - filterDestination: %r", filterDestination)
-if args.host:
-    filterHost = Address(args.host)
+        _log.debug("initialization")
     if _debug:
-        _log.debug("    - filterHost: %r", filterHost)
+        _log.debug("    - args: %r", args)
 
-# start out with no requests
-requests = {}
+    # interpret the arguments
+    configure(args)
+
+    # trace the file(s), in parallel when there is more than one job
+    trace_files(args.pcap, [COVNotificationSummary], args, args.jobs, report)
 
-# trace the file(s)
-for fname in args.pcap:
-    trace(fname, [COVNotificationSummary])
+    # print the notification counts
+    report()
 
-# sort the result, descending order by count
-items = requests.items()
-items.sort(key=lambda x: x[1], reverse=True)
 
-# print everything out
-print("%-20s %8s %-15s %4s %5s" % ("Address", "Device", "Object", "", "Count"))
-for key, count in items:
-    print("%-20s %8s %-15s %4d %5d" % (key[0], key[1], key[2][0], key[2][1], count))
+if __name__ == "__main__":
+    main()
@@ -14,10 +14,13 @@ applications.
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
-from bacpypes.pdu import Address
-from bacpypes.analysis import trace, strftimestamp, Tracer
+from bacpypes.analysis import strftimestamp, Tracer
 from bacpypes.apdu import ConfirmedEventNotificationRequest, SimpleAckPDU
 
+from addrmatch import address_filter
+from parallel import trace_ranges
+from pcaptrace import add_arguments
+
 try:
     from CSStat import Statistics
 except ImportError:
@@ -28,9 +31,7 @@ _debug = 0
 _log = ModuleLogger(globals())
 
 # globals
-filterSource = None
-filterDestination = None
-filterHost = None
+filterAddress = None
 
 # dictionary of pending requests
 requests = {}
@@ -53,53 +54,19 @@ class Traffic:
 
 
 #
-#   Match
+#   ConfirmedEventNotificationSummary
 #
 
 
 @bacpypes_debugging
-def Match(addr1, addr2):
-    """Return true iff addr1 matches addr2."""
-    if _debug:
-        Match._debug("Match %r %r", addr1, addr2)
-
-    if addr2.addrType == Address.localBroadcastAddr:
-        # match any local station
-        return (addr1.addrType == Address.localStationAddr) or (
-            addr1.addrType == Address.localBroadcastAddr
-        )
-    elif addr2.addrType == Address.localStationAddr:
-        # match a specific local station
-        return (addr1.addrType == Address.localStationAddr) and (
-            addr1.addrAddr == addr2.addrAddr
-        )
-    elif addr2.addrType == Address.remoteBroadcastAddr:
-        # match any remote station or remote broadcast on a matching network
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            or (addr1.addrType == Address.remoteBroadcastAddr)
-        ) and (addr1.addrNet == addr2.addrNet)
-    elif addr2.addrType == Address.remoteStationAddr:
-        # match a specific remote station
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            and (addr1.addrNet == addr2.addrNet)
-            and (addr1.addrAddr == addr2.addrAddr)
-        )
-    elif addr2.addrType == Address.globalBroadcastAddr:
-        # match a global broadcast address
-        return addr1.addrType == Address.globalBroadcastAddr
-    else:
-        raise RuntimeError("invalid match combination")
-
+class ConfirmedEventNotificationSummary(Tracer):
 
-#
-#   ConfirmedEventNotificationSummary
-#
+    # packets this tracer is interested in
+    pduTypes = (ConfirmedEventNotificationRequest, SimpleAckPDU)
 
+    # only the addresses and invoke ID are used, the decode cache has them
+    cacheable = True
 
-@bacpypes_debugging
-class ConfirmedEventNotificationSummary(Tracer):
     def __init__(self):
         if _debug:
             ConfirmedEventNotificationSummary._debug("__init__")
@@ -110,26 +77,11 @@ class ConfirmedEventNotificationSummary(Tracer):
             ConfirmedEventNotificationSummary._debug("Filter %r", pkt)
         global requests
 
-        # apply the filters
-        if filterSource:
-            if not Match(pkt.pduSource, filterSource):
-                if _debug:
-                    ConfirmedEventNotificationSummary._debug("    - source filter fail")
-                return
-        if filterDestination:
-            if not Match(pkt.pduDestination, filterDestination):
-                if _debug:
-                    ConfirmedEventNotificationSummary._debug(
-                        "    - destination filter fail"
-                    )
-                return
-        if filterHost:
-            if (not Match(pkt.pduSource, filterHost)) and (
-                not Match(pkt.pduDestination, filterHost)
-            ):
-                if _debug:
-                    ConfirmedEventNotificationSummary._debug("    - host filter fail")
-                return
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                ConfirmedEventNotificationSummary._debug("    - address filter fail")
+            return
 
         # check for notifications
         if isinstance(pkt, ConfirmedEventNotificationRequest):
@@ -164,65 +116,90 @@ class ConfirmedEventNotificationSummary(Tracer):
 
 
 #
-#   __main__
+#   configure
 #
 
-# parse the command line arguments
-parser = ArgumentParser(description=__doc__)
-parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
-parser.add_argument(
-    "-d", "--destination", nargs="?", type=str, help="destination address"
-)
-parser.add_argument("--host", nargs="?", type=str, help="source or destination")
-parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
-args = parser.parse_args()
-
-if _debug:
-    _log.debug("initialization")
-if _debug:
-    _log.debug("    - args: %r", args)
-
-# interpret the arguments
-if args.source:
-    filterSource = Address(args.source)
-    if _debug:
-        _log.debug("    - filterSource: %r", filterSource)
-if args.destination:
-    filterDestination = Address(args.destination)
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
     if _debug:
-        _log.debug("    - filterDestination: %r", filterDestination)
-if args.host:
-    filterHost = Address(args.host)
+        configure._debug("configure %r", args)
+    global filterAddress
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
     if _debug:
-        _log.debug("    - filterHost: %r", filterHost)
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+
+#
+#   report
+#
 
-# start out with no unmatched requests
-requests = {}
 
-# trace the file(s)
-for fname in args.pcap:
-    trace(fname, [ConfirmedEventNotificationSummary])
-
-# dump everything
-for msg in traffic:
-    req = msg.req
-    resp = msg.resp
-
-    if resp:
-        deltatime = "%8.2fms" % ((resp._timestamp - req._timestamp) * 1000,)
-    else:
-        deltatime = "-"
-
-    print(
-        "%s\t%s\t%s\t%8s\t%s\t%s\t%s\t%s"
-        % (
-            strftimestamp(req._timestamp),
-            req.pduSource,
-            resp.pduSource if resp else "-",
-            deltatime,
-            msg.retry if (msg.retry != 1) else "",
-            req.eventObjectIdentifier,
-            req.fromState,
-            req.toState,
+def report():
+    """Dump everything."""
+    for msg in traffic:
+        req = msg.req
+        resp = msg.resp
+
+        if resp:
+            deltatime = "%8.2fms" % ((resp._timestamp - req._timestamp) * 1000,)
+        else:
+            deltatime = "-"
+
+        print(
+            "%s\t%s\t%s\t%8s\t%s\t%s\t%s\t%s"
+            % (
+                strftimestamp(req._timestamp),
+                req.pduSource,
+                resp.pduSource if resp else "-",
+                deltatime,
+                msg.retry if (msg.retry != 1) else "",
+                req.eventObjectIdentifier,
+                req.fromState,
+                req.toState,
+            )
         )
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of decoding processes"
     )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    # interpret the arguments
+    configure(args)
+
+    # trace the file(s), decoding each one in parallel when there is more
+    # than one job
+    trace_ranges(
+        args.pcap, [ConfirmedEventNotificationSummary], args, args.jobs, report
+    )
+
+    # dump everything
+    report()
+
+
+if __name__ == "__main__":
+    main()
@@ -18,64 +18,24 @@ from collections import defaultdict
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
-from bacpypes.pdu import Address
-from bacpypes.analysis import trace, Tracer
+from bacpypes.analysis import Tracer
 from bacpypes.npdu import IAmRouterToNetwork
 
+from addrmatch import address_filter
+from parallel import trace_files
+from pcaptrace import add_arguments
+
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
 # globals
-filterSource = None
-filterDestination = None
-filterHost = None
+filterAddress = None
 
 # dictionary of requests
 requests = defaultdict(int)
 networks = defaultdict(list)
 
-#
-#   Match
-#
-
-
-@bacpypes_debugging
-def Match(addr1, addr2):
-    """Return true iff addr1 matches addr2."""
-    if _debug:
-        Match._debug("Match %r %r", addr1, addr2)
-
-    if addr2.addrType == Address.localBroadcastAddr:
-        # match any local station
-        return (addr1.addrType == Address.localStationAddr) or (
-            addr1.addrType == Address.localBroadcastAddr
-        )
-    elif addr2.addrType == Address.localStationAddr:
-        # match a specific local station
-        return (addr1.addrType == Address.localStationAddr) and (
-            addr1.addrAddr == addr2.addrAddr
-        )
-    elif addr2.addrType == Address.remoteBroadcastAddr:
-        # match any remote station or remote broadcast on a matching network
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            or (addr1.addrType == Address.remoteBroadcastAddr)
-        ) and (addr1.addrNet == addr2.addrNet)
-    elif addr2.addrType == Address.remoteStationAddr:
-        # match a specific remote station
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            and (addr1.addrNet == addr2.addrNet)
-            and (addr1.addrAddr == addr2.addrAddr)
-        )
-    elif addr2.addrType == Address.globalBroadcastAddr:
-        # match a global broadcast address
-        return addr1.addrType == Address.globalBroadcastAddr
-    else:
-        raise RuntimeError("invalid match combination")
-
-
 #
 #   IAmRouterToNetworkSummary
 #
@@ -83,6 +43,10 @@ def Match(addr1, addr2):
 
 @bacpypes_debugging
 class IAmRouterToNetworkSummary(Tracer):
+
+    # packets this tracer is interested in
+    pduTypes = (IAmRouterToNetwork,)
+
     def __init__(self):
         if _debug:
             IAmRouterToNetworkSummary._debug("__init__")
@@ -97,24 +61,11 @@ class IAmRouterToNetworkSummary(Tracer):
         if not isinstance(pkt, IAmRouterToNetwork):
             return
 
-        # apply the filters
-        if filterSource:
-            if not Match(pkt.pduSource, filterSource):
-                if _debug:
-                    IAmRouterToNetworkSummary._debug("    - source filter fail")
-                return
-        if filterDestination:
-            if not Match(pkt.pduDestination, filterDestination):
-                if _debug:
-                    IAmRouterToNetworkSummary._debug("    - destination filter fail")
-                return
-        if filterHost:
-            if (not Match(pkt.pduSource, filterHost)) and (
-                not Match(pkt.pduDestination, filterHost)
-            ):
-                if _debug:
-                    IAmRouterToNetworkSummary._debug("    - host filter fail")
-                return
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                IAmRouterToNetworkSummary._debug("    - address filter fail")
+            return
 
         # count it
         requests[pkt.pduSource] += 1
@@ -122,60 +73,107 @@ class IAmRouterToNetworkSummary(Tracer):
 
 
 #
-#   __main__
+#   configure
 #
 
-# parse the command line arguments
-parser = ArgumentParser(description=__doc__)
-parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
-parser.add_argument(
-    "-d", "--destination", nargs="?", type=str, help="destination address"
-)
-parser.add_argument("--host", nargs="?", type=str, help="source or destination")
-parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
-args = parser.parse_args()
-
-if _debug:
-    _log.debug("initialization")
-if _debug:
-    _log.debug("    - args: %r", args)
-
-# interpret the arguments
-if args.source:
-    filterSource = Address(args.source)
-    if _debug:
-        _log.debug("    - filterSource: %r", filterSource)
-if args.destination:
-    filterDestination = Address(args.destination)
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
     if _debug:
-        _log.debug("    - filterDestination: %r", filterDestination)
-if args.host:
-    filterHost = Address(args.host)
+        configure._debug("configure %r", args)
+    global filterAddress
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
     if _debug:
-        _log.debug("    - filterHost: %r", filterHost)
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+
+#
+#   state
+#
+
 
-# trace the file(s)
-for fname in args.pcap:
-    trace(fname, [IAmRouterToNetworkSummary])
+def state():
+    """Return the router counts and networks so they can be merged by another
+    process."""
+    return (requests, networks)
+
+
+def merge(partial):
+    """Add the router counts and networks from another process."""
+    partialRequests, partialNetworks = partial
+    for key, count in partialRequests.items():
+        requests[key] += count
+    for key, network_list in partialNetworks.items():
+        networks[key].extend(network_list)
+
+
+#
+#   report
+#
+
+
+def report():
+    """Print the routers and the networks they reference."""
+    # sort the result, descending order by count
+    items = sorted(requests.items(), key=lambda x: x[1], reverse=True)
+
+    # print everything out
+    print("%-20s %5s" % ("Address", "Count"))
+    for key, count in items:
+        print("%-20s %5d" % (key, count))
+
+        # count the number of times of each network
+        net_count = defaultdict(int)
+        for subnet_list in networks[key]:
+            for net in subnet_list:
+                net_count[net] += 1
+
+        # sort descending
+        net_count = sorted(net_count.items(), key=lambda x: x[1], reverse=True)
+
+        for net, count in net_count:
+            print("    %5d %5d" % (net, count))
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--checkpoint", type=str, help="file to save the results and positions in"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
 
-# sort the result, descending order by count
-items = requests.items()
-items.sort(key=lambda x: x[1], reverse=True)
+    # interpret the arguments
+    configure(args)
 
-# print everything out
-print("%-20s %5s" % ("Address", "Count"))
-for key, count in items:
-    print("%-20s %5d" % (key, count))
+    # trace the file(s), in parallel when there is more than one job
+    trace_files(args.pcap, [IAmRouterToNetworkSummary], args, args.jobs, report)
 
-    # count the number of times of each network
-    net_count = defaultdict(int)
-    for subnet_list in networks[key]:
-        for net in subnet_list:
-            net_count[net] += 1
+    # print everything out
+    report()
 
-    # sort descending
-    net_count = net_count.items()
-    net_count.sort(key=lambda x: x[1], reverse=True)
 
-    for net, count in net_count:
-        print("    %5d %5d" % (net, count))
+if __name__ == "__main__":
+    main()
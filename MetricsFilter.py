@@ -0,0 +1,424 @@
+#!/usr/bin/python
+
+"""
+This application counts the traffic that is interesting for monitoring the
+health of a BACnet network and prints the counters in the Prometheus text
+format: packets by source address, Read Property requests, retries, timeouts
+and the number still waiting for a response, Who-Is and I-Am requests, and
+COV notifications.  The counters only go up, so a monitoring system turns
+them into rates.
+
+With the --listen option the counters are also served on that port of
+localhost while the packets are being traced, which is most useful with a
+capture read from stdin or a named pipe, or with the WatchFilter application
+which has the same option.  A Read Property request that has not been
+answered after --timeout seconds of capture time is counted as a timeout.
+
+This application accepts the same --source, --destination, and --host options
+as the other filters, and accepts the debugging options of other BACpypes
+applications.
+"""
+
+import sys
+import asyncio
+import threading
+from collections import defaultdict, OrderedDict
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from bacpypes.analysis import Tracer
+from bacpypes.apdu import (
+    ReadPropertyRequest,
+    ReadPropertyACK,
+    WhoIsRequest,
+    IAmRequest,
+    ConfirmedCOVNotificationRequest,
+    UnconfirmedCOVNotificationRequest,
+)
+
+from addrmatch import address_filter
+from parallel import trace_files
+from pcaptrace import add_arguments
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+filterAddress = None
+
+# seconds of capture time to wait for a response
+timeout = 10.0
+
+# the tracer and the server share the counters
+lock = threading.Lock()
+
+# packets by source address
+packets = defaultdict(int)
+
+# (metric name, label value) to count
+counters = defaultdict(int)
+
+# pending Read Property requests and the time they were last sent
+requests = OrderedDict()
+
+# the time of the latest packet
+last_time = None
+
+# the first Read Property request or ACK for each (client, server, invoke
+# ID) as (kind, time, latest packet time up to it), these may be for the
+# requests from a file traced by another process, and there are at most 256
+# for each client and server
+first_seen = {}
+
+# metric name, type, help, and label name or None
+metrics = (
+    ("bacnet_packets_total", "counter", "Packets by source address.", "source"),
+    (
+        "bacnet_readproperty_requests_total",
+        "counter",
+        "Read Property requests, not counting retries.",
+        None,
+    ),
+    ("bacnet_readproperty_retries_total", "counter", "Read Property retries.", None),
+    (
+        "bacnet_readproperty_timeouts_total",
+        "counter",
+        "Read Property requests that were not answered.",
+        None,
+    ),
+    (
+        "bacnet_readproperty_outstanding",
+        "gauge",
+        "Read Property requests waiting for a response.",
+        None,
+    ),
+    ("bacnet_whois_total", "counter", "Who-Is requests.", None),
+    ("bacnet_iam_total", "counter", "I-Am requests.", None),
+    (
+        "bacnet_cov_notifications_total",
+        "counter",
+        "COV notifications by service.",
+        "service",
+    ),
+)
+
+#
+#   MetricsTracer
+#
+
+
+@bacpypes_debugging
+class MetricsTracer(Tracer):
+
+    # only the addresses, invoke ID and timestamp are used
+    cacheable = True
+
+    def __init__(self):
+        if _debug:
+            MetricsTracer._debug("__init__")
+        Tracer.__init__(self, self.Filter)
+
+    def Filter(self, pkt):
+        if _debug:
+            MetricsTracer._debug("Filter %r", pkt)
+
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                MetricsTracer._debug("    - address filter fail")
+            return
+
+        global last_time
+
+        with lock:
+            packets[pkt.pduSource] += 1
+            if (last_time is None) or (pkt._timestamp > last_time):
+                last_time = pkt._timestamp
+
+            # time has moved on, the older requests may have timed out
+            while requests:
+                key, last = next(iter(requests.items()))
+                if last + timeout > pkt._timestamp:
+                    break
+                del requests[key]
+                counters["bacnet_readproperty_timeouts_total", None] += 1
+
+            if isinstance(pkt, ReadPropertyRequest):
+                key = (pkt.pduSource, pkt.pduDestination, pkt.apduInvokeID)
+                if key not in first_seen:
+                    first_seen[key] = ("request", pkt._timestamp, last_time)
+
+                if key in requests:
+                    counters["bacnet_readproperty_retries_total", None] += 1
+                    del requests[key]
+                else:
+                    counters["bacnet_readproperty_requests_total", None] += 1
+                requests[key] = pkt._timestamp
+
+            elif isinstance(pkt, ReadPropertyACK):
+                key = (pkt.pduDestination, pkt.pduSource, pkt.apduInvokeID)
+                if key not in first_seen:
+                    first_seen[key] = ("ack", pkt._timestamp, last_time)
+
+                requests.pop(key, None)
+
+            elif isinstance(pkt, WhoIsRequest):
+                counters["bacnet_whois_total", None] += 1
+
+            elif isinstance(pkt, IAmRequest):
+                counters["bacnet_iam_total", None] += 1
+
+            elif isinstance(pkt, ConfirmedCOVNotificationRequest):
+                counters["bacnet_cov_notifications_total", "confirmed"] += 1
+
+            elif isinstance(pkt, UnconfirmedCOVNotificationRequest):
+                counters["bacnet_cov_notifications_total", "unconfirmed"] += 1
+
+
+#
+#   configure
+#
+
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
+    if _debug:
+        configure._debug("configure %r", args)
+    global filterAddress, timeout
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
+    if _debug:
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+    # the other applications do not have this option
+    timeout = getattr(args, "timeout", None) or timeout
+
+
+#
+#   state
+#
+
+
+def state():
+    """Return the counters and pending requests so they can be merged by
+    another process."""
+    return (packets, counters, requests, first_seen, last_time)
+
+
+def merge(partial):
+    """Add the counters and pending requests from another process that
+    traced the packets that come after these.  The requests that are still
+    pending here are answered, retried, or timed out by the packets of the
+    other process just as if they had been traced here."""
+    global last_time
+
+    (
+        partial_packets,
+        partial_counters,
+        partial_requests,
+        partial_first_seen,
+        partial_last_time,
+    ) = partial
+
+    with lock:
+        for source, count in partial_packets.items():
+            packets[source] += count
+        for key, count in partial_counters.items():
+            counters[key] += count
+
+        pending = []
+        for key, last in requests.items():
+            deadline = last + timeout
+
+            # the first time it comes up there, unless it timed out before
+            kind, when, latest = partial_first_seen.get(key, (None, None, None))
+            if (kind is not None) and (latest < deadline):
+                # the other process counted the retry as a new request, it
+                # is pending there if it has not been answered
+                if kind == "request":
+                    counters["bacnet_readproperty_requests_total", None] -= 1
+                    counters["bacnet_readproperty_retries_total", None] += 1
+            elif (partial_last_time is not None) and (partial_last_time >= deadline):
+                counters["bacnet_readproperty_timeouts_total", None] += 1
+            else:
+                pending.append((last, key))
+
+        # keep the pending requests in time order for the timeouts
+        pending.extend((last, key) for key, last in partial_requests.items())
+        pending.sort(key=lambda item: item[0])
+
+        requests.clear()
+        for last, key in pending:
+            requests[key] = last
+
+        if (partial_last_time is not None) and (
+            (last_time is None) or (partial_last_time > last_time)
+        ):
+            last_time = partial_last_time
+
+
+#
+#   exposition
+#
+
+
+def escape(value):
+    """Escape a label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def exposition():
+    """Return the counters in the Prometheus text format."""
+    with lock:
+        values = dict(counters)
+        values["bacnet_readproperty_outstanding", None] = len(requests)
+        sources = dict(packets)
+
+    lines = []
+    for name, kind, text, label in metrics:
+        lines.append("# HELP %s %s" % (name, text))
+        lines.append("# TYPE %s %s" % (name, kind))
+
+        if name == "bacnet_packets_total":
+            samples = sorted((str(source), count) for source, count in sources.items())
+        else:
+            samples = sorted(
+                (label_value, count)
+                for (metric, label_value), count in values.items()
+                if metric == name
+            )
+            if (not samples) and (label is None):
+                samples = [(None, 0)]
+
+        for label_value, count in samples:
+            if label is None:
+                lines.append("%s %d" % (name, count))
+            else:
+                lines.append(
+                    '%s{%s="%s"} %d' % (name, label, escape(label_value), count)
+                )
+
+    return "\n".join(lines) + "\n"
+
+
+#
+#   report
+#
+
+
+def report():
+    """Print the counters."""
+    sys.stdout.write(exposition())
+
+
+#
+#   serve
+#
+
+
+async def handle_request(reader, writer):
+    """Answer one HTTP request, the counters are at /metrics."""
+    try:
+        request = await reader.readline()
+
+        # skip the headers
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+        parts = request.split()
+        if (
+            (len(parts) >= 2)
+            and (parts[0] == b"GET")
+            and (parts[1].split(b"?")[0] == b"/metrics")
+        ):
+            status = "200 OK"
+            body = exposition().encode()
+        else:
+            status = "404 Not Found"
+            body = b"not found\n"
+
+        writer.write(
+            (
+                "HTTP/1.0 %s\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                "Content-Length: %d\r\n"
+                "\r\n" % (status, len(body))
+            ).encode()
+            + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+@bacpypes_debugging
+def serve(port, host="127.0.0.1"):
+    """Serve the counters from a thread running an event loop, and return the
+    server.  The port is bound before returning so an error is raised here."""
+    if _debug:
+        serve._debug("serve %r %r", port, host)
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(handle_request, host, port))
+
+    thread = threading.Thread(target=loop.run_forever, name="metrics", daemon=True)
+    thread.start()
+
+    return server
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "-t", "--timeout", type=float, help="seconds to wait for a response"
+    )
+    parser.add_argument(
+        "--listen", type=int, help="serve the counters on this port of localhost"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--checkpoint", type=str, help="file to save the results and positions in"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    # interpret the arguments
+    configure(args)
+
+    # serve the counters as they change
+    if args.listen:
+        serve(args.listen)
+
+    # trace the file(s), in parallel when there is more than one job
+    trace_files(args.pcap, [MetricsTracer], args, args.jobs, report)
+
+    # print the counters
+    report()
+
+
+if __name__ == "__main__":
+    main()
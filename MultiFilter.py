@@ -0,0 +1,194 @@
+#!/usr/bin/python
+
+"""
+This application runs several of the other analyzers over the same PCAP
+files in a single pass, so each packet is read and decoded once no matter how
+many reports are being generated.  Name the analyzers with the --analyzer
+option (it may be given more than once), and when all of the files have been
+traced each of the analyzer reports is printed, or written to a file per
+analyzer in the --output directory.  With the --jobs option the files are
+traced by a pool of worker processes when all of the analyzers can merge
+their counters, otherwise ranges of each file are decoded in parallel.
+
+This application accepts the same --source, --destination, and --host options
+as the other filters, and accepts the debugging options of other BACpypes
+applications.
+"""
+
+import os
+import sys
+import importlib
+import functools
+import contextlib
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from parallel import trace_files, trace_ranges
+from pcaptrace import add_arguments
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# analyzer name, module name, tracer class name
+analyzers = {
+    "address": ("AddressFilter", "AddressFilterTracer"),
+    "cov": ("COVNotificationSummaryFilter", "COVNotificationSummary"),
+    "event": ("EventNotificationSummaryFilter", "ConfirmedEventNotificationSummary"),
+    "iamrouter": ("IAmRouterToNetworkSummaryFilter", "IAmRouterToNetworkSummary"),
+    "metrics": ("MetricsFilter", "MetricsTracer"),
+    "pdus": ("PDUsPerMinuteFilter", "PDUsPerMinuteTracer"),
+    "readproperty": ("ReadPropertySummaryFilter", "ReadPropertySummary"),
+    "storm": ("BroadcastStormFilter", "BroadcastStorm"),
+    "timeout": ("ReadPropertyTimeoutFilter", "ReadPropertySummary"),
+    "transactions": ("TransactionSummaryFilter", "TransactionSummary"),
+    "device": ("WhoIsIAmDeviceFilter", "WhoIsIAmDevice"),
+    "whois": ("WhoIsIAmSummaryFilter", "WhoIsIAmSummary"),
+    "whoisrouter": ("WhoIsRouterToNetworkSummaryFilter", "WhoIsRouterToNetworkSummary"),
+}
+
+#
+#   load_analyzers
+#
+
+
+@bacpypes_debugging
+def load_analyzers(names, args):
+    """Import the analyzer modules, configure them from the command line
+    arguments, and return a list of (name, module, tracer class) tuples."""
+    if _debug:
+        load_analyzers._debug("load_analyzers %r %r", names, args)
+
+    loaded = []
+    for name in names:
+        module_name, tracer_name = analyzers[name]
+
+        module = importlib.import_module(module_name)
+        module.configure(args)
+
+        loaded.append((name, module, getattr(module, tracer_name)))
+        if _debug:
+            load_analyzers._debug("    - loaded: %r", module)
+
+    return loaded
+
+
+#
+#   write_reports
+#
+
+
+@bacpypes_debugging
+def write_reports(loaded, output=None):
+    """Write the report of each analyzer, to stdout or to a file per
+    analyzer in the output directory."""
+    if _debug:
+        write_reports._debug("write_reports %r %r", loaded, output)
+
+    for name, module, tracer in loaded:
+        # some analyzers print as they go and have no report
+        if not hasattr(module, "report"):
+            continue
+
+        if output:
+            fname = os.path.join(output, name + ".txt")
+            if _debug:
+                write_reports._debug("    - fname: %r", fname)
+
+            with open(fname, "w") as f:
+                with contextlib.redirect_stdout(f):
+                    module.report()
+        else:
+            print("----- %s -----" % (name,))
+            print("")
+            module.report()
+            print("")
+
+        sys.stdout.flush()
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-a",
+        "--analyzer",
+        action="append",
+        choices=sorted(analyzers),
+        required=True,
+        help="analyzer to run",
+    )
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "-i", "--interval", type=int, default=60, help="pdus interval in seconds"
+    )
+    parser.add_argument(
+        "--device",
+        nargs=1,
+        type=str,
+        help="device identifier, comma separated list, or file of them",
+    )
+    parser.add_argument("-o", "--output", type=str, help="report directory")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--checkpoint", type=str, help="file to save the results and positions in"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    # the device analyzer needs something to look for
+    if ("device" in args.analyzer) and (not args.device):
+        parser.error("the device analyzer requires --device")
+
+    # each analyzer only once, in the order given
+    names = []
+    for name in args.analyzer:
+        if name not in names:
+            names.append(name)
+
+    # make sure there is some place to put the reports
+    if args.output and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    # interpret the arguments
+    loaded = load_analyzers(names, args)
+    tracers = [tracer for name, module, tracer in loaded]
+    mergeable = all(hasattr(module, "merge") for name, module, tracer in loaded)
+
+    # the results of the other analyzers cannot be saved
+    if args.checkpoint and not mergeable:
+        parser.error("--checkpoint requires analyzers that can be merged")
+
+    # trace the file(s), every packet is decoded once and given to each tracer,
+    # in parallel by file when the results can be merged, otherwise by
+    # decoding ranges of each file in parallel
+    report = functools.partial(write_reports, loaded, args.output)
+    if mergeable:
+        trace_files(args.pcap, tracers, args, args.jobs, report)
+    else:
+        trace_ranges(args.pcap, tracers, args, args.jobs, report)
+
+    # dump the reports
+    write_reports(loaded, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,8 +15,11 @@ from collections import defaultdict
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
-from bacpypes.pdu import Address
-from bacpypes.analysis import trace, strftimestamp, Tracer
+from bacpypes.analysis import strftimestamp, Tracer
+
+from addrmatch import address_filter
+from parallel import trace_files
+from pcaptrace import add_arguments
 
 # some debugging
 _debug = 0
@@ -24,52 +27,10 @@ _log = ModuleLogger(globals())
 
 # globals
 counter = defaultdict(int)
+interval = 60
 
 # globals
-filterSource = None
-filterDestination = None
-filterHost = None
-
-#
-#   Match
-#
-
-
-@bacpypes_debugging
-def Match(addr1, addr2):
-    """Return true iff addr1 matches addr2."""
-    if _debug:
-        Match._debug("Match %r %r", addr1, addr2)
-
-    if addr2.addrType == Address.localBroadcastAddr:
-        # match any local station
-        return (addr1.addrType == Address.localStationAddr) or (
-            addr1.addrType == Address.localBroadcastAddr
-        )
-    elif addr2.addrType == Address.localStationAddr:
-        # match a specific local station
-        return (addr1.addrType == Address.localStationAddr) and (
-            addr1.addrAddr == addr2.addrAddr
-        )
-    elif addr2.addrType == Address.remoteBroadcastAddr:
-        # match any remote station or remote broadcast on a matching network
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            or (addr1.addrType == Address.remoteBroadcastAddr)
-        ) and (addr1.addrNet == addr2.addrNet)
-    elif addr2.addrType == Address.remoteStationAddr:
-        # match a specific remote station
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            and (addr1.addrNet == addr2.addrNet)
-            and (addr1.addrAddr == addr2.addrAddr)
-        )
-    elif addr2.addrType == Address.globalBroadcastAddr:
-        # match a global broadcast address
-        return addr1.addrType == Address.globalBroadcastAddr
-    else:
-        raise RuntimeError("invalid match combination")
-
+filterAddress = None
 
 #
 #   PDUsPerMinuteTracer
@@ -78,6 +39,10 @@ def Match(addr1, addr2):
 
 @bacpypes_debugging
 class PDUsPerMinuteTracer(Tracer):
+
+    # only the addresses and timestamp are used, the decode cache has them
+    cacheable = True
+
     def __init__(self):
         if _debug:
             PDUsPerMinuteTracer._debug("__init__")
@@ -87,27 +52,14 @@ class PDUsPerMinuteTracer(Tracer):
         if _debug:
             PDUsPerMinuteTracer._debug("Filter %r", pkt)
 
-        # apply the filters
-        if filterSource:
-            if not Match(pkt.pduSource, filterSource):
-                if _debug:
-                    PDUsPerMinuteTracer._debug("    - source filter fail")
-                return
-        if filterDestination:
-            if not Match(pkt.pduDestination, filterDestination):
-                if _debug:
-                    PDUsPerMinuteTracer._debug("    - destination filter fail")
-                return
-        if filterHost:
-            if (not Match(pkt.pduSource, filterHost)) and (
-                not Match(pkt.pduDestination, filterHost)
-            ):
-                if _debug:
-                    PDUsPerMinuteTracer._debug("    - host filter fail")
-                return
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                PDUsPerMinuteTracer._debug("    - address filter fail")
+            return
 
         # passed all the filter tests
-        slot = (int(pkt._timestamp) / interval) * interval
+        slot = (int(pkt._timestamp) // interval) * interval
         if _debug:
             PDUsPerMinuteTracer._debug("    - slot: %r", slot)
 
@@ -116,48 +68,95 @@ class PDUsPerMinuteTracer(Tracer):
 
 
 #
-#   __main__
+#   configure
 #
 
-# parse the command line arguments
-parser = ArgumentParser(description=__doc__)
-parser.add_argument(
-    "-i", "--interval", nargs=1, type=int, default=60, help="interval in seconds"
-)
-parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
-parser.add_argument(
-    "-d", "--destination", nargs="?", type=str, help="destination address"
-)
-parser.add_argument("--host", nargs="?", type=str, help="source or destination")
-parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
-args = parser.parse_args()
-
-if _debug:
-    _log.debug("initialization")
-if _debug:
-    _log.debug("    - args: %r", args)
-
-# interpret the arguments
-if args.source:
-    filterSource = Address(args.source)
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
+    if _debug:
+        configure._debug("configure %r", args)
+    global filterAddress, interval
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
     if _debug:
-        _log.debug("    - filterSource: %r", filterSource)
-if args.destination:
-    filterDestination = Address(args.destination)
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+    # share the interval
+    interval = args.interval
+
+
+#
+#   state
+#
+
+
+def state():
+    """Return the counters so they can be merged by another process."""
+    return counter
+
+
+def merge(partial):
+    """Add the counters from another process."""
+    for slot, count in partial.items():
+        counter[slot] += count
+
+
+#
+#   report
+#
+
+
+def report():
+    """Dump the counters."""
+    if not counter:
+        return
+
+    for ts in range(min(counter), max(counter) + 1, interval):
+        print("%s\t%d" % (strftimestamp(ts), counter[ts]))
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-i", "--interval", type=int, default=60, help="interval in seconds"
+    )
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--checkpoint", type=str, help="file to save the results and positions in"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
     if _debug:
-        _log.debug("    - filterDestination: %r", filterDestination)
-if args.host:
-    filterHost = Address(args.host)
+        _log.debug("initialization")
     if _debug:
-        _log.debug("    - filterHost: %r", filterHost)
+        _log.debug("    - args: %r", args)
+
+    # interpret the arguments
+    configure(args)
+
+    # trace the file(s), in parallel when there is more than one job
+    trace_files(args.pcap, [PDUsPerMinuteTracer], args, args.jobs, report)
 
-# share the interval
-interval = args.interval
+    # dump the counters
+    report()
 
-# trace the file(s)
-for fname in args.pcap:
-    trace(fname, [PDUsPerMinuteTracer])
 
-# dump the counters
-for ts in range(min(counter), max(counter) + 1, interval):
-    print("%s\t%d" % (strftimestamp(ts), counter[ts]))
+if __name__ == "__main__":
+    main()
@@ -7,27 +7,38 @@ finding missing requests and looking at the variation in response times which
 might be an indication of a network that intermittently fails or is
 saturated.
 
+On a large capture the list is too long to read, with the --summary option
+the response times are kept in a sketch for each client and server pair and
+the report has the number of requests, retries, and timeouts, and the 50th,
+95th, and 99th percentile and the maximum response time for each pair and
+for each server.  A request that is not answered within the --timeout (ten
+seconds by default) is counted as a timeout.
+
 This application accepts the same --source, --destination, and --host options
 as the other filters, and accepts the debugging options of other BACpypes
 applications.
 """
 
+from collections import defaultdict
+
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
-from bacpypes.pdu import Address
-from bacpypes.analysis import trace, strftimestamp, Tracer
+from bacpypes.analysis import strftimestamp, Tracer
 from bacpypes.apdu import ReadPropertyRequest, ReadPropertyACK
 
+from addrmatch import address_filter
+from parallel import trace_ranges
+from pcaptrace import add_arguments
+from sketch import LatencySketch
+from transactions import TransactionEngine
+
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
 # globals
-filterSource = None
-filterDestination = None
-filterHost = None
-filterEval = None
+filterAddress = None
 
 # dictionary of pending requests
 requests = {}
@@ -35,6 +46,18 @@ requests = {}
 # all traffic
 traffic = []
 
+# seconds of capture time to wait for a response in a summary
+timeout = 10.0
+
+# matches the requests and responses for a summary
+engine = None
+
+# (client, server) to the summary of the pair
+pairs = {}
+
+# percentiles in a summary
+percentiles = (0.50, 0.95, 0.99)
+
 #
 #   Traffic
 #
@@ -50,44 +73,34 @@ class Traffic:
 
 
 #
-#   Match
+#   PairSummary
 #
 
 
-@bacpypes_debugging
-def Match(addr1, addr2):
-    """Return true iff addr1 matches addr2."""
-    if _debug:
-        Match._debug("Match %r %r", addr1, addr2)
+class PairSummary:
+    def __init__(self):
+        self.sketch = LatencySketch()
+        self.retries = 0
+        self.timeouts = 0
 
-    if addr2.addrType == Address.localBroadcastAddr:
-        # match any local station
-        return (addr1.addrType == Address.localStationAddr) or (
-            addr1.addrType == Address.localBroadcastAddr
-        )
-    elif addr2.addrType == Address.localStationAddr:
-        # match a specific local station
-        return (addr1.addrType == Address.localStationAddr) and (
-            addr1.addrAddr == addr2.addrAddr
-        )
-    elif addr2.addrType == Address.remoteBroadcastAddr:
-        # match any remote station or remote broadcast on a matching network
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            or (addr1.addrType == Address.remoteBroadcastAddr)
-        ) and (addr1.addrNet == addr2.addrNet)
-    elif addr2.addrType == Address.remoteStationAddr:
-        # match a specific remote station
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            and (addr1.addrNet == addr2.addrNet)
-            and (addr1.addrAddr == addr2.addrAddr)
-        )
-    elif addr2.addrType == Address.globalBroadcastAddr:
-        # match a global broadcast address
-        return addr1.addrType == Address.globalBroadcastAddr
+
+#
+#   completed
+#
+
+
+def completed(txn):
+    """Add a finished transaction to the summary of its client and server."""
+    key = (txn.req.pduSource, txn.req.pduDestination)
+    pair = pairs.get(key)
+    if pair is None:
+        pair = pairs[key] = PairSummary()
+
+    pair.retries += txn.retry - 1
+    if txn.resp:
+        pair.sketch.add(txn.latency)
     else:
-        raise RuntimeError("invalid match combination")
+        pair.timeouts += 1
 
 
 #
@@ -97,6 +110,13 @@ def Match(addr1, addr2):
 
 @bacpypes_debugging
 class ReadPropertySummary(Tracer):
+
+    # packets this tracer is interested in
+    pduTypes = (ReadPropertyRequest, ReadPropertyACK)
+
+    # only the addresses and invoke ID are used, the decode cache has them
+    cacheable = True
+
     def __init__(self):
         if _debug:
             ReadPropertySummary._debug("__init__")
@@ -107,35 +127,16 @@ class ReadPropertySummary(Tracer):
             ReadPropertySummary._debug("Filter %r", pkt)
         global requests
 
-        # apply the filters
-        if filterSource:
-            if not Match(pkt.pduSource, filterSource):
-                if _debug:
-                    ReadPropertySummary._debug("    - source filter fail")
-                return
-        if filterDestination:
-            if not Match(pkt.pduDestination, filterDestination):
-                if _debug:
-                    ReadPropertySummary._debug("    - destination filter fail")
-                return
-        if filterHost:
-            if (not Match(pkt.pduSource, filterHost)) and (
-                not Match(pkt.pduDestination, filterHost)
-            ):
-                if _debug:
-                    ReadPropertySummary._debug("    - host filter fail")
-                return
-        if filterEval:
-            try:
-                matches = eval(filterEval, {"pkt": pkt})
-                if not matches:
-                    if _debug:
-                        ReadPropertySummary._debug("    - eval filter fail")
-                    return
-            except:
-                if _debug:
-                    ReadPropertySummary._debug("    - eval filter massive fail")
-                return
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                ReadPropertySummary._debug("    - address filter fail")
+            return
+
+        # summaries only keep the pending requests
+        if engine:
+            engine.process(pkt)
+            return
 
         # check for reads
         if isinstance(pkt, ReadPropertyRequest):
@@ -168,70 +169,195 @@ class ReadPropertySummary(Tracer):
 
 
 #
-#   __main__
+#   configure
 #
 
-# parse the command line arguments
-parser = ArgumentParser(description=__doc__)
-parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
-parser.add_argument(
-    "-d", "--destination", nargs="?", type=str, help="destination address"
-)
-parser.add_argument("--host", nargs="?", type=str, help="source or destination")
-parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
-args = parser.parse_args()
-
-if _debug:
-    _log.debug("initialization")
-if _debug:
-    _log.debug("    - args: %r", args)
-
-# interpret the arguments
-if args.source:
-    filterSource = Address(args.source)
-    if _debug:
-        _log.debug("    - filterSource: %r", filterSource)
-if args.destination:
-    filterDestination = Address(args.destination)
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
     if _debug:
-        _log.debug("    - filterDestination: %r", filterDestination)
-if args.host:
-    filterHost = Address(args.host)
+        configure._debug("configure %r", args)
+    global filterAddress, timeout, engine
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
     if _debug:
-        _log.debug("    - filterHost: %r", filterHost)
+        configure._debug("    - filterAddress: %r", filterAddress)
 
-# start out with no unmatched requests
-requests = {}
+    # the other applications do not have these options
+    if getattr(args, "summary", False):
+        timeout = getattr(args, "timeout", None) or timeout
+        engine = TransactionEngine(completed, timeout)
 
-# trace the file(s)
-for fname in args.pcap:
-    trace(fname, [ReadPropertySummary])
 
-# dump everything
-for msg in traffic:
-    req = msg.req
-    resp = msg.resp
+#
+#   report
+#
+
+
+def report():
+    """Dump everything."""
+    if engine:
+        report_summary()
+        return
+
+    for msg in traffic:
+        req = msg.req
+        resp = msg.resp
+
+        if resp:
+            deltatime = (resp._timestamp - req._timestamp) * 1000
+            print(
+                "%s\t%s\t%s\t%6.2fms\t%s"
+                % (
+                    strftimestamp(req._timestamp),
+                    req.pduSource,
+                    resp.pduSource,
+                    deltatime,
+                    msg.retry if (msg.retry != 1) else "",
+                )
+            )
+        else:
+            print(
+                "%s\t%s\t%s\t%6.2fms\t%s"
+                % (
+                    strftimestamp(req._timestamp),
+                    req.pduSource,
+                    "-",
+                    0,
+                    msg.retry if (msg.retry != 1) else "",
+                )
+            )
+
+
+def summary_line(name, count, retries, timeouts, pending, sketch):
+    """Return a line of the summary."""
+    times = sketch.quantiles(percentiles) + [sketch.maximum]
+    return "%-40s %7d %7d %8d %7d %s" % (
+        name,
+        count,
+        retries,
+        timeouts,
+        pending,
+        " ".join(
+            "%9s" % ("-",) if value is None else "%9.2f" % (value * 1000,)
+            for value in times
+        ),
+    )
+
+
+def report_summary():
+    """Dump the summary of each client and server pair, and each server."""
+    # requests that are still waiting are counted but not summarized
+    pending = defaultdict(int)
+    for (client, server, invoke_id), txn in engine.pending.items():
+        pending[client, server] += 1
+
+    header = "%-40s %7s %7s %8s %7s %s" % (
+        "",
+        "count",
+        "retries",
+        "timeouts",
+        "pending",
+        " ".join(
+            "%9s" % (name,)
+            for name in ["p%d ms" % (p * 100,) for p in percentiles] + ["max ms"]
+        ),
+    )
+
+    print("----- Client and server pairs -----")
+    print("")
+    print(header)
+
+    servers = {}
+    server_pending = defaultdict(int)
+    for key in sorted(set(pairs) | set(pending), key=lambda x: (str(x[0]), str(x[1]))):
+        pair = pairs.get(key) or PairSummary()
+        client, server = key
 
-    if resp:
-        deltatime = (resp._timestamp - req._timestamp) * 1000
         print(
-            "%s\t%s\t%s\t%6.2fms\t%s"
-            % (
-                strftimestamp(req._timestamp),
-                req.pduSource,
-                resp.pduSource,
-                deltatime,
-                msg.retry if (msg.retry != 1) else "",
+            summary_line(
+                "%s -> %s" % (client, server),
+                pair.sketch.count + pair.timeouts,
+                pair.retries,
+                pair.timeouts,
+                pending[key],
+                pair.sketch,
             )
         )
-    else:
+
+        # add the pair to the server
+        server_pair = servers.get(server)
+        if server_pair is None:
+            server_pair = servers[server] = PairSummary()
+        server_pair.sketch.merge(pair.sketch)
+        server_pair.retries += pair.retries
+        server_pair.timeouts += pair.timeouts
+        server_pending[server] += pending[key]
+    print("")
+
+    print("----- Servers -----")
+    print("")
+    print(header)
+
+    for server in sorted(servers, key=str):
+        pair = servers[server]
         print(
-            "%s\t%s\t%s\t%6.2fms\t%s"
-            % (
-                strftimestamp(req._timestamp),
-                req.pduSource,
-                "-",
-                0,
-                msg.retry if (msg.retry != 1) else "",
+            summary_line(
+                str(server),
+                pair.sketch.count + pair.timeouts,
+                pair.retries,
+                pair.timeouts,
+                server_pending[server],
+                pair.sketch,
             )
         )
+    print("")
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="summarize the response times of each client and server",
+    )
+    parser.add_argument(
+        "-t", "--timeout", type=float, help="seconds to wait for a response"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of decoding processes"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    # interpret the arguments
+    configure(args)
+
+    # trace the file(s), decoding each one in parallel when there is more
+    # than one job
+    trace_ranges(args.pcap, [ReadPropertySummary], args, args.jobs, report)
+
+    # dump everything
+    report()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,29 +8,43 @@ is typically used with a capture file on a client device, it can also be given
 network capture files to see if the request timeouts are happening at the same
 time with multiple clients.
 
+With the --timeout option the requests are not kept until the end, instead
+each one is printed as soon as it has gone unanswered for that many seconds
+after it was sent (or last retried), and answered requests are forgotten.
+This is for long captures where keeping all of the traffic would take too
+much memory, the lines are in the order the requests timed out rather than
+the order they were sent.
+
 This application accepts the same --source, --destination, and --host options
 as the other filters, and accepts the debugging options of other BACpypes
 applications.
 """
 
+import sys
+from collections import OrderedDict
+
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
-from bacpypes.pdu import Address
-from bacpypes.analysis import trace, strftimestamp, Tracer
+from bacpypes.analysis import strftimestamp, Tracer
 from bacpypes.apdu import ReadPropertyRequest, ReadPropertyACK
 
+from addrmatch import address_filter
+from parallel import trace_ranges
+from pcaptrace import add_arguments
+
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
 # globals
-filterSource = None
-filterDestination = None
-filterHost = None
+filterAddress = None
 
-# dictionary of pending requests
-requests = {}
+# seconds to wait for a response in streaming mode
+timeout = None
+
+# dictionary of pending requests, oldest first
+requests = OrderedDict()
 
 # all traffic
 traffic = []
@@ -46,48 +60,33 @@ class Traffic:
         self.resp = None
 
         self.ts = req._timestamp
+        self.last = req._timestamp
         self.retry = 1
 
 
 #
-#   Match
+#   expire
 #
 
 
 @bacpypes_debugging
-def Match(addr1, addr2):
-    """Return true iff addr1 matches addr2."""
+def expire(now):
+    """Print and forget the pending requests that have not been answered
+    within the timeout."""
     if _debug:
-        Match._debug("Match %r %r", addr1, addr2)
+        expire._debug("expire %r", now)
 
-    if addr2.addrType == Address.localBroadcastAddr:
-        # match any local station
-        return (addr1.addrType == Address.localStationAddr) or (
-            addr1.addrType == Address.localBroadcastAddr
-        )
-    elif addr2.addrType == Address.localStationAddr:
-        # match a specific local station
-        return (addr1.addrType == Address.localStationAddr) and (
-            addr1.addrAddr == addr2.addrAddr
-        )
-    elif addr2.addrType == Address.remoteBroadcastAddr:
-        # match any remote station or remote broadcast on a matching network
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            or (addr1.addrType == Address.remoteBroadcastAddr)
-        ) and (addr1.addrNet == addr2.addrNet)
-    elif addr2.addrType == Address.remoteStationAddr:
-        # match a specific remote station
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            and (addr1.addrNet == addr2.addrNet)
-            and (addr1.addrAddr == addr2.addrAddr)
-        )
-    elif addr2.addrType == Address.globalBroadcastAddr:
-        # match a global broadcast address
-        return addr1.addrType == Address.globalBroadcastAddr
-    else:
-        raise RuntimeError("invalid match combination")
+    while requests:
+        key, msg = next(iter(requests.items()))
+        if msg.last + timeout > now:
+            break
+        if _debug:
+            expire._debug("    - timeout: %r", key)
+
+        del requests[key]
+        print_request(msg)
+
+    sys.stdout.flush()
 
 
 #
@@ -97,6 +96,13 @@ def Match(addr1, addr2):
 
 @bacpypes_debugging
 class ReadPropertySummary(Tracer):
+
+    # packets this tracer is interested in
+    pduTypes = (ReadPropertyRequest, ReadPropertyACK)
+
+    # only the addresses and invoke ID are used, the decode cache has them
+    cacheable = True
+
     def __init__(self):
         if _debug:
             ReadPropertySummary._debug("__init__")
@@ -107,24 +113,15 @@ class ReadPropertySummary(Tracer):
             ReadPropertySummary._debug("Filter %r", pkt)
         global requests
 
-        # apply the filters
-        if filterSource:
-            if not Match(pkt.pduSource, filterSource):
-                if _debug:
-                    ReadPropertySummary._debug("    - source filter fail")
-                return
-        if filterDestination:
-            if not Match(pkt.pduDestination, filterDestination):
-                if _debug:
-                    ReadPropertySummary._debug("    - destination filter fail")
-                return
-        if filterHost:
-            if (not Match(pkt.pduSource, filterHost)) and (
-                not Match(pkt.pduDestination, filterHost)
-            ):
-                if _debug:
-                    ReadPropertySummary._debug("    - host filter fail")
-                return
+        # time has moved on, the older requests may have timed out
+        if timeout is not None:
+            expire(pkt._timestamp)
+
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                ReadPropertySummary._debug("    - address filter fail")
+            return
 
         # check for reads
         if isinstance(pkt, ReadPropertyRequest):
@@ -132,13 +129,17 @@ class ReadPropertySummary(Tracer):
             if key in requests:
                 if _debug:
                     ReadPropertySummary._debug("    - retry")
-                requests[key].retry += 1
+                msg = requests[key]
+                msg.retry += 1
+                msg.last = pkt._timestamp
+                requests.move_to_end(key)
             else:
                 if _debug:
                     ReadPropertySummary._debug("    - new request")
                 msg = Traffic(pkt)
                 requests[key] = msg
-                traffic.append(msg)
+                if timeout is None:
+                    traffic.append(msg)
 
         # now check for results
         elif isinstance(pkt, ReadPropertyACK):
@@ -157,53 +158,100 @@ class ReadPropertySummary(Tracer):
 
 
 #
-#   __main__
+#   configure
 #
 
-# parse the command line arguments
-parser = ArgumentParser(description=__doc__)
-parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
-parser.add_argument(
-    "-d", "--destination", nargs="?", type=str, help="destination address"
-)
-parser.add_argument("--host", nargs="?", type=str, help="source or destination")
-parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
-args = parser.parse_args()
-
-if _debug:
-    _log.debug("initialization")
-if _debug:
-    _log.debug("    - args: %r", args)
-
-# interpret the arguments
-if args.source:
-    filterSource = Address(args.source)
-    if _debug:
-        _log.debug("    - filterSource: %r", filterSource)
-if args.destination:
-    filterDestination = Address(args.destination)
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
     if _debug:
-        _log.debug("    - filterDestination: %r", filterDestination)
-if args.host:
-    filterHost = Address(args.host)
+        configure._debug("configure %r", args)
+    global filterAddress, timeout
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
     if _debug:
-        _log.debug("    - filterHost: %r", filterHost)
-
-# start out with no unmatched requests
-requests = {}
-
-# trace the file(s)
-for fname in args.pcap:
-    trace(fname, [ReadPropertySummary])
-
-# dump the requests that failed
-for msg in traffic:
-    if not msg.resp:
-        print(
-            "%s\t%s\t%s"
-            % (
-                strftimestamp(msg.req._timestamp),
-                msg.req.objectIdentifier,
-                msg.req.propertyIdentifier,
-            )
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+    # the analyzer in MultiFilter does not stream
+    timeout = getattr(args, "timeout", None)
+
+
+#
+#   report
+#
+
+
+def print_request(msg):
+    """Print a request that failed."""
+    print(
+        "%s\t%s\t%s"
+        % (
+            strftimestamp(msg.req._timestamp),
+            msg.req.objectIdentifier,
+            msg.req.propertyIdentifier,
         )
+    )
+
+
+def report():
+    """Dump the requests that failed, in streaming mode these are the ones
+    still waiting for a response at the end."""
+    if timeout is not None:
+        for msg in requests.values():
+            print_request(msg)
+        return
+
+    for msg in traffic:
+        if not msg.resp:
+            print_request(msg)
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of decoding processes"
+    )
+    parser.add_argument(
+        "-t", "--timeout", type=float, help="print requests as they time out"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    # interpret the arguments
+    configure(args)
+
+    # trace the file(s), decoding each one in parallel when there is more
+    # than one job, rolling reports are only made when the timeouts are not
+    # being streamed
+    trace_ranges(
+        args.pcap,
+        [ReadPropertySummary],
+        args,
+        args.jobs,
+        report if (timeout is None) else None,
+    )
+
+    # dump the requests that failed
+    report()
+
+
+if __name__ == "__main__":
+    main()
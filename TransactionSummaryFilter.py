@@ -0,0 +1,242 @@
+#!/usr/bin/python
+
+"""
+This application matches every confirmed request with its response, Simple
+Ack, Complex Ack, Error, Reject, or Abort, and prints a summary for each
+service: the number of requests and retries, how they were answered, the
+number that were not answered within the --timeout (ten seconds by default),
+and the response times.  It is the same kind of information as the
+ReadPropertySummaryFilter application for all of the confirmed services at
+once, like Write Property, Read Property Multiple, and Subscribe COV.
+
+This application accepts the same --source, --destination, and --host options
+as the other filters, and accepts the debugging options of other BACpypes
+applications.
+"""
+
+from collections import defaultdict
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from bacpypes.analysis import Tracer
+
+from addrmatch import address_filter
+from parallel import trace_ranges
+from pcaptrace import add_arguments
+from transactions import (
+    TransactionEngine,
+    transaction_pdu_types,
+    service_name,
+    outcomes,
+)
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+filterAddress = None
+
+# seconds of capture time to wait for a response
+timeout = 10.0
+
+# matches the requests and responses
+engine = None
+
+# service choice to summary
+services = {}
+
+#
+#   ServiceSummary
+#
+
+
+class ServiceSummary:
+    def __init__(self):
+        self.count = 0
+        self.retries = 0
+        self.outcomes = defaultdict(int)
+
+        # response times of the answered requests
+        self.answered = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+
+#
+#   completed
+#
+
+
+def completed(txn):
+    """Add a finished transaction to the summary of its service."""
+    summary = services.get(txn.service)
+    if summary is None:
+        summary = services[txn.service] = ServiceSummary()
+
+    summary.count += 1
+    summary.retries += txn.retry - 1
+    summary.outcomes[txn.outcome] += 1
+
+    latency = txn.latency
+    if latency is not None:
+        summary.answered += 1
+        summary.total += latency
+        if (summary.minimum is None) or (latency < summary.minimum):
+            summary.minimum = latency
+        if (summary.maximum is None) or (latency > summary.maximum):
+            summary.maximum = latency
+
+
+#
+#   TransactionSummary
+#
+
+
+@bacpypes_debugging
+class TransactionSummary(Tracer):
+
+    # packets this tracer is interested in
+    pduTypes = transaction_pdu_types
+
+    # only the addresses, service and invoke ID are used
+    cacheable = True
+
+    def __init__(self):
+        if _debug:
+            TransactionSummary._debug("__init__")
+        Tracer.__init__(self, self.Filter)
+
+    def Filter(self, pkt):
+        if _debug:
+            TransactionSummary._debug("Filter %r", pkt)
+
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                TransactionSummary._debug("    - address filter fail")
+            return
+
+        engine.process(pkt)
+
+
+#
+#   configure
+#
+
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
+    if _debug:
+        configure._debug("configure %r", args)
+    global filterAddress, timeout, engine
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
+    if _debug:
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+    # the other applications do not have this option
+    timeout = getattr(args, "timeout", None) or timeout
+
+    engine = TransactionEngine(completed, timeout)
+
+
+#
+#   report
+#
+
+
+def report():
+    """Dump the summary of each service."""
+    # requests that are still waiting are counted but not summarized
+    pending = defaultdict(int)
+    for txn in engine.pending.values():
+        pending[txn.service] += 1
+
+    print(
+        "%-32s %7s %7s %s %7s %9s %9s %9s"
+        % (
+            "service",
+            "count",
+            "retries",
+            " ".join("%10s" % (outcome,) for outcome in outcomes),
+            "pending",
+            "min ms",
+            "avg ms",
+            "max ms",
+        )
+    )
+
+    for service in sorted(set(services) | set(pending)):
+        summary = services.get(service) or ServiceSummary()
+
+        if summary.answered:
+            times = "%9.2f %9.2f %9.2f" % (
+                summary.minimum * 1000,
+                summary.total / summary.answered * 1000,
+                summary.maximum * 1000,
+            )
+        else:
+            times = "%9s %9s %9s" % ("-", "-", "-")
+
+        print(
+            "%-32s %7d %7d %s %7d %s"
+            % (
+                service_name(service),
+                summary.count,
+                summary.retries,
+                " ".join("%10d" % (summary.outcomes[outcome],) for outcome in outcomes),
+                pending[service],
+                times,
+            )
+        )
+
+    if engine.unmatched:
+        print("")
+        print("%d unmatched responses" % (engine.unmatched,))
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "-t", "--timeout", type=float, help="seconds to wait for a response"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of decoding processes"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    # interpret the arguments
+    configure(args)
+
+    # trace the file(s), decoding each one in parallel when there is more
+    # than one job
+    trace_ranges(args.pcap, [TransactionSummary], args, args.jobs, report)
+
+    # dump the summary
+    report()
+
+
+if __name__ == "__main__":
+    main()
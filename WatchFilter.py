@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+"""
+This application is a long running version of MultiFilter.  It watches a
+directory where a capture program like daemonlogger is writing and rotating
+PCAP files, and traces each new or growing file as it is written, so the
+analyzers named by the --analyzer option keep up with the capture.  Every
+--report-interval seconds (one minute by default), if there have been new
+packets, each of the analyzer reports is printed, or written to a file per
+analyzer in the --output directory.
+
+The capture files are the ones that match the --pattern options, which
+default to *.pcap, *.pcapng, and *.cap.  With the --checkpoint option the
+results and file positions are saved with each report, so when the
+application is restarted it continues where it stopped.
+
+The --listen option adds the metrics analyzer and serves its counters in the
+Prometheus text format on that port of localhost, see MetricsFilter.
+
+This application accepts the same --source, --destination, and --host options
+as the other filters, and accepts the debugging options of other BACpypes
+applications.
+"""
+
+import os
+import functools
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from MultiFilter import analyzers, load_analyzers, write_reports
+from pcaptrace import add_arguments
+from watch import DirectoryWatcher, watch_directory, file_patterns
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-a",
+        "--analyzer",
+        action="append",
+        choices=sorted(analyzers),
+        required=True,
+        help="analyzer to run",
+    )
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "-i", "--interval", type=int, default=60, help="pdus interval in seconds"
+    )
+    parser.add_argument(
+        "--device",
+        nargs=1,
+        type=str,
+        help="device identifier, comma separated list, or file of them",
+    )
+    parser.add_argument("-o", "--output", type=str, help="report directory")
+    parser.add_argument(
+        "--pattern", action="append", type=str, help="capture file name pattern"
+    )
+    parser.add_argument(
+        "--poll", type=float, default=5.0, help="seconds between directory scans"
+    )
+    parser.add_argument(
+        "--checkpoint", type=str, help="file to save the results and positions in"
+    )
+    parser.add_argument(
+        "--listen", type=int, help="serve the metrics on this port of localhost"
+    )
+    add_arguments(parser)
+    parser.add_argument("directory", type=str, help="capture directory")
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    # the device analyzer needs something to look for
+    if ("device" in args.analyzer) and (not args.device):
+        parser.error("the device analyzer requires --device")
+    if not os.path.isdir(args.directory):
+        parser.error("%s is not a directory" % (args.directory,))
+
+    # each analyzer only once, in the order given
+    names = []
+    for name in args.analyzer:
+        if name not in names:
+            names.append(name)
+    if args.listen and ("metrics" not in names):
+        names.append("metrics")
+
+    # interpret the arguments
+    loaded = load_analyzers(names, args)
+    tracers = [tracer for name, module, tracer in loaded]
+
+    # the results of the other analyzers cannot be saved
+    if args.checkpoint and not all(
+        hasattr(module, "merge") for name, module, tracer in loaded
+    ):
+        parser.error("--checkpoint requires analyzers that can be merged")
+
+    # make sure there is some place to put the reports
+    if args.output and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    # serve the metrics as they change
+    if args.listen:
+        for name, module, tracer in loaded:
+            if name == "metrics":
+                module.serve(args.listen)
+
+    watcher = DirectoryWatcher(
+        args.directory, tuple(args.pattern or file_patterns), args.poll
+    )
+    report = functools.partial(write_reports, loaded, args.output)
+
+    # trace the files as they are written until interrupted
+    try:
+        watch_directory(watcher, tracers, args, report, args.report_interval or 60.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+    # dump the reports
+    write_reports(loaded, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,10 @@
 """
 Given a device identifier and a list of PCAP files, this application prints
 a summary line of Who-Is packets such that the device should respond, and
-the I-Am packets that are sent by the device.  This is useful for repeated
+the I-Am packets that are sent by the device.  The device may also be a
+comma separated list of device identifiers, or the name of a file with one or
+more on each line, and the lines for each device are printed together in the
+report so all of them are checked in one pass.  This is useful for repeated
 attempts to 'bind' where it fails, or where more than one device responds to
 the request (which is bad) or the same device responds but it comes from
 changing source addresses (which is really bad).
@@ -13,62 +16,72 @@ as the other filters, and accepts the debugging options of other BACpypes
 applications.
 """
 
+import heapq
+import bisect
+import itertools
+
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
-from bacpypes.pdu import Address
-from bacpypes.analysis import trace, strftimestamp, Tracer
+from bacpypes.analysis import strftimestamp, Tracer
 from bacpypes.apdu import WhoIsRequest, IAmRequest
 
+from addrmatch import address_filter
+from parallel import trace_files
+from pcaptrace import add_arguments
+
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
 # globals
-filterSource = None
-filterDestination = None
-filterHost = None
-filterDevice = None
+filterAddress = None
+
+# sorted list and set of the device instances to look for
+devices = []
+watched = set()
+
+# device instance to a list of (sequence, line) for the device when more
+# than one is watched, a single device has its lines printed as they are found
+timelines = {}
+
+# (sequence, line) for the Who-Is requests that every device should answer
+global_whois = []
+
+# the order of the lines
+sequence = itertools.count()
 
 #
-#   Match
+#   device_list
 #
 
 
-@bacpypes_debugging
-def Match(addr1, addr2):
-    """Return true iff addr1 matches addr2."""
-    if _debug:
-        Match._debug("Match %r %r", addr1, addr2)
-
-    if addr2.addrType == Address.localBroadcastAddr:
-        # match any local station
-        return (addr1.addrType == Address.localStationAddr) or (
-            addr1.addrType == Address.localBroadcastAddr
-        )
-    elif addr2.addrType == Address.localStationAddr:
-        # match a specific local station
-        return (addr1.addrType == Address.localStationAddr) and (
-            addr1.addrAddr == addr2.addrAddr
-        )
-    elif addr2.addrType == Address.remoteBroadcastAddr:
-        # match any remote station or remote broadcast on a matching network
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            or (addr1.addrType == Address.remoteBroadcastAddr)
-        ) and (addr1.addrNet == addr2.addrNet)
-    elif addr2.addrType == Address.remoteStationAddr:
-        # match a specific remote station
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            and (addr1.addrNet == addr2.addrNet)
-            and (addr1.addrAddr == addr2.addrAddr)
-        )
-    elif addr2.addrType == Address.globalBroadcastAddr:
-        # match a global broadcast address
-        return addr1.addrType == Address.globalBroadcastAddr
-    else:
-        raise RuntimeError("invalid match combination")
+def device_list(spec):
+    """Return a sorted list of device instances from a comma separated list,
+    or from a file with one or more on each line where # starts a comment."""
+    try:
+        instances = [int(word) for word in spec.replace(",", " ").split()]
+    except ValueError:
+        instances = []
+        with open(spec) as f:
+            for line in f:
+                line = line.split("#")[0]
+                instances.extend(int(word) for word in line.replace(",", " ").split())
+
+    return sorted(set(instances))
+
+
+#
+#   watched_devices
+#
+
+
+def watched_devices(low, high):
+    """Return the devices in a Who-Is range, found by bisecting the sorted
+    list so it does not depend on how many devices there are."""
+    return devices[
+        bisect.bisect_left(devices, low) : bisect.bisect_right(devices, high)
+    ]
 
 
 #
@@ -78,6 +91,10 @@ def Match(addr1, addr2):
 
 @bacpypes_debugging
 class WhoIsIAmDevice(Tracer):
+
+    # packets this tracer is interested in
+    pduTypes = (WhoIsRequest, IAmRequest)
+
     def __init__(self):
         if _debug:
             WhoIsIAmDevice._debug("__init__")
@@ -86,106 +103,158 @@ class WhoIsIAmDevice(Tracer):
     def Filter(self, pkt):
         if _debug:
             WhoIsIAmDevice._debug("Filter %r", pkt)
-        global requests
 
-        # apply the filters
-        if filterSource:
-            if not Match(pkt.pduSource, filterSource):
-                if _debug:
-                    WhoIsIAmDevice._debug("    - source filter fail")
-                return
-        if filterDestination:
-            if not Match(pkt.pduDestination, filterDestination):
-                if _debug:
-                    WhoIsIAmDevice._debug("    - destination filter fail")
-                return
-        if filterHost:
-            if (not Match(pkt.pduSource, filterHost)) and (
-                not Match(pkt.pduDestination, filterHost)
-            ):
-                if _debug:
-                    WhoIsIAmDevice._debug("    - host filter fail")
-                return
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                WhoIsIAmDevice._debug("    - address filter fail")
+            return
 
         # check for Who-Is
         if isinstance(pkt, WhoIsRequest):
-            match = False
-            if (pkt.deviceInstanceRangeLowLimit is None) or (
-                pkt.deviceInstanceRangeHighLimit is None
-            ):
-                match = True
-            elif (pkt.deviceInstanceRangeLowLimit >= filterDevice) and (
-                pkt.deviceInstanceRangeHighLimit <= filterDevice
-            ):
-                match = True
-
-            if match:
-                print(
-                    "[%d] %s WhoIs %-20s %-20s %8s %8s"
-                    % (
-                        pkt._number,
-                        strftimestamp(pkt._timestamp),
-                        pkt.pduSource,
-                        pkt.pduDestination,
-                        pkt.deviceInstanceRangeLowLimit,
-                        pkt.deviceInstanceRangeHighLimit,
-                    )
-                )
+            low = pkt.deviceInstanceRangeLowLimit
+            high = pkt.deviceInstanceRangeHighLimit
+            if (low is None) or (high is None):
+                matches = None
+            else:
+                matches = watched_devices(low, high)
+                if not matches:
+                    return
+
+            line = (
+                next(sequence),
+                "[%d] %s WhoIs %-20s %-20s %8s %8s"
+                % (
+                    pkt._number,
+                    strftimestamp(pkt._timestamp),
+                    pkt.pduSource,
+                    pkt.pduDestination,
+                    low,
+                    high,
+                ),
+            )
+
+            if len(devices) == 1:
+                print(line[1])
+
+            # every device should answer
+            elif matches is None:
+                global_whois.append(line)
+            else:
+                for device in matches:
+                    timelines.setdefault(device, []).append(line)
 
         # check for I-Am
         elif isinstance(pkt, IAmRequest):
+            device = pkt.iAmDeviceIdentifier[1]
+            if device not in watched:
+                return
 
-            if pkt.iAmDeviceIdentifier[1] == filterDevice:
-                print(
-                    "[%d] %s IAm   %-20s %-20s"
-                    % (
-                        pkt._number,
-                        strftimestamp(pkt._timestamp),
-                        pkt.pduSource,
-                        pkt.pduDestination,
-                    )
-                )
+            line = (
+                next(sequence),
+                "[%d] %s IAm   %-20s %-20s"
+                % (
+                    pkt._number,
+                    strftimestamp(pkt._timestamp),
+                    pkt.pduSource,
+                    pkt.pduDestination,
+                ),
+            )
+
+            if len(devices) == 1:
+                print(line[1])
+            else:
+                timelines.setdefault(device, []).append(line)
 
 
 #
-#   __main__
+#   configure
 #
 
-# parse the command line arguments
-parser = ArgumentParser(description=__doc__)
-parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
-parser.add_argument(
-    "-d", "--destination", nargs="?", type=str, help="destination address"
-)
-parser.add_argument("--host", nargs="?", type=str, help="source or destination")
-parser.add_argument("device", nargs=1, type=int, help="device identifier")
-parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
-args = parser.parse_args()
-
-if _debug:
-    _log.debug("initialization")
-if _debug:
-    _log.debug("    - args: %r", args)
-
-# interpret the arguments
-if args.source:
-    filterSource = Address(args.source)
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
+    if _debug:
+        configure._debug("configure %r", args)
+    global filterAddress, devices, watched
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
     if _debug:
-        _log.debug("    - filterSource: %r", filterSource)
-if args.destination:
-    filterDestination = Address(args.destination)
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+    # which device instances to look for
+    devices = device_list(args.device[0])
+    watched = set(devices)
+    if _debug:
+        configure._debug("    - devices: %r", devices)
+
+
+#
+#   report
+#
+
+
+def report():
+    """Print the lines for each device in the order they were found.  A
+    single device has no report, its lines have already been printed."""
+    if len(devices) == 1:
+        return
+
+    for device in devices:
+        print("----- Device %d -----" % (device,))
+        print("")
+
+        lines = heapq.merge(global_whois, timelines.get(device, ()))
+        for i, line in lines:
+            print(line)
+
+        print("")
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "device",
+        nargs=1,
+        type=str,
+        help="device identifier, comma separated list, or file of them",
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
     if _debug:
-        _log.debug("    - filterDestination: %r", filterDestination)
-if args.host:
-    filterHost = Address(args.host)
+        _log.debug("initialization")
     if _debug:
-        _log.debug("    - filterHost: %r", filterHost)
+        _log.debug("    - args: %r", args)
+
+    # check the device list
+    try:
+        device_list(args.device[0])
+    except (OSError, ValueError) as err:
+        parser.error("invalid device list: %s" % (err,))
+
+    # interpret the arguments
+    configure(args)
+
+    # trace the file(s), one after another or merged
+    trace_files(args.pcap, [WhoIsIAmDevice], args, report=report)
+
+    # print the lines for each device when there is more than one
+    report()
 
-# which device instance to look for
-filterDevice = args.device[0]
-if _debug:
-    _log.debug("    - filterDevice: %r", filterDevice)
 
-# trace the file(s)
-for fname in args.pcap:
-    trace(fname, [WhoIsIAmDevice])
+if __name__ == "__main__":
+    main()
@@ -17,64 +17,24 @@ from collections import defaultdict
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
-from bacpypes.pdu import Address
-from bacpypes.analysis import trace, Tracer
+from bacpypes.analysis import Tracer
 from bacpypes.apdu import WhoIsRequest, IAmRequest
 
+from addrmatch import address_filter
+from parallel import trace_files
+from pcaptrace import add_arguments
+
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
 # globals
-filterSource = None
-filterDestination = None
-filterHost = None
+filterAddress = None
 
 # dictionaries of requests
 whoIsTraffic = defaultdict(int)
 iAmTraffic = defaultdict(int)
 
-#
-#   Match
-#
-
-
-@bacpypes_debugging
-def Match(addr1, addr2):
-    """Return true iff addr1 matches addr2."""
-    if _debug:
-        Match._debug("Match %r %r", addr1, addr2)
-
-    if addr2.addrType == Address.localBroadcastAddr:
-        # match any local station
-        return (addr1.addrType == Address.localStationAddr) or (
-            addr1.addrType == Address.localBroadcastAddr
-        )
-    elif addr2.addrType == Address.localStationAddr:
-        # match a specific local station
-        return (addr1.addrType == Address.localStationAddr) and (
-            addr1.addrAddr == addr2.addrAddr
-        )
-    elif addr2.addrType == Address.remoteBroadcastAddr:
-        # match any remote station or remote broadcast on a matching network
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            or (addr1.addrType == Address.remoteBroadcastAddr)
-        ) and (addr1.addrNet == addr2.addrNet)
-    elif addr2.addrType == Address.remoteStationAddr:
-        # match a specific remote station
-        return (
-            (addr1.addrType == Address.remoteStationAddr)
-            and (addr1.addrNet == addr2.addrNet)
-            and (addr1.addrAddr == addr2.addrAddr)
-        )
-    elif addr2.addrType == Address.globalBroadcastAddr:
-        # match a global broadcast address
-        return addr1.addrType == Address.globalBroadcastAddr
-    else:
-        raise RuntimeError("invalid match combination")
-
-
 #
 #   WhoIsIAmSummary
 #
@@ -82,6 +42,10 @@ def Match(addr1, addr2):
 
 @bacpypes_debugging
 class WhoIsIAmSummary(Tracer):
+
+    # packets this tracer is interested in
+    pduTypes = (WhoIsRequest, IAmRequest)
+
     def __init__(self):
         if _debug:
             WhoIsIAmSummary._debug("__init__")
@@ -92,24 +56,11 @@ class WhoIsIAmSummary(Tracer):
             WhoIsIAmSummary._debug("Filter %r", pkt)
         global requests
 
-        # apply the filters
-        if filterSource:
-            if not Match(pkt.pduSource, filterSource):
-                if _debug:
-                    WhoIsIAmSummary._debug("    - source filter fail")
-                return
-        if filterDestination:
-            if not Match(pkt.pduDestination, filterDestination):
-                if _debug:
-                    WhoIsIAmSummary._debug("    - destination filter fail")
-                return
-        if filterHost:
-            if (not Match(pkt.pduSource, filterHost)) and (
-                not Match(pkt.pduDestination, filterHost)
-            ):
-                if _debug:
-                    WhoIsIAmSummary._debug("    - host filter fail")
-                return
+        # apply the address filters
+        if filterAddress and not filterAddress(pkt):
+            if _debug:
+                WhoIsIAmSummary._debug("    - address filter fail")
+            return
 
         # check for Who-Is
         if isinstance(pkt, WhoIsRequest):
@@ -127,57 +78,104 @@ class WhoIsIAmSummary(Tracer):
 
 
 #
-#   __main__
+#   configure
 #
 
-# parse the command line arguments
-parser = ArgumentParser(description=__doc__)
-parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
-parser.add_argument(
-    "-d", "--destination", nargs="?", type=str, help="destination address"
-)
-parser.add_argument("--host", nargs="?", type=str, help="source or destination")
-parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
-args = parser.parse_args()
-
-if _debug:
-    _log.debug("initialization")
-if _debug:
-    _log.debug("    - args: %r", args)
-
-# interpret the arguments
-if args.source:
-    filterSource = Address(args.source)
+
+@bacpypes_debugging
+def configure(args):
+    """Interpret the command line arguments."""
+    if _debug:
+        configure._debug("configure %r", args)
+    global filterAddress
+
+    filterAddress = address_filter(args.source, args.destination, args.host)
     if _debug:
-        _log.debug("    - filterSource: %r", filterSource)
-if args.destination:
-    filterDestination = Address(args.destination)
+        configure._debug("    - filterAddress: %r", filterAddress)
+
+
+#
+#   state
+#
+
+
+def state():
+    """Return the request counts so they can be merged by another process."""
+    return (whoIsTraffic, iAmTraffic)
+
+
+def merge(partial):
+    """Add the request counts from another process."""
+    partialWhoIs, partialIAm = partial
+    for key, count in partialWhoIs.items():
+        whoIsTraffic[key] += count
+    for key, count in partialIAm.items():
+        iAmTraffic[key] += count
+
+
+#
+#   report
+#
+
+
+def report():
+    """Dump request counts."""
+    print("----- Top 20 Who-Is -----")
+    print("")
+
+    items = sorted(
+        whoIsTraffic.items(), key=lambda x: (x[1], str(x[0][0])), reverse=True
+    )
+    for item in items[:20]:
+        print("%-20s %8s %8s %5d" % (item[0][0], item[0][1], item[0][2], item[1]))
+    print("")
+
+    print("----- Top 20 I-Am -----")
+    print("")
+
+    items = sorted(iAmTraffic.items(), key=lambda x: (x[1], str(x[0][0])), reverse=True)
+    for item in items[:20]:
+        print("%-20s %8s %5d" % (item[0][0], item[0][1], item[1]))
+    print("")
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--source", nargs="?", type=str, help="source address")
+    parser.add_argument(
+        "-d", "--destination", nargs="?", type=str, help="destination address"
+    )
+    parser.add_argument("--host", nargs="?", type=str, help="source or destination")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--checkpoint", type=str, help="file to save the results and positions in"
+    )
+    add_arguments(parser)
+    parser.add_argument("pcap", nargs="+", type=str, help="pcap file(s)")
+    args = parser.parse_args()
+
     if _debug:
-        _log.debug("    - filterDestination: %r", filterDestination)
-if args.host:
-    filterHost = Address(args.host)
+        _log.debug("initialization")
     if _debug:
-        _log.debug("    - filterHost: %r", filterHost)
-
-# trace the file(s)
-for fname in args.pcap:
-    trace(fname, [WhoIsIAmSummary])
-
-# dump request counts
-print("----- Top 20 Who-Is -----")
-print("")
-
-items = whoIsTraffic.items()
-items.sort(key=lambda x: (x[1], x[0][0]), reverse=True)
-for item in items[:20]:
-    print("%-20s %8s %8s %5d" % (item[0][0], item[0][1], item[0][2], item[1]))
-print("")
-
-print("----- Top 20 I-Am -----")
-print("")
-
-items = iAmTraffic.items()
-items.sort(key=lambda x: (x[1], x[0][0]), reverse=True)
-for item in items[:20]:
-    print("%-20s %8s %5d" % (item[0][0], item[0][1], item[1]))
-print("")
+        _log.debug("    - args: %r", args)
+
+    # interpret the arguments
+    configure(args)
+
+    # trace the file(s), in parallel when there is more than one job
+    trace_files(args.pcap, [WhoIsIAmSummary], args, args.jobs, report)
+
+    # dump request counts
+    report()
+
+
+if __name__ == "__main__":
+    main()
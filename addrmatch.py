@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+"""
+Address Match - Compiling --source, --destination and --host filters
+
+Each of the options is a BACnet address, a comma separated list of them, or
+@filename for a file with one address per line (blank lines and lines
+starting with '#' are skipped), and a packet address matches if it matches
+any of them.  The addresses are sorted into sets by type when the options
+are interpreted so matching a packet address is a lookup rather than a
+comparison with each one:
+
+    - a local station matches the same local station
+    - a local broadcast '*' matches any local station or local broadcast
+    - a remote station 'net:addr' matches the same remote station
+    - a remote broadcast 'net:*' matches any remote station or remote
+      broadcast on that network
+    - a global broadcast '*:*' matches a global broadcast
+"""
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+from bacpypes.pdu import Address
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+#
+#   parse_addresses
+#
+
+
+@bacpypes_debugging
+def parse_addresses(spec):
+    """Return a list of addresses from an option value."""
+    if _debug:
+        parse_addresses._debug("parse_addresses %r", spec)
+
+    if spec.startswith("@"):
+        with open(spec[1:], "r") as f:
+            items = [line.strip() for line in f]
+        items = [item for item in items if item and not item.startswith("#")]
+    else:
+        items = [item.strip() for item in spec.split(",") if item.strip()]
+
+    if not items:
+        raise ValueError("no addresses: %r" % (spec,))
+
+    return [Address(item) for item in items]
+
+
+#
+#   compile_match
+#
+
+
+def _always(addr):
+    return True
+
+
+@bacpypes_debugging
+def compile_match(addresses):
+    """Return a function that is given an address and returns true if it
+    matches any of the addresses."""
+    if _debug:
+        compile_match._debug("compile_match %r", addresses)
+
+    local_broadcast = False
+    global_broadcast = False
+    local_stations = set()
+    remote_stations = set()
+    remote_networks = set()
+
+    for addr in addresses:
+        if addr.addrType == Address.localBroadcastAddr:
+            local_broadcast = True
+        elif addr.addrType == Address.localStationAddr:
+            local_stations.add(addr.addrAddr)
+        elif addr.addrType == Address.remoteBroadcastAddr:
+            remote_networks.add(addr.addrNet)
+        elif addr.addrType == Address.remoteStationAddr:
+            remote_stations.add((addr.addrNet, addr.addrAddr))
+        elif addr.addrType == Address.globalBroadcastAddr:
+            global_broadcast = True
+        else:
+            raise ValueError("invalid match address: %r" % (addr,))
+
+    # the common case is one or more IP addresses
+    if local_stations and not (
+        local_broadcast or global_broadcast or remote_stations or remote_networks
+    ):
+
+        def match(addr):
+            return (addr.addrType == Address.localStationAddr) and (
+                addr.addrAddr in local_stations
+            )
+
+        return match
+
+    # a test for each type of address that can match
+    tests = {}
+    if local_broadcast:
+        tests[Address.localStationAddr] = _always
+        tests[Address.localBroadcastAddr] = _always
+    elif local_stations:
+        tests[Address.localStationAddr] = lambda addr: addr.addrAddr in local_stations
+    if remote_stations or remote_networks:
+        tests[Address.remoteStationAddr] = lambda addr: (
+            addr.addrNet in remote_networks
+        ) or ((addr.addrNet, addr.addrAddr) in remote_stations)
+    if remote_networks:
+        tests[Address.remoteBroadcastAddr] = (
+            lambda addr: addr.addrNet in remote_networks
+        )
+    if global_broadcast:
+        tests[Address.globalBroadcastAddr] = _always
+    if _debug:
+        compile_match._debug("    - tests: %r", tests)
+
+    get_test = tests.get
+
+    def match(addr):
+        test = get_test(addr.addrType)
+        return (test is not None) and test(addr)
+
+    return match
+
+
+#
+#   address_filter
+#
+
+
+@bacpypes_debugging
+def address_filter(source=None, destination=None, host=None):
+    """Given the values of the --source, --destination and --host options,
+    return a function that is given a packet and returns true if it passes
+    all of them, or None if there are no filters."""
+    if _debug:
+        address_filter._debug("address_filter %r %r %r", source, destination, host)
+
+    source_match = compile_match(parse_addresses(source)) if source else None
+    destination_match = (
+        compile_match(parse_addresses(destination)) if destination else None
+    )
+    host_match = compile_match(parse_addresses(host)) if host else None
+
+    if not (source_match or destination_match or host_match):
+        return None
+
+    def match(pkt):
+        if source_match and not source_match(pkt.pduSource):
+            return False
+        if destination_match and not destination_match(pkt.pduDestination):
+            return False
+        if (
+            host_match
+            and not host_match(pkt.pduSource)
+            and not host_match(pkt.pduDestination)
+        ):
+            return False
+        return True
+
+    return match
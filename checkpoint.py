@@ -0,0 +1,155 @@
+#!/usr/bin/python
+
+"""
+Checkpoint - Saving the results of a run to continue from later
+
+Captures that are rotated every few minutes are usually summarized again and
+again as the day goes on.  A checkpoint file has the state of each of the
+analyzer modules, the same state that is merged from worker processes, and
+the position in each file after the last packet that was read.  The next run
+with the same checkpoint merges the saved state into the modules, skips the
+files that have not grown, and starts reading the others where the last run
+stopped, so only the new packets are decoded.
+
+A file is recognized by its absolute path and the first few kilobytes of
+its contents, a file that has been replaced rather than added to is read
+again from the start.  The checkpoint should only be used with the same
+analyzers and the same options that select the packets, the state of the
+modules is the result of those options.
+"""
+
+import os
+import zlib
+import pickle
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+from pcapfile import is_stream
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# change this when the layout of the checkpoint file changes
+checkpoint_version = 1
+
+# number of bytes at the start of a file that identify it
+head_size = 4096
+
+#
+#   file_head
+#
+
+
+def file_head(fname, size=head_size):
+    """Return the (length, crc) of the start of a file."""
+    with open(fname, "rb") as f:
+        head = f.read(size)
+    return (len(head), zlib.crc32(head))
+
+
+#
+#   Checkpoint
+#
+
+
+@bacpypes_debugging
+class Checkpoint:
+    """The positions in the files that have been read and the state of the
+    analyzer modules.  Without a file name it only collects the positions,
+    which is what a worker process does."""
+
+    def __init__(self, fname=None, module_names=()):
+        if _debug:
+            Checkpoint._debug("__init__ %r %r", fname, module_names)
+
+        self.fname = fname
+        self.module_names = list(module_names)
+
+        # absolute file name to {"position": position, "head": (length, crc)}
+        self.files = {}
+
+    def load(self):
+        """Load the checkpoint and return a list of the saved state of each
+        module, or None if there is no checkpoint yet."""
+        if _debug:
+            Checkpoint._debug("load")
+
+        try:
+            with open(self.fname, "rb") as f:
+                content = pickle.load(f)
+        except FileNotFoundError:
+            if _debug:
+                Checkpoint._debug("    - no checkpoint")
+            return None
+
+        if content.get("version") != checkpoint_version:
+            raise RuntimeError("%s: unsupported checkpoint version" % (self.fname,))
+        if content["modules"] != self.module_names:
+            raise RuntimeError(
+                "%s: checkpoint is for %s"
+                % (self.fname, ", ".join(content["modules"]))
+            )
+
+        self.files = content["files"]
+        return content["states"]
+
+    def save(self, states):
+        """Save the state of each module and the file positions, the old
+        checkpoint is replaced when the new one is complete."""
+        if _debug:
+            Checkpoint._debug("save")
+
+        content = {
+            "version": checkpoint_version,
+            "modules": self.module_names,
+            "states": states,
+            "files": self.files,
+        }
+
+        temp_name = self.fname + ".tmp"
+        with open(temp_name, "wb") as f:
+            pickle.dump(content, f)
+        os.replace(temp_name, self.fname)
+
+    def position(self, fname):
+        """Return the position to continue reading the file from, or None to
+        read it from the start."""
+        if is_stream(fname):
+            return None
+
+        info = self.files.get(os.path.abspath(fname))
+        if not info:
+            return None
+
+        # a file that has been replaced is read again
+        length, crc = info["head"]
+        if file_head(fname, length) != (length, crc):
+            if _debug:
+                Checkpoint._debug("    - replaced: %r", fname)
+            return None
+
+        return info["position"]
+
+    def finished(self, fname):
+        """Return true if the file has been read to the end and has not
+        changed since."""
+        position = self.position(fname)
+        if position is None:
+            return False
+
+        # the offset of the next record is the first element of a position
+        return position[0] >= os.path.getsize(fname)
+
+    def update(self, fname, position):
+        """Save the position after the last packet that was read, streams do
+        not have positions."""
+        if _debug:
+            Checkpoint._debug("update %r %r", fname, position)
+        if position is None:
+            return
+
+        self.files[os.path.abspath(fname)] = {
+            "position": position,
+            "head": file_head(fname),
+        }
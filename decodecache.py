@@ -0,0 +1,358 @@
+#!/usr/bin/python
+
+"""
+Decode Cache - Keeping decoded packet headers next to a pcap file
+
+Decoding every packet with BACpypes is the slowest part of running a filter,
+and the same capture is often run through several filters.  The first time a
+file is read with the cache the header fields of every packet are saved in a
+sidecar file as columns of typed arrays, and later runs build lightweight
+packet objects from the columns without decoding anything.
+
+The cached packets are instances of the same PDU classes with only these
+attributes: _number, _timestamp, pduSource, pduDestination, apduService,
+apduInvokeID, objectIdentifier and propertyIdentifier, so the cache is only
+used when every tracer has a cacheable attribute that is true and a --filter
+expression only uses these fields.  Like the
+packet index, the cache is ignored when the size or modification time of the
+file changes.
+"""
+
+import os
+import sys
+import array
+import bisect
+import pickle
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+from bacpypes.analysis import decode_packet
+
+from pcapfile import open_pcap
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# change this when the layout of the cache file changes
+cache_version = 1
+
+# packet attributes that are in the cache
+cached_fields = (
+    "_number",
+    "_timestamp",
+    "pduSource",
+    "pduDestination",
+    "apduService",
+    "apduInvokeID",
+    "objectIdentifier",
+    "propertyIdentifier",
+)
+
+# column name and array type code, -1 is used for a missing value
+_columns = (
+    ("number", "I"),
+    ("timestamp", "d"),
+    ("source", "i"),
+    ("destination", "i"),
+    ("pdu_class", "H"),
+    ("service", "h"),
+    ("invoke_id", "h"),
+    ("object_type", "i"),
+    ("object_instance", "i"),
+    ("property", "i"),
+)
+
+#
+#   cacheable
+#
+
+
+def cacheable(tracers, match=None):
+    """Return true if every tracer only needs the fields in the cache, and
+    so does the match function of a filter expression if there is one."""
+    if match and not match.fields.issubset(cached_fields):
+        return False
+    return all(getattr(tracer, "cacheable", False) for tracer in tracers)
+
+
+#
+#   pdu_classes
+#
+
+
+def pdu_classes(tracers):
+    """Return a tuple of the PDU classes the tracers are interested in, or
+    None if there is a tracer that needs everything."""
+    classes = []
+    for tracer in tracers:
+        pdu_types = getattr(tracer, "pduTypes", None)
+        if pdu_types is None:
+            return None
+        classes.extend(pdu_types)
+
+    return tuple(classes)
+
+
+#
+#   DecodeCache
+#
+
+
+@bacpypes_debugging
+class DecodeCache:
+    """The decoded header fields of every packet in a file.  Addresses, PDU
+    classes, object types and property identifiers are kept in tables and
+    the columns have the index into the table."""
+
+    def __init__(self, fname):
+        if _debug:
+            DecodeCache._debug("__init__ %r", fname)
+
+        self.fname = fname
+        self.cachename = fname + ".cache"
+
+        stat = os.stat(fname)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+        self.columns = {name: array.array(code) for name, code in _columns}
+
+        self.addresses = []
+        self.pdu_classes = []
+        self.values = []
+
+    def load(self):
+        """Load the cache, return True if it matches the file."""
+        if _debug:
+            DecodeCache._debug("load")
+
+        try:
+            with open(self.cachename, "rb") as f:
+                header = pickle.load(f)
+                if (
+                    (header.get("version") != cache_version)
+                    or (header.get("size") != self.size)
+                    or (header.get("mtime") != self.mtime)
+                ):
+                    if _debug:
+                        DecodeCache._debug("    - stale cache")
+                    return False
+
+                for name, code in _columns:
+                    self.columns[name].fromfile(f, header["count"])
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError) as err:
+            if _debug:
+                DecodeCache._debug("    - no cache: %r", err)
+            self.columns = {name: array.array(code) for name, code in _columns}
+            return False
+
+        # the columns are saved in the byte order of the machine that wrote them
+        if header["byteorder"] != sys.byteorder:
+            for column in self.columns.values():
+                column.byteswap()
+
+        self.addresses = header["addresses"]
+        self.pdu_classes = header["pdu_classes"]
+        self.values = header["values"]
+
+        return True
+
+    def save(self):
+        """Save the cache, quietly giving up if the file cannot be written."""
+        if _debug:
+            DecodeCache._debug("save")
+
+        header = {
+            "version": cache_version,
+            "size": self.size,
+            "mtime": self.mtime,
+            "byteorder": sys.byteorder,
+            "count": len(self.columns["number"]),
+            "addresses": self.addresses,
+            "pdu_classes": self.pdu_classes,
+            "values": self.values,
+        }
+        try:
+            with open(self.cachename, "wb") as f:
+                pickle.dump(header, f)
+                for name, code in _columns:
+                    self.columns[name].tofile(f)
+        except OSError as err:
+            if _debug:
+                DecodeCache._debug("    - save failed: %r", err)
+
+    def build(self, packets=None):
+        """Add the packets, by default every packet in the file decoded in
+        this process, and save the cache."""
+        if _debug:
+            DecodeCache._debug("build")
+
+        if packets is None:
+            packets = self.decode()
+
+        # map the table entries to their index
+        addresses = {}
+        pdu_classes = {}
+        values = {}
+
+        def lookup(table, entries, value):
+            if value is None:
+                return -1
+            i = table.get(value)
+            if i is None:
+                i = table[value] = len(entries)
+                entries.append(value)
+            return i
+
+        number = self.columns["number"].append
+        timestamp = self.columns["timestamp"].append
+        source = self.columns["source"].append
+        destination = self.columns["destination"].append
+        pdu_class = self.columns["pdu_class"].append
+        service = self.columns["service"].append
+        invoke_id = self.columns["invoke_id"].append
+        object_type = self.columns["object_type"].append
+        object_instance = self.columns["object_instance"].append
+        prop = self.columns["property"].append
+
+        for pkt in packets:
+            number(pkt._number)
+            timestamp(pkt._timestamp)
+            source(lookup(addresses, self.addresses, pkt.pduSource))
+            destination(lookup(addresses, self.addresses, pkt.pduDestination))
+            pdu_class(lookup(pdu_classes, self.pdu_classes, pkt.__class__))
+
+            value = getattr(pkt, "apduService", None)
+            service(-1 if value is None else value)
+            value = getattr(pkt, "apduInvokeID", None)
+            invoke_id(-1 if value is None else value)
+
+            value = getattr(pkt, "objectIdentifier", None)
+            if value is None:
+                object_type(-1)
+                object_instance(-1)
+            else:
+                object_type(lookup(values, self.values, value[0]))
+                object_instance(value[1])
+            prop(lookup(values, self.values, getattr(pkt, "propertyIdentifier", None)))
+
+        self.save()
+
+    def decode(self):
+        """Decode every packet in the file."""
+        p = open_pcap(self.fname)
+        try:
+            for number, timestamp, data in p.records():
+                try:
+                    pkt = decode_packet(bytes(data))
+                    if not pkt:
+                        continue
+                except Exception as err:
+                    if _debug:
+                        DecodeCache._debug(
+                            "    - exception decoding packet %d: %r", number, err
+                        )
+                    continue
+
+                pkt._number = number
+                pkt._timestamp = timestamp
+
+                yield pkt
+        finally:
+            p.close()
+
+    def packets(self, classes=None, first=None, last=None, start=None, end=None):
+        """Yield packets rebuilt from the columns, limited to instances of the
+        tuple of PDU classes and the ranges of packet numbers and
+        timestamps."""
+        if _debug:
+            DecodeCache._debug(
+                "packets classes=%r first=%r last=%r start=%r end=%r",
+                classes,
+                first,
+                last,
+                start,
+                end,
+            )
+        numbers = self.columns["number"]
+        timestamps = self.columns["timestamp"]
+
+        # the packet numbers and timestamps are increasing
+        lo, hi = 0, len(numbers)
+        if first is not None:
+            lo = max(lo, bisect.bisect_left(numbers, first))
+        if last is not None:
+            hi = min(hi, bisect.bisect_right(numbers, last))
+        if start is not None:
+            lo = max(lo, bisect.bisect_left(timestamps, start))
+        if end is not None:
+            hi = min(hi, bisect.bisect_right(timestamps, end))
+
+        # the classes to skip
+        skip = set()
+        if classes is not None:
+            skip = set(
+                i
+                for i, pdu_class in enumerate(self.pdu_classes)
+                if not issubclass(pdu_class, classes)
+            )
+
+        addresses = self.addresses
+        pdu_classes = self.pdu_classes
+        values = self.values
+        sources = self.columns["source"]
+        destinations = self.columns["destination"]
+        pdu_class_indexes = self.columns["pdu_class"]
+        services = self.columns["service"]
+        invoke_ids = self.columns["invoke_id"]
+        object_types = self.columns["object_type"]
+        object_instances = self.columns["object_instance"]
+        properties = self.columns["property"]
+
+        for i in range(lo, hi):
+            j = pdu_class_indexes[i]
+            if j in skip:
+                continue
+            pdu_class = pdu_classes[j]
+
+            pkt = pdu_class.__new__(pdu_class)
+            pkt._number = numbers[i]
+            pkt._timestamp = timestamps[i]
+
+            j = sources[i]
+            pkt.pduSource = None if j < 0 else addresses[j]
+            j = destinations[i]
+            pkt.pduDestination = None if j < 0 else addresses[j]
+
+            j = services[i]
+            pkt.apduService = None if j < 0 else j
+            j = invoke_ids[i]
+            pkt.apduInvokeID = None if j < 0 else j
+
+            j = object_types[i]
+            pkt.objectIdentifier = None if j < 0 else (values[j], object_instances[i])
+            j = properties[i]
+            pkt.propertyIdentifier = None if j < 0 else values[j]
+
+            yield pkt
+
+
+#
+#   cached_packets
+#
+
+
+@bacpypes_debugging
+def cached_packets(fname, classes=None, packets=None, **kwargs):
+    """Yield the packets of a file from its cache, building the cache first
+    from the decoded packets, or by decoding the file, when it is missing or
+    stale.  The other keyword arguments select the packets to yield."""
+    if _debug:
+        cached_packets._debug("cached_packets %r %r %r", fname, classes, kwargs)
+
+    cache = DecodeCache(fname)
+    if not cache.load():
+        cache.build(packets)
+
+    return cache.packets(classes, **kwargs)
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+
+"""
+Filter Expressions - Compiling --filter expressions into predicates
+
+A filter expression is a Python expression about a decoded packet named pkt,
+like this:
+
+    pkt.propertyIdentifier == 'presentValue' and pkt.apduInvokeID < 10
+
+The expression is parsed once and only comparisons, boolean operators,
+simple arithmetic, constants, subscripts, a few functions, and the packet
+fields listed below are allowed.  A field the packet does not have is None.
+Calls to Address() with constant arguments are evaluated when the expression
+is compiled rather than for every packet.
+"""
+
+import ast
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+from bacpypes.pdu import Address
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# packet fields that can be used in an expression
+fields = (
+    "_number",
+    "_timestamp",
+    "pduSource",
+    "pduDestination",
+    "apduType",
+    "apduService",
+    "apduInvokeID",
+    "objectIdentifier",
+    "propertyIdentifier",
+    "propertyArrayIndex",
+    "deviceInstanceRangeLowLimit",
+    "deviceInstanceRangeHighLimit",
+    "iAmDeviceIdentifier",
+    "initiatingDeviceIdentifier",
+    "monitoredObjectIdentifier",
+    "eventObjectIdentifier",
+    "wirtnNetwork",
+    "iartnNetworkList",
+)
+
+# functions that can be called in an expression
+functions = {"Address": Address, "str": str, "int": int, "len": len}
+
+# syntax that is allowed, anything else is an error
+_allowed_nodes = (
+    ast.Expression,
+    ast.BoolOp,
+    ast.And,
+    ast.Or,
+    ast.UnaryOp,
+    ast.Not,
+    ast.USub,
+    ast.BinOp,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.Mod,
+    ast.Compare,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+    ast.In,
+    ast.NotIn,
+    ast.Is,
+    ast.IsNot,
+    ast.Constant,
+    ast.Tuple,
+    ast.List,
+    ast.Set,
+    ast.Subscript,
+    ast.Attribute,
+    ast.Name,
+    ast.Call,
+    ast.Load,
+)
+
+#
+#   FilterTransformer
+#
+
+
+class FilterTransformer(ast.NodeTransformer):
+    """Check each node of the expression and rewrite the packet fields and
+    constant addresses."""
+
+    def __init__(self):
+        self.fields = set()
+        self.constants = {}
+
+    def generic_visit(self, node):
+        if not isinstance(node, _allowed_nodes):
+            raise ValueError("%s is not allowed" % (node.__class__.__name__,))
+        return ast.NodeTransformer.generic_visit(self, node)
+
+    def visit_Name(self, node):
+        if node.id not in ("pkt",):
+            raise ValueError("unknown name %r" % (node.id,))
+        return node
+
+    def visit_Attribute(self, node):
+        if not (isinstance(node.value, ast.Name) and (node.value.id == "pkt")):
+            raise ValueError("only the fields of pkt can be used")
+        if node.attr not in fields:
+            raise ValueError("unknown field %r" % (node.attr,))
+        self.fields.add(node.attr)
+
+        # a missing field is None
+        return ast.copy_location(
+            ast.Call(
+                func=ast.Name(id="getattr", ctx=ast.Load()),
+                args=[node.value, ast.Constant(node.attr), ast.Constant(None)],
+                keywords=[],
+            ),
+            node,
+        )
+
+    def visit_Call(self, node):
+        if not (isinstance(node.func, ast.Name) and (node.func.id in functions)):
+            raise ValueError("only %s can be called" % (", ".join(functions),))
+        if node.keywords:
+            raise ValueError("keyword arguments are not allowed")
+        node.args = [self.visit(arg) for arg in node.args]
+
+        # build constant addresses now
+        if (node.func.id == "Address") and all(
+            isinstance(arg, ast.Constant) for arg in node.args
+        ):
+            name = "_address%d" % (len(self.constants),)
+            self.constants[name] = Address(*[arg.value for arg in node.args])
+            return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+        return node
+
+
+#
+#   compile_filter
+#
+
+
+@bacpypes_debugging
+def compile_filter(expression):
+    """Compile the expression and return a function that is given a packet
+    and returns true if it matches.  The function has a fields attribute
+    with the set of fields that are used.  A ValueError is raised if the
+    expression is not valid."""
+    if _debug:
+        compile_filter._debug("compile_filter %r", expression)
+
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as err:
+        raise ValueError("syntax error in filter: %s" % (err.msg,))
+
+    transformer = FilterTransformer()
+    try:
+        tree.body = transformer.visit(tree.body)
+    except ValueError as err:
+        raise ValueError("invalid filter: %s" % (err,))
+
+    # build a function around the expression
+    tree.body = ast.Lambda(
+        args=ast.arguments(
+            posonlyargs=[],
+            args=[ast.arg(arg="pkt")],
+            kwonlyargs=[],
+            kw_defaults=[],
+            defaults=[],
+        ),
+        body=tree.body,
+    )
+    ast.fix_missing_locations(tree)
+
+    namespace = {"__builtins__": {}, "getattr": getattr}
+    namespace.update(functions)
+    namespace.update(transformer.constants)
+    function = eval(compile(tree, "<filter>", "eval"), namespace)
+
+    def match(pkt):
+        try:
+            return function(pkt)
+        except (TypeError, ValueError, IndexError, KeyError, ZeroDivisionError):
+            # something like comparing a missing field to a number
+            return False
+
+    match.fields = transformer.fields
+    if _debug:
+        compile_filter._debug("    - fields: %r", match.fields)
+
+    return match
@@ -0,0 +1,383 @@
+#!/usr/bin/python
+
+"""
+Parallel - Tracing pcap files in worker processes
+
+Analyzer modules that can be run this way have a state() function that
+returns what has been accumulated by their tracers and a merge() function
+that adds the state from another process to their own.  Each worker traces
+one file with a fresh copy of the modules and returns the state of each one,
+and the results are merged in the order of the files.
+
+Analyzers that match requests and responses cannot be merged, so for those
+a large file is split into ranges of records that are decoded by the
+workers, and the decoded packets are given to the tracers in this process in
+their original order.  A request at the end of one range is matched with the
+response at the beginning of the next just as if the file had been decoded
+in one piece.
+
+Streams from stdin or a named pipe are always traced in this process.
+
+With the --merge option the files are traced together in timestamp order.
+The analyzers that are merged trace them in this process, and for the others
+each file is split into ranges and decoded by the workers as before, a few
+ranges of each file at a time, and the packets are merged as they come back.
+
+Each worker keeps its own decode memo when there is a --memo option, and the
+hits and misses of the workers are added up for the report.  Duplicates are
+skipped within each range, except when files are merged, then they are
+skipped in this process so the copies of a packet in different files are
+found.
+
+The analyzers that are merged can also save their state with a --checkpoint
+option, see the checkpoint module, and only the files or the parts of them
+that are new since the last run are traced.
+"""
+
+import os
+import sys
+import importlib
+import multiprocessing
+from collections import deque
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+from pcapfile import open_pcap, is_stream
+from pcaptrace import trace, trace_packets, decode_file, trace_options, wanted_keys
+from pcaptrace import use_cache, merge_packets, trace_merged, report_stats
+from pcaptrace import DecodeMemo, Deduplicator
+from decodecache import cached_packets, pdu_classes
+from checkpoint import Checkpoint
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# size of the ranges of a file decoded by each worker
+range_size = 32 * 1024 * 1024
+
+# decode memo of a worker process
+_memo = None
+
+#
+#   module_name
+#
+
+
+def module_name(module):
+    """Return the name a worker process would use to import the module, which
+    is different from its __name__ when it is running as a script."""
+    if module.__name__ != "__main__":
+        return module.__name__
+    return os.path.splitext(os.path.basename(module.__file__))[0]
+
+
+#
+#   trace_file
+#
+
+
+@bacpypes_debugging
+def trace_file(task):
+    """Trace a file in a worker process and return the state of each of the
+    analyzer modules, and the file positions when there is a checkpoint."""
+    if _debug:
+        trace_file._debug("trace_file %r", task)
+    module_names, tracer_names, args, fname, position = task
+
+    # start each module over, a worker traces more than one file
+    modules = []
+    for name in module_names:
+        if name in sys.modules:
+            module = importlib.reload(sys.modules[name])
+        else:
+            module = importlib.import_module(name)
+        module.configure(args)
+        modules.append(module)
+
+    # the positions are saved by the main process
+    checkpoint = Checkpoint() if getattr(args, "checkpoint", None) else None
+
+    tracers = [getattr(modules[i], tracer_name) for i, tracer_name in tracer_names]
+    trace_one(fname, tracers, checkpoint, position, **trace_options(args))
+
+    return (
+        [module.state() for module in modules],
+        checkpoint.files if checkpoint else None,
+    )
+
+
+#
+#   trace_one
+#
+
+
+def trace_one(fname, tracers, checkpoint=None, position=None, **options):
+    """Trace a file, continuing from the position when there is one, and
+    save the position after the last packet in the checkpoint."""
+    if checkpoint is not None:
+        options["checkpoint"] = checkpoint
+    if position is not None:
+        options["position"] = position
+    trace(fname, tracers, **options)
+
+
+#
+#   tracer_modules
+#
+
+
+def tracer_modules(tracers):
+    """Return the modules that have the tracers, each one once, and a list of
+    (module index, tracer name) for each tracer."""
+    modules = []
+    tracer_names = []
+    for tracer in tracers:
+        module = sys.modules[tracer.__module__]
+        if not hasattr(module, "merge"):
+            raise RuntimeError("%s cannot be run in parallel" % (module_name(module),))
+        if module not in modules:
+            modules.append(module)
+        tracer_names.append((modules.index(module), tracer.__name__))
+
+    return modules, tracer_names
+
+
+#
+#   trace_files
+#
+
+
+@bacpypes_debugging
+def trace_files(fnames, tracers, args, jobs=1, report=None):
+    """Trace the files with a pool of worker processes and merge the results
+    into the modules of the tracers.  Rolling reports are only made when the
+    files are traced in this process, which is also where files that are
+    merged are traced.  With a checkpoint the saved state is merged first,
+    and the state and file positions are saved at the end."""
+    if _debug:
+        trace_files._debug(
+            "trace_files %r %r %r %r %r", fnames, tracers, args, jobs, report
+        )
+    checkpoint_name = getattr(args, "checkpoint", None)
+
+    if getattr(args, "merge", False):
+        if checkpoint_name:
+            raise RuntimeError("a checkpoint cannot be used with merged files")
+        trace_merged(fnames, tracers, report=report, **trace_options(args))
+        return
+
+    # continue from the checkpoint, skipping the files that are done
+    checkpoint = None
+    if checkpoint_name:
+        modules, tracer_names = tracer_modules(tracers)
+        checkpoint = Checkpoint(
+            checkpoint_name, [module_name(module) for module in modules]
+        )
+        states = checkpoint.load()
+        if states:
+            for module, state in zip(modules, states):
+                module.merge(state)
+
+        fnames = [fname for fname in fnames if not checkpoint.finished(fname)]
+        if _debug:
+            trace_files._debug("    - new or changed: %r", fnames)
+
+    def positions():
+        for fname in fnames:
+            yield (fname, checkpoint.position(fname) if checkpoint else None)
+
+    if (jobs <= 1) or (len(fnames) <= 1) or any(is_stream(fname) for fname in fnames):
+        for fname, position in positions():
+            trace_one(
+                fname,
+                tracers,
+                checkpoint,
+                position,
+                report=report,
+                **trace_options(args)
+            )
+    else:
+        modules, tracer_names = tracer_modules(tracers)
+        module_names = [module_name(module) for module in modules]
+        tasks = [
+            (module_names, tracer_names, args, fname, position)
+            for fname, position in positions()
+        ]
+
+        with multiprocessing.Pool(min(jobs, len(fnames))) as pool:
+            for fname, (states, files) in zip(fnames, pool.imap(trace_file, tasks)):
+                if _debug:
+                    trace_files._debug("    - merging: %r", fname)
+
+                for module, state in zip(modules, states):
+                    module.merge(state)
+                if checkpoint:
+                    checkpoint.files.update(files)
+
+    if checkpoint:
+        checkpoint.save([module.state() for module in modules])
+
+
+#
+#   decode_range
+#
+
+
+@bacpypes_debugging
+def decode_range(task):
+    """Decode a range of records in a worker process and return a list of
+    the packets, the number of decode memo hits and misses when there is a
+    memo size, and the number of duplicates when there is a window."""
+    if _debug:
+        decode_range._debug("decode_range %r", task)
+    global _memo
+    fname, keys, prefilter, options, memo_size, window, position, stop = task
+
+    # the memo lasts as long as the worker
+    if not memo_size:
+        memo = None
+    else:
+        if (_memo is None) or (_memo.size != memo_size):
+            _memo = DecodeMemo(memo_size)
+        memo = _memo
+        memo.hits = memo.misses = 0
+
+    dedup = Deduplicator(window) if window else None
+
+    packets = list(
+        decode_file(
+            fname, keys, prefilter, memo, dedup, position=position, stop=stop, **options
+        )
+    )
+
+    return (
+        packets,
+        memo.hits if memo else 0,
+        memo.misses if memo else 0,
+        dedup.duplicates if dedup else 0,
+    )
+
+
+#
+#   decode_ranges
+#
+
+
+@bacpypes_debugging
+def decode_ranges(pool, jobs, fname, keys, prefilter, options, memo=None, dedup=None):
+    """Split a file into ranges, decode them with the pool, and yield the
+    packets in order.  Only a few ranges are decoded ahead of the packets
+    being traced.  The hits and misses of the workers are added to the
+    memo, and the duplicates they skipped to the deduplicator."""
+    if _debug:
+        decode_ranges._debug(
+            "decode_ranges %r %r %r %r %r %r %r %r",
+            pool,
+            jobs,
+            fname,
+            keys,
+            prefilter,
+            options,
+            memo,
+            dedup,
+        )
+    memo_size = memo.size if memo else None
+    window = dedup.window if dedup else None
+
+    def results(result):
+        packets, hits, misses, duplicates = result.get()
+        if memo:
+            memo.hits += hits
+            memo.misses += misses
+        if dedup:
+            dedup.duplicates += duplicates
+        return packets
+
+    p = open_pcap(fname)
+    try:
+        ranges = p.split(max(jobs, os.path.getsize(fname) // range_size))
+    finally:
+        p.close()
+
+    pending = deque()
+    for position, stop in ranges:
+        pending.append(
+            pool.apply_async(
+                decode_range,
+                ((fname, keys, prefilter, options, memo_size, window, position, stop),),
+            )
+        )
+        if len(pending) > 2 * jobs:
+            for pkt in results(pending.popleft()):
+                yield pkt
+    while pending:
+        for pkt in results(pending.popleft()):
+            yield pkt
+
+
+#
+#   trace_ranges
+#
+
+
+@bacpypes_debugging
+def trace_ranges(fnames, tracers, args, jobs=1, report=None):
+    """Trace the files one at a time, or merged in timestamp order, with each
+    file decoded in parallel by a pool of worker processes and the tracers
+    running in this one."""
+    if _debug:
+        trace_ranges._debug(
+            "trace_ranges %r %r %r %r %r", fnames, tracers, args, jobs, report
+        )
+
+    options = trace_options(args)
+    merge = getattr(args, "merge", False)
+    # the copies of a packet in different files are only found when the
+    # files are merged in this process
+    if (jobs <= 1) or (merge and options["dedup"]):
+        if merge:
+            trace_merged(fnames, tracers, report=report, **options)
+            return
+        for fname in fnames:
+            trace(fname, tracers, report=report, **options)
+        return
+
+    # the rest of the options select the packets to decode
+    cache = options.pop("cache")
+    interval = options.pop("interval")
+    match = options.pop("match")
+    prefilter = options.pop("prefilter")
+    memo = options.pop("memo")
+    dedup = options.pop("dedup")
+
+    keys = wanted_keys(tracers)
+
+    def ranged_packets(fname):
+        # streams cannot be split
+        if is_stream(fname):
+            return decode_file(fname, keys, prefilter, memo, dedup, **options)
+
+        # the ranges are only decoded when the cache is built
+        if cache and use_cache(fname, tracers, match, prefilter, dedup):
+            return cached_packets(
+                fname,
+                pdu_classes(tracers),
+                decode_ranges(pool, jobs, fname, None, None, {}, memo),
+                **options
+            )
+
+        return decode_ranges(pool, jobs, fname, keys, prefilter, options, memo, dedup)
+
+    with multiprocessing.Pool(jobs) as pool:
+        if merge:
+            packets = merge_packets([ranged_packets(fname) for fname in fnames])
+            trace_packets(packets, tracers, report, interval, match)
+
+            report_stats(", ".join(fnames), memo, dedup)
+            return
+
+        for fname in fnames:
+            trace_packets(ranged_packets(fname), tracers, report, interval, match)
+
+            report_stats(fname, memo, dedup)
@@ -0,0 +1,697 @@
+#!/usr/bin/python
+
+"""
+PCAP File - Reading pcap and pcapng files without libpcap
+
+The file is memory mapped and each record is returned as a tuple where the
+data is a memoryview of the packet bytes in the map, so nothing is copied
+until a packet is decoded.
+
+The first time a range of packet numbers or timestamps is read from a file
+the record headers are scanned to build an index of the offset of every
+thousandth packet, which is saved next to the file.  Reading a range starts
+at the closest checkpoint rather than at the beginning of the file.
+
+A classic pcap file can also be read as it is being written to stdin or a
+named pipe, like the output of 'tcpdump -w -', one record at a time.
+
+After reading records from a file the position attribute is the position of
+the next record, so a file that is still being written can be read again
+later starting with the records that have been added.
+"""
+
+import os
+import sys
+import stat
+import json
+import mmap
+import struct
+import bisect
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# magic numbers in file byte order, microsecond and nanosecond resolution
+_pcap_magic = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+
+# pcapng section header block type and byte order magic
+_pcapng_shb = b"\x0a\x0d\x0d\x0a"
+_pcapng_byte_order = {b"\x4d\x3c\x2b\x1a": "<", b"\x1a\x2b\x3c\x4d": ">"}
+
+# pcapng block types
+_IDB = 0x00000001
+_OPB = 0x00000002
+_SPB = 0x00000003
+_EPB = 0x00000006
+
+# pcapng interface description block options
+_if_tsresol = 9
+_if_tsoffset = 14
+
+# link layer header types
+LINKTYPE_ETHERNET = 1
+
+#
+#   PacketIndex
+#
+
+
+@bacpypes_debugging
+class PacketIndex:
+    """A list of (packet number, timestamp, offset, section) checkpoints
+    kept in a sidecar file, along with the file size and modification time
+    so it is ignored when the file changes."""
+
+    # packets between checkpoints
+    interval = 1000
+
+    def __init__(self, fname):
+        if _debug:
+            PacketIndex._debug("__init__ %r", fname)
+
+        self.fname = fname
+        self.idxname = fname + ".idx"
+
+        stat = os.stat(fname)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+        self.sections = []
+        self.numbers = []
+        self.timestamps = []
+        self.offsets = []
+        self.section_numbers = []
+
+    def load(self):
+        """Load the index, return True if it matches the file."""
+        if _debug:
+            PacketIndex._debug("load")
+
+        try:
+            with open(self.idxname, "r") as f:
+                content = json.load(f)
+        except (OSError, ValueError) as err:
+            if _debug:
+                PacketIndex._debug("    - no index: %r", err)
+            return False
+
+        if (content.get("size") != self.size) or (content.get("mtime") != self.mtime):
+            if _debug:
+                PacketIndex._debug("    - stale index")
+            return False
+
+        self.sections = content["sections"]
+        for number, timestamp, offset, section in content["checkpoints"]:
+            self.add(number, timestamp, offset, section)
+
+        return True
+
+    def save(self):
+        """Save the index, quietly giving up if the file cannot be written."""
+        if _debug:
+            PacketIndex._debug("save")
+
+        content = {
+            "size": self.size,
+            "mtime": self.mtime,
+            "sections": self.sections,
+            "checkpoints": list(
+                zip(self.numbers, self.timestamps, self.offsets, self.section_numbers)
+            ),
+        }
+        try:
+            with open(self.idxname, "w") as f:
+                json.dump(content, f)
+        except OSError as err:
+            if _debug:
+                PacketIndex._debug("    - save failed: %r", err)
+
+    def add(self, number, timestamp, offset, section):
+        """Add a checkpoint, called while reading the file from the start."""
+        self.numbers.append(number)
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+        self.section_numbers.append(section)
+
+    def find(self, first=None, start=None):
+        """Return the (number, offset, section) of the last checkpoint before
+        packet number first and timestamp start, or None."""
+        if _debug:
+            PacketIndex._debug("find first=%r start=%r", first, start)
+
+        if (first is None) and (start is None):
+            return None
+
+        i = len(self.numbers)
+        if first is not None:
+            i = min(i, bisect.bisect_right(self.numbers, first))
+        if start is not None:
+            i = min(i, bisect.bisect_left(self.timestamps, start))
+        if i == 0:
+            return None
+
+        i -= 1
+        return (self.numbers[i], self.offsets[i], self.section_numbers[i])
+
+
+#
+#   PCAPFile
+#
+
+
+@bacpypes_debugging
+class PCAPFile:
+    """A classic pcap file, iterating over it yields (timestamp, data)
+    tuples.  A position in the file is an (offset, number) tuple of the
+    offset of a record and the number of packets before it."""
+
+    def __init__(self, fname):
+        if _debug:
+            PCAPFile._debug("__init__ %r", fname)
+
+        self.fname = fname
+        self.map = None
+        self.linktype = LINKTYPE_ETHERNET
+
+        # position of the next record to read
+        self.position = None
+
+        # map the file, empty files have no records
+        with open(fname, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if not self.map:
+            return
+
+        self.check_header()
+
+        # load the index if there is a current one
+        self.index = PacketIndex(fname)
+        self.indexed = self.index.load()
+
+    def check_header(self):
+        """Check the file header."""
+        if len(self.map) < 24:
+            raise RuntimeError("%s: truncated pcap file header" % (self.fname,))
+        magic = self.map[:4]
+        if magic not in _pcap_magic:
+            raise RuntimeError("%s: not a pcap file" % (self.fname,))
+        byte_order, self.resolution = _pcap_magic[magic]
+
+        self.record_header = struct.Struct(byte_order + "IIII")
+        self.linktype = struct.unpack_from(byte_order + "I", self.map, 20)[0]
+        if _debug:
+            PCAPFile._debug("    - linktype: %r", self.linktype)
+
+        # the packets are decoded as Ethernet frames
+        if self.linktype != LINKTYPE_ETHERNET:
+            raise RuntimeError(
+                "%s: unsupported link type %d" % (self.fname, self.linktype)
+            )
+
+    def __iter__(self):
+        for number, timestamp, data in self.records():
+            yield (timestamp, data)
+
+    def packets(self, position=None, stop=None):
+        """Walk through the record headers from the position, or the start of
+        the file, to the stop offset, or the end of the file, and yield
+        (position, timestamp, data offset, data length) for each packet."""
+        view = memoryview(self.map)
+        unpack_from = self.record_header.unpack_from
+        resolution = self.resolution
+        size = len(view)
+        if (stop is None) or (stop > size):
+            stop = size
+
+        offset, number = position or (24, 0)
+        self.position = (offset, number)
+        while offset + 16 <= stop:
+            ts_sec, ts_frac, incl_len, orig_len = unpack_from(view, offset)
+
+            # a partial record at the end of the file
+            if offset + 16 + incl_len > size:
+                if _debug:
+                    PCAPFile._debug("    - truncated record at %d", offset)
+                break
+
+            yield (
+                (offset, number),
+                ts_sec + ts_frac * resolution,
+                offset + 16,
+                incl_len,
+            )
+
+            offset += 16 + incl_len
+            number += 1
+            self.position = (offset, number)
+
+    def records(
+        self, first=None, last=None, start=None, end=None, position=None, stop=None
+    ):
+        """Yield (number, timestamp, data) tuples for the packets with numbers
+        in the range first..last and timestamps in the range start..end, where
+        the timestamps are expected to be increasing.  Reading starts at the
+        position and ends before the stop offset when they are given,
+        otherwise it starts at the closest checkpoint in the index."""
+        if _debug:
+            PCAPFile._debug(
+                "records first=%r last=%r start=%r end=%r position=%r stop=%r",
+                first,
+                last,
+                start,
+                end,
+                position,
+                stop,
+            )
+        if not self.map:
+            return
+
+        if position is None:
+            position = self.seek(first, start)
+
+        view = memoryview(self.map)
+        for position, timestamp, data_offset, data_len in self.packets(position, stop):
+            number = position[1] + 1
+            if (last is not None) and (number > last):
+                break
+            if (end is not None) and (timestamp > end):
+                break
+            if (first is not None) and (number < first):
+                continue
+            if (start is not None) and (timestamp < start):
+                continue
+
+            yield (number, timestamp, view[data_offset : data_offset + data_len])
+
+    def seek(self, first=None, start=None):
+        """Return the position of the last checkpoint before the packet number
+        first and the timestamp start, building the index if necessary, or
+        None to start at the beginning."""
+        if _debug:
+            PCAPFile._debug("seek first=%r start=%r", first, start)
+        if (first is None) and (start is None):
+            return None
+
+        if not self.indexed:
+            self.build_index()
+
+        checkpoint = self.index.find(first, start)
+        if _debug:
+            PCAPFile._debug("    - checkpoint: %r", checkpoint)
+        if not checkpoint:
+            return None
+
+        return self.checkpoint_position(checkpoint)
+
+    def checkpoint_position(self, checkpoint):
+        """Return the position of an index checkpoint."""
+        number, offset, section = checkpoint
+        return (offset, number - 1)
+
+    def build_index(self):
+        """Walk through the file adding checkpoints to a new index and save
+        it."""
+        if _debug:
+            PCAPFile._debug("build_index")
+
+        index = PacketIndex(self.fname)
+        interval = PacketIndex.interval
+
+        for position, timestamp, data_offset, data_len in self.packets():
+            number = position[1] + 1
+            if number % interval == 1:
+                index.add(
+                    number, timestamp, position[0], self.position_section(position)
+                )
+        index.sections = self.index_sections()
+
+        index.save()
+        self.index = index
+        self.indexed = True
+
+    def position_section(self, position):
+        """Return the section number of a position."""
+        return 0
+
+    def index_sections(self):
+        """Return the section information to save in an index."""
+        return []
+
+    def split(self, count):
+        """Return a list of (position, stop) tuples that divide the records
+        into about count ranges of the same size."""
+        if _debug:
+            PCAPFile._debug("split %r", count)
+        if not self.map:
+            return []
+
+        size = len(self.map)
+        chunk = max(1, size // count)
+
+        ranges = []
+        first_position = None
+        boundary = chunk
+        stop = None
+        for position, timestamp, data_offset, data_len in self.packets():
+            if first_position is None:
+                first_position = position
+            elif position[0] >= boundary:
+                ranges.append((first_position, position[0]))
+                first_position = position
+                boundary = position[0] + chunk
+            stop = data_offset + data_len
+        if first_position is not None:
+            ranges.append((first_position, stop))
+
+        if _debug:
+            PCAPFile._debug("    - ranges: %r", ranges)
+        return ranges
+
+    def close(self):
+        if _debug:
+            PCAPFile._debug("close")
+
+        if self.map:
+            try:
+                self.map.close()
+            except BufferError:
+                # records are still being referenced, let the garbage
+                # collector close the map when they are gone
+                pass
+            self.map = None
+
+
+#
+#   PCAPNGFile
+#
+
+
+@bacpypes_debugging
+class PCAPNGFile(PCAPFile):
+    """A pcapng file with one or more sections and interfaces, each
+    interface with its own link type and timestamp resolution.  A position
+    in the file is an (offset, number, section, byte order, interfaces) tuple
+    of the offset of a block, the number of packets before it, and the
+    section it is in."""
+
+    def check_header(self):
+        """Check the section header block at the start of the file."""
+        if self.map[:4] != _pcapng_shb:
+            raise RuntimeError("%s: not a pcapng file" % (self.fname,))
+
+        # the sections and interfaces as they are found
+        self.sections = []
+
+        # packets from an interface that is not Ethernet are skipped
+        self.skipped = False
+
+    def packets(self, position=None, stop=None):
+        """Walk through the blocks from the position, or the start of the
+        file, to the stop offset, or the end of the file, and yield
+        (position, timestamp, data offset, data length) for each packet."""
+        view = memoryview(self.map)
+        size = len(view)
+        if (stop is None) or (stop > size):
+            stop = size
+        timestamp = 0.0
+
+        if position:
+            offset, number, section, byte_order, interfaces = position
+            interfaces = tuple(interfaces)
+        else:
+            offset, number, section, byte_order, interfaces = 0, 0, -1, "<", ()
+        self.position = (offset, number, section, byte_order, interfaces)
+
+        while offset + 12 <= stop:
+            # new section, find its byte order
+            if view[offset : offset + 4] == _pcapng_shb:
+                byte_order = _pcapng_byte_order.get(
+                    bytes(view[offset + 8 : offset + 12])
+                )
+                if not byte_order:
+                    raise RuntimeError("%s: invalid section header" % (self.fname,))
+                section += 1
+                interfaces = ()
+                if section == len(self.sections):
+                    self.sections.append(
+                        {"offset": offset, "byte_order": byte_order, "interfaces": []}
+                    )
+
+            block_type, block_len = struct.unpack_from(byte_order + "II", view, offset)
+            if block_len < 12:
+                raise RuntimeError(
+                    "%s: invalid block length at %d" % (self.fname, offset)
+                )
+
+            # a partial block at the end of the file
+            if offset + block_len > size:
+                if _debug:
+                    PCAPNGFile._debug("    - truncated block at %d", offset)
+                break
+
+            if block_type == _EPB:
+                iface, ts_high, ts_low, cap_len, orig_len = struct.unpack_from(
+                    byte_order + "IIIII", view, offset + 8
+                )
+                linktype, scale, tsoffset = interfaces[iface]
+                timestamp = ((ts_high << 32) + ts_low) * scale + tsoffset
+                data_offset = offset + 28
+
+            elif block_type == _SPB:
+                (orig_len,) = struct.unpack_from(byte_order + "I", view, offset + 8)
+                linktype, scale, tsoffset = interfaces[0]
+                cap_len = min(orig_len, block_len - 16)
+                data_offset = offset + 12
+
+            elif block_type == _OPB:
+                iface, drops, ts_high, ts_low, cap_len, orig_len = struct.unpack_from(
+                    byte_order + "HHIIII", view, offset + 8
+                )
+                linktype, scale, tsoffset = interfaces[iface]
+                timestamp = ((ts_high << 32) + ts_low) * scale + tsoffset
+                data_offset = offset + 28
+
+            else:
+                if block_type == _IDB:
+                    interfaces += (self._interface(view, offset, byte_order),)
+                    if section < len(self.sections):
+                        self.sections[section]["interfaces"] = interfaces
+                offset += block_len
+                self.position = (offset, number, section, byte_order, interfaces)
+                continue
+
+            # skipped packets are still numbered so the numbers match Wireshark
+            if linktype != LINKTYPE_ETHERNET:
+                if not self.skipped:
+                    sys.stderr.write(
+                        "%s: skipping packets with link type %d\n"
+                        % (self.fname, linktype)
+                    )
+                    self.skipped = True
+
+                offset += block_len
+                number += 1
+                self.position = (offset, number, section, byte_order, interfaces)
+                continue
+
+            yield (
+                (offset, number, section, byte_order, interfaces),
+                timestamp,
+                data_offset,
+                cap_len,
+            )
+
+            offset += block_len
+            number += 1
+            self.position = (offset, number, section, byte_order, interfaces)
+
+    def checkpoint_position(self, checkpoint):
+        """Return the position of an index checkpoint."""
+        number, offset, section = checkpoint
+        info = self.index.sections[section]
+        return (offset, number - 1, section, info["byte_order"], info["interfaces"])
+
+    def position_section(self, position):
+        """Return the section number of a position."""
+        return position[2]
+
+    def index_sections(self):
+        """Return the section information to save in an index."""
+        return self.sections
+
+    def _interface(self, view, offset, byte_order):
+        """Return the (linktype, timestamp scale, timestamp offset) of an
+        interface description block."""
+        linktype, reserved, snaplen, block_len = struct.unpack_from(
+            byte_order + "HHI", view, offset + 8
+        ) + struct.unpack_from(byte_order + "I", view, offset + 4)
+        scale = 1e-6
+        tsoffset = 0
+
+        # look through the options
+        option_offset = offset + 16
+        option_end = offset + block_len - 4
+        while option_offset + 4 <= option_end:
+            code, length = struct.unpack_from(byte_order + "HH", view, option_offset)
+            if code == 0:
+                break
+            value_offset = option_offset + 4
+            if code == _if_tsresol:
+                resolution = view[value_offset]
+                if resolution & 0x80:
+                    scale = 2.0 ** -(resolution & 0x7F)
+                else:
+                    scale = 10.0**-resolution
+            elif code == _if_tsoffset:
+                (tsoffset,) = struct.unpack_from(byte_order + "q", view, value_offset)
+            option_offset = value_offset + ((length + 3) & ~3)
+
+        if _debug:
+            PCAPNGFile._debug("    - interface: %r %r %r", linktype, scale, tsoffset)
+        return (linktype, scale, tsoffset)
+
+
+#
+#   PCAPStream
+#
+
+
+@bacpypes_debugging
+class PCAPStream:
+    """A classic pcap file read from stdin or a named pipe as it arrives.  The
+    records can only be read once and there are no positions."""
+
+    def __init__(self, fname):
+        if _debug:
+            PCAPStream._debug("__init__ %r", fname)
+
+        self.fname = fname
+        self.linktype = LINKTYPE_ETHERNET
+        self.position = None
+
+        if fname == "-":
+            self.file = sys.stdin.buffer
+        else:
+            self.file = open(fname, "rb")
+
+        # wait for the file header, an empty stream has no records
+        header = self.file.read(24)
+        if not header:
+            self.record_header = None
+            return
+        if len(header) < 24:
+            raise RuntimeError("%s: truncated pcap file header" % (fname,))
+
+        magic = header[:4]
+        if magic == _pcapng_shb:
+            raise RuntimeError(
+                "%s: pcapng cannot be read from a stream, write classic pcap" % (fname,)
+            )
+        if magic not in _pcap_magic:
+            raise RuntimeError("%s: not a pcap file" % (fname,))
+        byte_order, self.resolution = _pcap_magic[magic]
+
+        self.record_header = struct.Struct(byte_order + "IIII")
+        self.linktype = struct.unpack_from(byte_order + "I", header, 20)[0]
+        if _debug:
+            PCAPStream._debug("    - linktype: %r", self.linktype)
+
+        # the packets are decoded as Ethernet frames
+        if self.linktype != LINKTYPE_ETHERNET:
+            raise RuntimeError("%s: unsupported link type %d" % (fname, self.linktype))
+
+    def __iter__(self):
+        for number, timestamp, data in self.records():
+            yield (timestamp, data)
+
+    def records(self, first=None, last=None, start=None, end=None):
+        """Yield (number, timestamp, data) tuples for the packets with numbers
+        in the range first..last and timestamps in the range start..end as
+        they are read."""
+        if _debug:
+            PCAPStream._debug(
+                "records first=%r last=%r start=%r end=%r", first, last, start, end
+            )
+        if not self.record_header:
+            return
+
+        read = self.file.read
+        unpack = self.record_header.unpack
+        resolution = self.resolution
+
+        number = 0
+        while True:
+            header = read(16)
+            if len(header) < 16:
+                break
+            ts_sec, ts_frac, incl_len, orig_len = unpack(header)
+
+            data = read(incl_len)
+            if len(data) < incl_len:
+                if _debug:
+                    PCAPStream._debug("    - truncated record")
+                break
+
+            number += 1
+            timestamp = ts_sec + ts_frac * resolution
+            if (last is not None) and (number > last):
+                break
+            if (end is not None) and (timestamp > end):
+                break
+            if (first is not None) and (number < first):
+                continue
+            if (start is not None) and (timestamp < start):
+                continue
+
+            yield (number, timestamp, data)
+
+    def split(self, count):
+        raise RuntimeError("%s: a stream cannot be split" % (self.fname,))
+
+    def close(self):
+        if _debug:
+            PCAPStream._debug("close")
+
+        if self.file and (self.file is not sys.stdin.buffer):
+            self.file.close()
+        self.file = None
+
+
+#
+#   is_stream
+#
+
+
+def is_stream(fname):
+    """Return true if the file name is stdin or a named pipe."""
+    if fname == "-":
+        return True
+    return stat.S_ISFIFO(os.stat(fname).st_mode)
+
+
+#
+#   open_pcap
+#
+
+
+def open_pcap(fname):
+    """Return a PCAPStream, PCAPFile or PCAPNGFile depending on the file name
+    and contents."""
+    if is_stream(fname):
+        return PCAPStream(fname)
+
+    with open(fname, "rb") as f:
+        magic = f.read(4)
+
+    if magic == _pcapng_shb:
+        return PCAPNGFile(fname)
+    return PCAPFile(fname)
@@ -0,0 +1,1008 @@
+#!/usr/bin/python
+
+"""
+PCAP Trace - Decoding pcap files for tracers
+
+This is a replacement for the decode_file() and trace() functions in the
+bacpypes.analysis module.  Tracer classes can have a pduTypes attribute that
+lists the PDU classes they are interested in, and when every tracer has one,
+packets that none of them want are skipped by looking at the raw bytes rather
+than being fully decoded.
+
+The --start and --end options limit the packets to a range of time, and
+reading starts near the first one rather than at the beginning of the file.
+
+When a file is read from stdin or a named pipe, the --report-interval option
+prints the results so far every so many seconds of capture time.
+
+The --filter option is an expression about each decoded packet, see the
+filterexpr module, and packets that do not match are not given to the
+tracers.
+
+When the --source, --destination and --host options are BACnet/IP stations
+they are also checked in the raw bytes of each packet, like a BPF program
+given to libpcap, so packets from other stations are skipped without being
+decoded.  The --port option only keeps UDP packets to or from that port.
+
+Polling traffic is very repetitive, the same request is sent to the same
+device over and over with only the invoke ID changing.  The --memo option
+keeps that many decoded packets, and a packet with the same addresses and
+contents as one of them is copied rather than decoded again.  The number of
+hits and misses is printed to stderr when each file is done.
+
+Files are traced one after another, unless there is a --merge option, then
+the packets of all of the files are given to the tracers in timestamp order.
+This is for captures taken at the same time in different places, or files
+from a capture rotation that overlap, where a request in one file is
+answered in another.  The packet numbers are still the numbers within each
+file.
+
+When several switch ports are mirrored to the capture the same packet can be
+captured more than once a few microseconds apart.  The --dedup option is a
+number of seconds, and a packet with the same IP addresses, ports and
+contents as one captured less than that long before it is skipped.  The
+number of duplicates is printed to stderr.
+"""
+
+import sys
+import copy
+import time
+import argparse
+import heapq
+import operator
+import datetime
+from collections import OrderedDict, deque
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+from bacpypes.pdu import Address
+from bacpypes.bvll import BVLPDU
+from bacpypes.npdu import NPDU
+from bacpypes.analysis import decode_packet, strftimestamp
+
+from pcapfile import open_pcap, is_stream
+from decodecache import cacheable, cached_packets, pdu_classes
+from filterexpr import compile_filter
+from addrmatch import parse_addresses
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# BVLL functions that carry an NPDU and the offset of the NPDU
+_bvll_npdu_offset = {
+    0x04: 10,  # Forwarded-NPDU
+    0x09: 4,  # Distribute-Broadcast-To-Network
+    0x0A: 4,  # Original-Unicast-NPDU
+    0x0B: 4,  # Original-Broadcast-NPDU
+}
+
+# formats accepted for --start and --end, in local time
+_timestamp_formats = (
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%d-%b-%Y %H:%M:%S.%f",
+    "%d-%b-%Y %H:%M:%S",
+    "%d-%b-%Y %H:%M",
+)
+
+#
+#   strptimestamp
+#
+
+
+def strptimestamp(s):
+    """Convert a local date and time like '2020-01-31 13:45:00' or
+    '31-Jan-2020 13:45:00.25', or a number of seconds since the epoch, into a
+    timestamp.  This is the reverse of strftimestamp()."""
+    try:
+        return float(s)
+    except ValueError:
+        pass
+
+    for fmt in _timestamp_formats:
+        try:
+            when = datetime.datetime.strptime(s, fmt)
+        except ValueError:
+            continue
+        return time.mktime(when.timetuple()) + when.microsecond / 1000000.0
+
+    raise ValueError("invalid timestamp: %r" % (s,))
+
+
+#
+#   filter_expression
+#
+
+
+def filter_expression(s):
+    """Check a --filter expression and return it."""
+    try:
+        compile_filter(s)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+    return s
+
+
+#
+#   add_arguments
+#
+
+
+def add_arguments(parser):
+    """Add the options that select the packets to read from each file."""
+    parser.add_argument(
+        "--start", type=strptimestamp, help="skip packets before this time"
+    )
+    parser.add_argument("--end", type=strptimestamp, help="stop after this time")
+    parser.add_argument(
+        "--cache", action="store_true", help="keep decoded packets in a cache file"
+    )
+    parser.add_argument(
+        "--report-interval", type=float, help="seconds between rolling reports"
+    )
+    parser.add_argument(
+        "--filter", type=filter_expression, help="expression packets must match"
+    )
+    parser.add_argument("--port", type=int, help="UDP source or destination port")
+    parser.add_argument(
+        "--memo", type=int, help="number of decoded packets to remember"
+    )
+    parser.add_argument(
+        "--merge", action="store_true", help="merge the files in timestamp order"
+    )
+    parser.add_argument(
+        "--dedup", type=float, help="skip copies captured within this many seconds"
+    )
+
+
+#
+#   decode_options
+#
+
+
+def decode_options(args):
+    """Return the keyword arguments for decode_file() from the command line
+    arguments."""
+    return {
+        "start": getattr(args, "start", None),
+        "end": getattr(args, "end", None),
+        "prefilter": endpoint_filter(
+            getattr(args, "source", None),
+            getattr(args, "destination", None),
+            getattr(args, "host", None),
+            getattr(args, "port", None),
+        ),
+        "memo": DecodeMemo(args.memo) if getattr(args, "memo", None) else None,
+        "dedup": Deduplicator(args.dedup) if getattr(args, "dedup", None) else None,
+    }
+
+
+#
+#   trace_options
+#
+
+
+def trace_options(args):
+    """Return the keyword arguments for trace() from the command line
+    arguments."""
+    options = decode_options(args)
+
+    # the decode cache cannot continue from a checkpoint
+    options["cache"] = getattr(args, "cache", False) and not getattr(
+        args, "checkpoint", None
+    )
+    options["interval"] = getattr(args, "report_interval", None)
+
+    # each process compiles the expression for itself
+    expression = getattr(args, "filter", None)
+    options["match"] = compile_filter(expression) if expression else None
+
+    return options
+
+
+#
+#   classify
+#
+
+
+def classify(data):
+    """Look at the raw bytes of an Ethernet frame (bytes or a memoryview)
+    and return a key that identifies the kind of BACnet message it carries,
+    or None if it cannot be classified.  APDU keys are (pduType, service
+    choice) and network layer message keys are ("npdu", message type).  The
+    headers are checked the same way decode_packet() checks them."""
+    try:
+        # skip the Ethernet header and a VLAN header
+        etype = (data[12] << 8) + data[13]
+        offset = 14
+        if etype == 0x8100:
+            etype = (data[16] << 8) + data[17]
+            offset = 18
+
+        # skip the IP header, and the UDP header if there is one
+        if etype == 0x0800:
+            protocol = data[offset + 9]
+            offset += (data[offset] & 0x0F) * 4
+            if protocol == 17:
+                offset += 8
+
+        # BVLL header
+        if data[offset] == 0x81:
+            function = data[offset + 1]
+            npdu_offset = _bvll_npdu_offset.get(function)
+            if npdu_offset is None:
+                return ("bvll", function)
+            offset += npdu_offset
+
+        # NPDU header, version 1 only
+        if data[offset] != 0x01:
+            return None
+        control = data[offset + 1]
+        offset += 2
+        if control & 0x20:
+            offset += 3 + data[offset + 2]
+        if control & 0x08:
+            offset += 3 + data[offset + 2]
+        if control & 0x20:
+            offset += 1
+
+        # network layer message
+        if control & 0x80:
+            return ("npdu", data[offset])
+
+        # APDU header
+        pdu_type = data[offset] >> 4
+        if pdu_type == 0x00:
+            if data[offset] & 0x08:
+                return (0, data[offset + 5])
+            return (0, data[offset + 3])
+        elif pdu_type == 0x01:
+            return (1, data[offset + 1])
+        elif pdu_type in (0x02, 0x05):
+            return (pdu_type, data[offset + 2])
+        elif pdu_type == 0x03:
+            if data[offset] & 0x08:
+                return (3, data[offset + 4])
+            return (3, data[offset + 2])
+        else:
+            return (pdu_type, None)
+
+    except IndexError:
+        return None
+
+
+#
+#   EndpointFilter
+#
+
+
+@bacpypes_debugging
+class EndpointFilter:
+    """Check the IP addresses and UDP ports in the raw bytes of a packet.
+    Each set of endpoints is the six byte address and port of BACnet/IP
+    stations, or None when the option is not given or the addresses can only
+    be checked after decoding.  When the BACnet address of a packet is not
+    the IP address, like the source of a Forwarded-NPDU or an address in the
+    NPDU header, it is found in the same place the decoder finds it, and
+    packets that cannot be parsed are passed along to the decoder."""
+
+    def __init__(self, sources=None, destinations=None, hosts=None, port=None):
+        if _debug:
+            EndpointFilter._debug(
+                "__init__ %r %r %r %r", sources, destinations, hosts, port
+            )
+
+        self.sources = sources
+        self.destinations = destinations
+        self.hosts = hosts
+        self.port = port
+
+    def __call__(self, data):
+        """Return false if the packet does not match."""
+        try:
+            # skip the Ethernet header and a VLAN header
+            etype = (data[12] << 8) + data[13]
+            offset = 14
+            if etype == 0x8100:
+                etype = (data[16] << 8) + data[17]
+                offset = 18
+
+            # only UDP packets have a port, anything else is decoded
+            if (etype != 0x0800) or (data[offset + 9] != 17):
+                return self.port is None
+            udp = offset + (data[offset] & 0x0F) * 4
+
+            if self.port is not None:
+                if (self.port != (data[udp] << 8) + data[udp + 1]) and (
+                    self.port != (data[udp + 2] << 8) + data[udp + 3]
+                ):
+                    return False
+
+            if (self.sources, self.destinations, self.hosts) == (None, None, None):
+                return True
+
+            # the addresses as decode_packet() would find them
+            source = bytes(data[offset + 12 : offset + 16]) + bytes(data[udp : udp + 2])
+            destination = bytes(data[offset + 16 : offset + 20]) + bytes(
+                data[udp + 2 : udp + 4]
+            )
+
+            npdu = udp + 8
+            if data[npdu] == 0x81:
+                function = data[npdu + 1]
+                if function == 0x04:
+                    source = bytes(data[npdu + 4 : npdu + 10])
+                npdu_offset = _bvll_npdu_offset.get(function)
+                if npdu_offset is None:
+                    npdu = None
+                else:
+                    npdu += npdu_offset
+
+            # remote stations are only matched after decoding
+            if (npdu is not None) and (data[npdu] == 0x01):
+                if data[npdu + 1] & 0x08:
+                    source = None
+                if data[npdu + 1] & 0x20:
+                    destination = None
+
+        except IndexError:
+            return True
+
+        if (self.sources is not None) and (source is not None):
+            if source not in self.sources:
+                return False
+        if (self.destinations is not None) and (destination is not None):
+            if destination not in self.destinations:
+                return False
+        if (
+            (self.hosts is not None)
+            and (source is not None)
+            and (destination is not None)
+        ):
+            if (source not in self.hosts) and (destination not in self.hosts):
+                return False
+
+        return True
+
+    def __str__(self):
+        """Return the BPF expression that does the same thing."""
+        terms = []
+        if self.port is not None:
+            terms.append("udp port %d" % (self.port,))
+
+        for endpoints, direction in (
+            (self.sources, "src "),
+            (self.destinations, "dst "),
+            (self.hosts, ""),
+        ):
+            if endpoints is None:
+                continue
+            hosts = []
+            for endpoint in sorted(endpoints):
+                ip = ".".join(str(octet) for octet in endpoint[:4])
+                port = (endpoint[4] << 8) + endpoint[5]
+                if direction:
+                    hosts.append(
+                        "%shost %s and %sport %d" % (direction, ip, direction, port)
+                    )
+                else:
+                    hosts.append(
+                        "src host %s and src port %d or dst host %s and dst port %d"
+                        % (ip, port, ip, port)
+                    )
+            terms.append("(%s)" % (" or ".join(hosts),))
+
+        return " and ".join(terms)
+
+
+#
+#   endpoint_filter
+#
+
+
+def _endpoints(spec):
+    """Return the set of BACnet/IP endpoints of the addresses in an option,
+    or None if there are other kinds of addresses."""
+    if not spec:
+        return None
+
+    addresses = parse_addresses(spec)
+    if all(
+        (addr.addrType == Address.localStationAddr) and (len(addr.addrAddr) == 6)
+        for addr in addresses
+    ):
+        return set(addr.addrAddr for addr in addresses)
+
+    return None
+
+
+@bacpypes_debugging
+def endpoint_filter(source=None, destination=None, host=None, port=None):
+    """Return an EndpointFilter for the values of the options, or None if none
+    of them can be checked in the raw bytes."""
+    if _debug:
+        endpoint_filter._debug(
+            "endpoint_filter %r %r %r %r", source, destination, host, port
+        )
+
+    prefilter = EndpointFilter(
+        _endpoints(source), _endpoints(destination), _endpoints(host), port
+    )
+    if (prefilter.sources, prefilter.destinations, prefilter.hosts, port) == (
+        None,
+        None,
+        None,
+        None,
+    ):
+        return None
+    if _debug:
+        endpoint_filter._debug("    - bpf: %s", prefilter)
+
+    return prefilter
+
+
+#
+#   use_cache
+#
+
+
+def use_cache(fname, tracers, match=None, prefilter=None, dedup=None):
+    """Return true if the packets of a file can come from the decode cache,
+    the cache has the fields the tracers and the match function need, the
+    file is not a stream, there is no port to check in the raw bytes, and
+    duplicates are not being skipped."""
+    if prefilter and (prefilter.port is not None):
+        return False
+    if dedup:
+        return False
+    return cacheable(tracers, match) and not is_stream(fname)
+
+
+#
+#   DecodeMemo
+#
+
+
+@bacpypes_debugging
+class DecodeMemo:
+    """A least recently used cache of decoded packets.  The key is the raw
+    bytes of the packet without the fields in the IP and UDP headers that
+    change from one packet to the next, and with the invoke ID masked out, so
+    a repeated request or response matches the first one."""
+
+    def __init__(self, size):
+        if _debug:
+            DecodeMemo._debug("__init__ %r", size)
+
+        self.size = size
+        self.packets = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data):
+        """Return the key and the offset of the invoke ID, which is None if
+        there is not one, or (None, None) if the packet cannot be parsed."""
+        try:
+            # skip the Ethernet header and a VLAN header
+            etype = (data[12] << 8) + data[13]
+            offset = 14
+            if etype == 0x8100:
+                etype = (data[16] << 8) + data[17]
+                offset = 18
+
+            # leave out the IP identification, time to live, and checksums
+            if etype == 0x0800:
+                protocol = data[offset + 9]
+                header_end = offset + (data[offset] & 0x0F) * 4
+                key = (
+                    bytes(data[: offset + 4])
+                    + bytes(data[offset + 6 : offset + 8])
+                    + bytes(data[offset + 9 : offset + 10])
+                    + bytes(data[offset + 12 : header_end])
+                )
+                offset = header_end
+                if protocol == 17:
+                    key += bytes(data[offset : offset + 6])
+                    offset += 8
+            else:
+                key = bytes(data[:offset])
+
+            # find the APDU
+            apdu = offset
+            if data[apdu] == 0x81:
+                npdu_offset = _bvll_npdu_offset.get(data[apdu + 1])
+                if npdu_offset is None:
+                    return (key + bytes(data[offset:]), None)
+                apdu += npdu_offset
+            if data[apdu] != 0x01:
+                return (key + bytes(data[offset:]), None)
+            control = data[apdu + 1]
+            apdu += 2
+            if control & 0x20:
+                apdu += 3 + data[apdu + 2]
+            if control & 0x08:
+                apdu += 3 + data[apdu + 2]
+            if control & 0x20:
+                apdu += 1
+            if control & 0x80:
+                return (key + bytes(data[offset:]), None)
+
+            # the invoke ID is the third octet of a confirmed request and
+            # the second of everything else but unconfirmed requests
+            pdu_type = data[apdu] >> 4
+            if pdu_type == 0x00:
+                invoke_id = apdu + 2
+            elif pdu_type == 0x01:
+                return (key + bytes(data[offset:]), None)
+            else:
+                invoke_id = apdu + 1
+            data[invoke_id]
+
+            key += bytes(data[offset:invoke_id]) + b"\0" + bytes(data[invoke_id + 1 :])
+            return (key, invoke_id)
+
+        except IndexError:
+            return (None, None)
+
+    def decode(self, data):
+        """Return a copy of the packet decoded from the same bytes, or decode
+        it and remember it."""
+        key, invoke_id = self.key(data)
+        if key is None:
+            return decode_packet(bytes(data))
+
+        pkt = self.packets.get(key)
+        if pkt is not None:
+            self.hits += 1
+            self.packets.move_to_end(key)
+
+            pkt = copy.copy(pkt)
+            if invoke_id is not None:
+                pkt.apduInvokeID = data[invoke_id]
+            return pkt
+
+        self.misses += 1
+        pkt = decode_packet(bytes(data))
+        if pkt:
+            self.packets[key] = pkt
+            if len(self.packets) > self.size:
+                self.packets.popitem(last=False)
+
+        return pkt
+
+    def report(self, fname):
+        """Print the hits and misses since the last report."""
+        sys.stderr.write(
+            "%s: %d decode memo hits, %d misses\n" % (fname, self.hits, self.misses)
+        )
+        self.hits = self.misses = 0
+
+
+#
+#   Deduplicator
+#
+
+
+@bacpypes_debugging
+class Deduplicator:
+    """Skip the copies of a packet that are captured within a window of time.
+    The hash of each packet is kept in a ring of the most recent ones with a
+    dictionary of the last time each hash was seen, so checking a packet
+    takes the same time no matter how many there are."""
+
+    def __init__(self, window, size=65536):
+        if _debug:
+            Deduplicator._debug("__init__ %r size=%r", window, size)
+
+        self.window = window
+        self.size = size
+
+        self.ring = deque()
+        self.seen = {}
+
+        self.duplicates = 0
+
+    def key(self, data):
+        """Return the hash of the packet from the IP source address to the
+        end of the IP packet, the link layer header, time to live and IP
+        checksum are different when the packet has been routed between the
+        mirrored ports."""
+        try:
+            etype = (data[12] << 8) + data[13]
+            offset = 14
+            if etype == 0x8100:
+                etype = (data[16] << 8) + data[17]
+                offset = 18
+            if etype != 0x0800:
+                return hash(bytes(data[offset:]))
+
+            end = offset + (data[offset + 2] << 8) + data[offset + 3]
+            return hash(bytes(data[offset + 12 : end]))
+        except IndexError:
+            return hash(bytes(data))
+
+    def duplicate(self, timestamp, data):
+        """Return true if the packet is a copy of one seen within the window,
+        otherwise remember it."""
+        key = self.key(data)
+
+        last = self.seen.get(key)
+        if (last is not None) and (abs(timestamp - last) <= self.window):
+            self.duplicates += 1
+            return True
+
+        self.seen[key] = timestamp
+        self.ring.append((key, timestamp))
+
+        # forget the oldest one unless it has been seen again since
+        if len(self.ring) > self.size:
+            key, timestamp = self.ring.popleft()
+            if self.seen[key] == timestamp:
+                del self.seen[key]
+
+        return False
+
+    def report(self, fname):
+        """Print the number of duplicates since the last report."""
+        sys.stderr.write("%s: %d duplicates skipped\n" % (fname, self.duplicates))
+        self.duplicates = 0
+
+
+#
+#   report_stats
+#
+
+
+def report_stats(fname, memo=None, dedup=None):
+    """Print the decode memo hits and misses if it was used, and the number of
+    duplicates if they are being skipped."""
+    if memo and (memo.hits or memo.misses):
+        memo.report(fname)
+    if dedup:
+        dedup.report(fname)
+
+
+#
+#   wanted_keys
+#
+
+
+@bacpypes_debugging
+def wanted_keys(tracers):
+    """Given a list of tracer classes, return the set of keys that one or
+    more of them need, or None if there is a tracer that needs everything."""
+    if _debug:
+        wanted_keys._debug("wanted_keys %r", tracers)
+
+    keys = set()
+    for tracer in tracers:
+        pdu_types = getattr(tracer, "pduTypes", None)
+        if pdu_types is None:
+            if _debug:
+                wanted_keys._debug("    - everything: %r", tracer)
+            return None
+
+        for pdu_type in pdu_types:
+            if issubclass(pdu_type, NPDU):
+                keys.add(("npdu", pdu_type.messageType))
+            elif issubclass(pdu_type, BVLPDU):
+                keys.add(("bvll", pdu_type.messageType))
+            elif getattr(pdu_type, "pduType", None) is not None:
+                keys.add((pdu_type.pduType, getattr(pdu_type, "serviceChoice", None)))
+            else:
+                if _debug:
+                    wanted_keys._debug("    - everything: %r", pdu_type)
+                return None
+
+    if _debug:
+        wanted_keys._debug("    - keys: %r", keys)
+    return keys
+
+
+#
+#   decode_file
+#
+
+
+def _decode(data):
+    return decode_packet(bytes(data))
+
+
+@bacpypes_debugging
+def decode_records(records, keys=None, prefilter=None, memo=None, dedup=None):
+    """Given an iterable of (number, timestamp, data) records, decode them
+    and yield each packet.  If there is a set of keys, packets that are
+    classified as something else are skipped without being decoded, and so
+    are packets that the prefilter function rejects and duplicates.  Packets
+    are decoded by the memo when there is one."""
+    if _debug:
+        decode_records._debug(
+            "decode_records %r keys=%r prefilter=%r memo=%r dedup=%r",
+            records,
+            keys,
+            prefilter,
+            memo,
+            dedup,
+        )
+
+    decode = memo.decode if memo else _decode
+
+    # loop through the packets
+    for number, timestamp, data in records:
+        if dedup and dedup.duplicate(timestamp, data):
+            continue
+        if prefilter and not prefilter(data):
+            continue
+        if keys is not None:
+            key = classify(data)
+            if (key is not None) and (key not in keys) and ((key[0], None) not in keys):
+                continue
+
+        try:
+            pkt = decode(data)
+            if not pkt:
+                continue
+        except Exception as err:
+            if _debug:
+                decode_records._debug(
+                    "    - exception decoding packet %d: %r", number, err
+                )
+            continue
+
+        # save the packet number (as viewed in Wireshark) and timestamp
+        pkt._number = number
+        pkt._timestamp = timestamp
+
+        yield pkt
+
+
+@bacpypes_debugging
+def decode_file(
+    fname, keys=None, prefilter=None, memo=None, dedup=None, checkpoint=None, **kwargs
+):
+    """Given the name of a pcap or pcapng file, open it, decode the contents
+    and yield each packet, see decode_records().  When the packets have been
+    read the position after the last one is saved in the checkpoint if there
+    is one.  The other keyword arguments select the records to read."""
+    if _debug:
+        decode_file._debug(
+            "decode_file %r keys=%r prefilter=%r memo=%r dedup=%r checkpoint=%r %r",
+            fname,
+            keys,
+            prefilter,
+            memo,
+            dedup,
+            checkpoint,
+            kwargs,
+        )
+
+    # open the file, the records are views of the mapped file
+    p = open_pcap(fname)
+
+    try:
+        for pkt in decode_records(p.records(**kwargs), keys, prefilter, memo, dedup):
+            yield pkt
+
+        if checkpoint:
+            checkpoint.update(fname, p.position)
+    finally:
+        p.close()
+
+
+#
+#   trace_packets
+#
+
+
+@bacpypes_debugging
+def trace_packets(packets, tracers, report=None, interval=None, match=None):
+    """Give each packet that matches, or every packet when there is no match
+    function, to each of the tracers.  When there is an interval, every
+    interval seconds of capture time the report function is called with the
+    results so far and the output is flushed."""
+    if _debug:
+        trace_packets._debug(
+            "trace_packets %r %r %r %r %r", packets, tracers, report, interval, match
+        )
+
+    # make a list of tracers
+    current_tracers = [traceClass() for traceClass in tracers]
+
+    next_report = None
+    for pkt in packets:
+        if interval:
+            if next_report is None:
+                next_report = pkt._timestamp + interval
+            elif pkt._timestamp >= next_report:
+                if report:
+                    print("----- %s -----" % (strftimestamp(pkt._timestamp),))
+                    print("")
+                    report()
+                    print("")
+                sys.stdout.flush()
+
+                while next_report <= pkt._timestamp:
+                    next_report += interval
+
+        if match and not match(pkt):
+            continue
+
+        for i, tracer in enumerate(current_tracers):
+            # give the packet to the tracer
+            tracer.current_state(pkt)
+
+            # if there is no current state, make a new one
+            if not tracer.current_state:
+                current_tracers[i] = tracers[i]()
+
+
+#
+#   file_packets
+#
+
+
+def file_packets(
+    fname,
+    tracers,
+    cache=False,
+    match=None,
+    prefilter=None,
+    memo=None,
+    dedup=None,
+    **kwargs
+):
+    """Return an iterator of the packets of the file for the tracers, from
+    the decode cache when it is requested and use_cache() says it can be
+    used."""
+    if cache and use_cache(fname, tracers, match, prefilter, dedup):
+        return cached_packets(fname, pdu_classes(tracers), **kwargs)
+    else:
+        return decode_file(
+            fname, wanted_keys(tracers), prefilter, memo, dedup, **kwargs
+        )
+
+
+#
+#   merge_records
+#
+
+_record_timestamp = operator.itemgetter(1)
+
+
+def merge_records(fnames, **kwargs):
+    """Open the files and yield the (number, timestamp, data) records of all
+    of them in timestamp order, only the next record of each one is kept.
+    The keyword arguments select the records to read from each file."""
+    readers = []
+    try:
+        for fname in fnames:
+            readers.append(open_pcap(fname))
+
+        records = [p.records(**kwargs) for p in readers]
+        for record in heapq.merge(*records, key=_record_timestamp):
+            yield record
+    finally:
+        for p in readers:
+            p.close()
+
+
+#
+#   merge_packets
+#
+
+_packet_timestamp = operator.attrgetter("_timestamp")
+
+
+def merge_packets(iterables):
+    """Given iterables of packets that are each in timestamp order, yield all
+    of the packets in timestamp order.  Only the next packet of each one is
+    kept, and packets with the same timestamp come in the order of the
+    iterables."""
+    return heapq.merge(*iterables, key=_packet_timestamp)
+
+
+#
+#   trace
+#
+
+
+@bacpypes_debugging
+def trace(
+    fname,
+    tracers,
+    cache=False,
+    report=None,
+    interval=None,
+    match=None,
+    prefilter=None,
+    memo=None,
+    dedup=None,
+    **kwargs
+):
+    """Decode the file and give each packet to each of the tracers.  The
+    report, interval and match function are passed to trace_packets(), and
+    the rest of the arguments are passed to file_packets()."""
+    if _debug:
+        trace._debug(
+            "trace %r %r cache=%r report=%r interval=%r match=%r prefilter=%r"
+            " memo=%r dedup=%r %r",
+            fname,
+            tracers,
+            cache,
+            report,
+            interval,
+            match,
+            prefilter,
+            memo,
+            dedup,
+            kwargs,
+        )
+
+    packets = file_packets(
+        fname, tracers, cache, match, prefilter, memo, dedup, **kwargs
+    )
+    trace_packets(packets, tracers, report, interval, match)
+
+    report_stats(fname, memo, dedup)
+
+
+#
+#   trace_merged
+#
+
+
+@bacpypes_debugging
+def trace_merged(
+    fnames,
+    tracers,
+    cache=False,
+    report=None,
+    interval=None,
+    match=None,
+    prefilter=None,
+    memo=None,
+    dedup=None,
+    **kwargs
+):
+    """Decode the files together and give the packets of all of them to each
+    of the tracers in timestamp order.  The arguments are the same as for
+    trace().  Unless they all come from the decode cache, the records of
+    the files are merged before they are decoded, so duplicates are found
+    in the order they were captured."""
+    if _debug:
+        trace_merged._debug(
+            "trace_merged %r %r cache=%r report=%r interval=%r match=%r"
+            " prefilter=%r memo=%r dedup=%r %r",
+            fnames,
+            tracers,
+            cache,
+            report,
+            interval,
+            match,
+            prefilter,
+            memo,
+            dedup,
+            kwargs,
+        )
+
+    if cache and all(
+        use_cache(fname, tracers, match, prefilter, dedup) for fname in fnames
+    ):
+        packets = merge_packets(
+            [cached_packets(fname, pdu_classes(tracers), **kwargs) for fname in fnames]
+        )
+    else:
+        packets = decode_records(
+            merge_records(fnames, **kwargs),
+            wanted_keys(tracers),
+            prefilter,
+            memo,
+            dedup,
+        )
+    trace_packets(packets, tracers, report, interval, match)
+
+    report_stats(", ".join(fnames), memo, dedup)
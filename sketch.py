@@ -0,0 +1,203 @@
+#!/usr/bin/python
+
+"""
+Sketch - Summaries of large captures in a fixed amount of memory
+
+Keeping every response time to find the median or the 99th percentile takes
+memory in proportion to the number of transactions.  A latency sketch counts
+the values in buckets whose bounds grow by a constant ratio, like an HDR
+histogram, so any quantile it returns is within a relative accuracy of the
+true value (one percent by default) and the number of buckets only depends
+on the range of the values, a few hundred between a millisecond and a
+minute.  Two sketches with the same accuracy are merged by adding their
+bucket counts, so the sketches of the client and server pairs can be added
+together for a server.
+
+Counting every key, like each object that sends COV notifications, takes
+memory in proportion to the number of keys.  The Space-Saving summary keeps a
+fixed number of counters and when a new key arrives and they are all in use
+the smallest one is given to the new key, so the keys that are seen most
+often are always kept.  Each count is never less than the true count and at
+most the total divided by the number of counters more, and the summaries
+from different processes can be merged.
+"""
+
+import math
+import heapq
+import itertools
+from collections import defaultdict
+
+# values at or below this many seconds are counted together
+minimum_value = 1e-6
+
+#
+#   LatencySketch
+#
+
+
+class LatencySketch:
+    """A histogram of response times in seconds with logarithmic buckets."""
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1.0 + accuracy) / (1.0 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        # bucket index to count, bucket i holds (gamma**(i-1), gamma**i]
+        self.buckets = defaultdict(int)
+        self.zero = 0
+
+        self.count = 0
+        self.maximum = None
+
+    def add(self, value, count=1):
+        """Add a value to the sketch."""
+        if value <= minimum_value:
+            self.zero += count
+        else:
+            self.buckets[int(math.ceil(math.log(value) / self.log_gamma))] += count
+
+        self.count += count
+        if (self.maximum is None) or (value > self.maximum):
+            self.maximum = value
+
+    def merge(self, other):
+        """Add the counts of another sketch with the same accuracy."""
+        if other.accuracy != self.accuracy:
+            raise ValueError("sketches have different accuracy")
+
+        for index, count in other.buckets.items():
+            self.buckets[index] += count
+        self.zero += other.zero
+
+        self.count += other.count
+        if (other.maximum is not None) and (
+            (self.maximum is None) or (other.maximum > self.maximum)
+        ):
+            self.maximum = other.maximum
+
+    def quantiles(self, fractions):
+        """Return the values at each of the fractions, like 0.5 for the
+        median, or None for each one when the sketch is empty."""
+        if not self.count:
+            return [None] * len(fractions)
+
+        # the rank of each value, walked in order
+        ranks = sorted(
+            (int(fraction * (self.count - 1)), i)
+            for i, fraction in enumerate(fractions)
+        )
+        values = [None] * len(fractions)
+
+        seen = self.zero
+        buckets = iter(sorted(self.buckets.items()))
+        value = 0.0
+        for rank, i in ranks:
+            while seen <= rank:
+                index, count = next(buckets)
+                seen += count
+
+                # the middle of the bucket in relative terms
+                value = 2.0 * self.gamma**index / (self.gamma + 1.0)
+
+            values[i] = min(value, self.maximum)
+
+        return values
+
+
+#
+#   SpaceSaving
+#
+
+
+class SpaceSaving:
+    """Approximate counts of the most frequent keys using a fixed number of
+    counters."""
+
+    def __init__(self, size):
+        self.size = size
+
+        # key to [count, error], the count is at most error too high
+        self.counts = {}
+
+        # (count, sequence, key) for each key, the count may be out of date
+        # but never too high, the sequence keeps the keys from being compared
+        self.heap = []
+        self.sequence = itertools.count()
+
+        self.total = 0
+
+    def add(self, key, count=1):
+        """Count a key."""
+        self.total += count
+
+        entry = self.counts.get(key)
+        if entry:
+            entry[0] += count
+            return
+
+        # take the smallest counter when they are all in use
+        error = 0
+        if len(self.counts) >= self.size:
+            error = self.evict()
+
+        self.counts[key] = [error + count, error]
+        heapq.heappush(self.heap, (error + count, next(self.sequence), key))
+
+    def evict(self):
+        """Remove the key with the smallest count and return the count."""
+        heap = self.heap
+        while True:
+            count, sequence, key = heap[0]
+            current = self.counts[key][0]
+            if current == count:
+                break
+            heapq.heapreplace(heap, (current, sequence, key))
+
+        heapq.heappop(heap)
+        del self.counts[key]
+        return count
+
+    def minimum(self):
+        """Return the most a key that is not counted could have been seen."""
+        if len(self.counts) < self.size:
+            return 0
+        return min(count for count, error in self.counts.values())
+
+    def merge(self, other):
+        """Add the counts of another summary.  A key that one of them does
+        not have could have been seen as often as its smallest count."""
+        self_minimum = self.minimum()
+        other_minimum = other.minimum()
+
+        counts = {}
+        for key, (count, error) in self.counts.items():
+            if key in other.counts:
+                other_count, other_error = other.counts[key]
+            else:
+                other_count = other_error = other_minimum
+            counts[key] = [count + other_count, error + other_error]
+        for key, (count, error) in other.counts.items():
+            if key not in counts:
+                counts[key] = [count + self_minimum, error + self_minimum]
+
+        # keep the largest
+        self.size = max(self.size, other.size)
+        if len(counts) > self.size:
+            largest = heapq.nlargest(
+                self.size, counts.items(), key=lambda item: item[1][0]
+            )
+            counts = dict(largest)
+        self.counts = counts
+        self.total += other.total
+
+        self.heap = [
+            (count, next(self.sequence), key) for key, (count, error) in counts.items()
+        ]
+        heapq.heapify(self.heap)
+
+    def top(self, n):
+        """Return a list of the n (key, count, error) with the largest
+        counts."""
+        largest = heapq.nlargest(n, self.counts.items(), key=lambda item: item[1][0])
+        return [(key, count, error) for key, (count, error) in largest]
@@ -0,0 +1,142 @@
+"""
+Test that the metrics are the same when the files are traced by worker
+processes as when they are traced one after another, and when the packets
+come from the decode cache.
+"""
+
+import os
+import sys
+import socket
+import struct
+import subprocess
+
+import pytest
+
+# the application
+metrics_filter = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "MetricsFilter.py"
+)
+
+client = "10.0.1.1"
+server = "10.0.1.10"
+
+
+def frame(source, destination, payload, port=47808):
+    """Return an Ethernet frame with a UDP packet."""
+    udp = struct.pack("!HHHH", port, port, 8 + len(payload), 0) + payload
+    ip = struct.pack(
+        "!BBHHHBBH4s4s",
+        0x45,
+        0,
+        20 + len(udp),
+        0,
+        0,
+        64,
+        17,
+        0,
+        socket.inet_aton(source),
+        socket.inet_aton(destination),
+    )
+    return b"\xff" * 6 + b"\x00\x11\x22\x33\x44\x55" + b"\x08\x00" + ip + udp
+
+
+def read_property(invoke_id):
+    """Return a Read Property request for the present value of analog input
+    1 from the client to the server."""
+    apdu = bytes([0x02, 0x04, invoke_id, 0x0C, 0x0C, 0, 0, 0, 1, 0x19, 0x55])
+    return frame(client, server, b"\x81\x0a\x00\x11\x01\x04" + apdu)
+
+
+def read_property_ack(invoke_id):
+    """Return the ACK from the server to the client."""
+    apdu = bytes([0x30, invoke_id, 0x0C, 0x0C, 0, 0, 0, 1, 0x19, 0x55])
+    apdu += bytes([0x3E, 0x44, 0x42, 0x28, 0, 0, 0x3F])
+    return frame(server, client, b"\x81\x0a\x00\x17\x01\x00" + apdu)
+
+
+def write_pcap(fname, packets):
+    with open(fname, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for timestamp, data in packets:
+            seconds = int(timestamp)
+            micros = int(round((timestamp - seconds) * 1e6))
+            f.write(struct.pack("<IIII", seconds, micros, len(data), len(data)))
+            f.write(data)
+
+
+@pytest.fixture
+def captures(tmp_path):
+    t = 1600000000.0
+
+    # answered in the same file, then requests left pending at the end
+    first = [
+        (t + 0.0, read_property(1)),
+        (t + 0.1, read_property_ack(1)),
+        (t + 1.0, read_property(2)),  # answered in the second file
+        (t + 1.1, read_property(3)),  # retried in the second file
+        (t + 1.2, read_property(4)),  # never answered
+        (t + 1.3, read_property(5)),  # answered after the timeout
+        (t + 1.4, read_property(6)),  # answered in the third file
+    ]
+
+    second = [
+        (t + 2.0, read_property_ack(2)),
+        (t + 3.0, read_property(3)),
+        (t + 3.5, read_property_ack(3)),
+        (t + 4.0, read_property(7)),  # answered in the third file
+    ]
+
+    third = [
+        (t + 6.0, read_property_ack(6)),
+        (t + 6.5, read_property_ack(7)),
+        (t + 11.0, read_property(8)),
+        (t + 12.0, read_property_ack(5)),
+        (t + 14.0, read_property(9)),  # pending at the end
+    ]
+
+    fnames = []
+    for i, packets in enumerate((first, second, third)):
+        fname = str(tmp_path / ("capture%d.pcap" % (i,)))
+        write_pcap(fname, packets)
+        fnames.append(fname)
+
+    return fnames
+
+
+def metrics(fnames, *options):
+    """Run the application and return the lines of the Read Property
+    metrics."""
+    result = subprocess.run(
+        [sys.executable, metrics_filter] + list(options) + list(fnames),
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    return [
+        line
+        for line in result.stdout.splitlines()
+        if line.startswith("bacnet_readproperty_")
+    ]
+
+
+def test_sequential(captures):
+    assert metrics(captures) == [
+        "bacnet_readproperty_requests_total 9",
+        "bacnet_readproperty_retries_total 1",
+        "bacnet_readproperty_timeouts_total 2",
+        "bacnet_readproperty_outstanding 2",
+    ]
+
+
+@pytest.mark.parametrize("jobs", ["2", "3"])
+def test_jobs(captures, jobs):
+    assert metrics(captures, "--jobs", jobs) == metrics(captures)
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_cache(captures, jobs):
+    expected = metrics(captures)
+
+    # the first run builds the cache files and the second one reads them
+    assert metrics(captures, "--cache", "--jobs", jobs) == expected
+    assert metrics(captures, "--cache", "--jobs", jobs) == expected
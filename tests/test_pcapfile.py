@@ -0,0 +1,97 @@
+"""
+Test that captures of a link type other than Ethernet are not decoded as
+Ethernet frames.
+"""
+
+import struct
+
+import pytest
+
+from pcapfile import PCAPFile, PCAPNGFile, PCAPStream
+
+# Linux cooked capture
+LINKTYPE_LINUX_SLL = 113
+
+
+def write_pcap(fname, linktype, packets):
+    with open(fname, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, linktype))
+        for timestamp, data in packets:
+            seconds = int(timestamp)
+            micros = int(round((timestamp - seconds) * 1e6))
+            f.write(struct.pack("<IIII", seconds, micros, len(data), len(data)))
+            f.write(data)
+
+
+def block(block_type, body):
+    """Return a pcapng block."""
+    body += b"\x00" * (-len(body) % 4)
+    return (
+        struct.pack("<II", block_type, 12 + len(body))
+        + body
+        + struct.pack("<I", 12 + len(body))
+    )
+
+
+def write_pcapng(fname, linktypes, packets):
+    """Write a section with an interface for each link type and the packets
+    as (interface, timestamp, data) in enhanced packet blocks."""
+    with open(fname, "wb") as f:
+        f.write(block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1)))
+        for linktype in linktypes:
+            f.write(block(1, struct.pack("<HHI", linktype, 0, 65535)))
+        for iface, timestamp, data in packets:
+            micros = int(round(timestamp * 1e6))
+            header = struct.pack(
+                "<IIIII", iface, micros >> 32, micros & 0xFFFFFFFF, len(data), len(data)
+            )
+            f.write(block(6, header + data))
+
+
+def test_pcap_ethernet(tmp_path):
+    fname = str(tmp_path / "ethernet.pcap")
+    write_pcap(fname, 1, [(1.0, b"\x00" * 60), (2.0, b"\x01" * 60)])
+
+    records = list(PCAPFile(fname).records())
+    assert [number for number, timestamp, data in records] == [1, 2]
+
+
+def test_pcap_linktype(tmp_path):
+    fname = str(tmp_path / "cooked.pcap")
+    write_pcap(fname, LINKTYPE_LINUX_SLL, [(1.0, b"\x00" * 60)])
+
+    with pytest.raises(RuntimeError, match="unsupported link type 113"):
+        PCAPFile(fname)
+
+
+def test_stream_linktype(tmp_path):
+    fname = str(tmp_path / "cooked.pcap")
+    write_pcap(fname, LINKTYPE_LINUX_SLL, [(1.0, b"\x00" * 60)])
+
+    with pytest.raises(RuntimeError, match="unsupported link type 113"):
+        PCAPStream(fname)
+
+
+def test_pcapng_linktype(tmp_path, capsys):
+    fname = str(tmp_path / "mixed.pcapng")
+    write_pcapng(
+        fname,
+        [1, LINKTYPE_LINUX_SLL],
+        [
+            (0, 1.0, b"\x00" * 60),
+            (1, 2.0, b"\x01" * 60),
+            (0, 3.0, b"\x02" * 60),
+            (1, 4.0, b"\x03" * 60),
+        ],
+    )
+
+    # the cooked packets are skipped but still numbered
+    records = list(PCAPNGFile(fname).records())
+    assert [(number, timestamp) for number, timestamp, data in records] == [
+        (1, 1.0),
+        (3, 3.0),
+    ]
+    assert bytes(records[1][2]) == b"\x02" * 60
+
+    # warned once
+    assert capsys.readouterr().err.count("skipping packets with link type 113") == 1
@@ -0,0 +1,51 @@
+"""
+Test parsing the hex dumps of tshark.
+"""
+
+from tshark import parse_stream
+
+
+def hex_dump(data):
+    """Return the lines of a tshark -x dump of some packet data."""
+    lines = []
+    for offset in range(0, len(data), 16):
+        chunk = data[offset : offset + 16]
+        hex_part = "".join("%02x " % (byte,) for byte in chunk).ljust(48)
+        text = "".join(chr(byte) if 32 <= byte < 127 else "." for byte in chunk)
+        lines.append("%04x  %s  %s" % (offset, hex_part, text))
+    return lines
+
+
+def tshark_output(packets):
+    """Return the lines of tshark -P -x output for a list of packets."""
+    lines = []
+    for number, data in enumerate(packets, 1):
+        lines.append("    %d 0.000000000    10.0.1.1 -> 10.0.1.2   BACnet" % (number,))
+        lines.append("")
+        lines.extend(hex_dump(data))
+        lines.append("")
+    return lines
+
+
+def test_long_packets():
+    # longer than 160 bytes so there are offsets like 00a0
+    packets = [bytes(range(256)) + bytes(54), bytes(reversed(range(256))) + bytes(54)]
+
+    assert [bytes(data) for data in parse_stream(tshark_output(packets))] == packets
+
+
+def test_without_blank_lines():
+    packets = [bytes(range(200)), bytes(range(20, 203))]
+    lines = hex_dump(packets[0]) + hex_dump(packets[1])
+
+    assert [bytes(data) for data in parse_stream(lines)] == packets
+
+
+def test_lost_line():
+    packets = [bytes(range(200)), bytes(range(50)), bytes(range(180))]
+    lines = tshark_output(packets)
+
+    # drop the second line of the first packet
+    del lines[lines.index(hex_dump(packets[0])[1])]
+
+    assert [bytes(data) for data in parse_stream(lines)] == packets[1:]
@@ -0,0 +1,272 @@
+#!/usr/bin/python
+
+"""
+Transactions - Matching confirmed requests with their responses
+
+Each confirmed request is kept by (client, server, invoke ID) until the
+server answers with a Simple Ack, Complex Ack, Error, Reject or Abort, or
+the client aborts it.  The same request sent again before it is answered is
+a retry.  A request that is not answered within the timeout, in capture
+time, is finished as a timeout so a later request that reuses the invoke ID
+is not matched with the wrong response.
+
+The pending requests are scheduled in a timer wheel, a ring of slots that
+each cover a short span of capture time, so finding the requests that have
+timed out only looks at the slots that time has moved past rather than at
+every pending request, and each packet is constant work.
+"""
+
+import math
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+from bacpypes.apdu import (
+    confirmed_request_types,
+    ConfirmedRequestPDU,
+    SimpleAckPDU,
+    ComplexAckPDU,
+    ErrorPDU,
+    RejectPDU,
+    AbortPDU,
+)
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# the packets a tracer using the engine is interested in
+transaction_pdu_types = (
+    ConfirmedRequestPDU,
+    SimpleAckPDU,
+    ComplexAckPDU,
+    ErrorPDU,
+    RejectPDU,
+    AbortPDU,
+)
+
+# response pduType to outcome
+response_outcomes = {
+    SimpleAckPDU.pduType: "simpleack",
+    ComplexAckPDU.pduType: "complexack",
+    ErrorPDU.pduType: "error",
+    RejectPDU.pduType: "reject",
+    AbortPDU.pduType: "abort",
+}
+
+# outcomes in the order they are reported
+outcomes = ("complexack", "simpleack", "error", "reject", "abort", "timeout")
+
+#
+#   service_name
+#
+
+
+def service_name(service):
+    """Return the name of a confirmed service choice."""
+    request_type = confirmed_request_types.get(service)
+    if request_type is None:
+        return "service %s" % (service,)
+
+    name = request_type.__name__
+    if name.endswith("Request"):
+        name = name[: -len("Request")]
+    return name
+
+
+#
+#   TimerWheel
+#
+
+
+@bacpypes_debugging
+class TimerWheel:
+    """Keys scheduled to expire at a time, kept in a ring of slots that each
+    cover resolution seconds.  The ring has enough slots for the longest
+    delay, so a key is never more than one turn ahead."""
+
+    def __init__(self, delay, resolution=0.1):
+        if _debug:
+            TimerWheel._debug("__init__ %r resolution=%r", delay, resolution)
+
+        self.resolution = resolution
+        self.slots = [[] for i in range(int(math.ceil(delay / resolution)) + 2)]
+
+        # the first slot that has not been expired
+        self.tick = None
+
+    def schedule(self, key, when):
+        """Add a key to the slot for a time."""
+        tick = int(when // self.resolution)
+        if self.tick is not None:
+            tick = max(tick, self.tick)
+        self.slots[tick % len(self.slots)].append(key)
+
+    def advance(self, now):
+        """Return the keys in the slots that time has moved past, these are
+        the keys scheduled before now.  A key that was scheduled again later
+        is also returned, the caller checks when it is really due."""
+        tick = int(now // self.resolution)
+        if self.tick is None:
+            self.tick = tick
+            return []
+
+        # after a long gap every slot is past
+        self.tick = max(self.tick, tick - len(self.slots))
+
+        keys = []
+        while self.tick < tick:
+            slot = self.slots[self.tick % len(self.slots)]
+            if slot:
+                keys.extend(slot)
+                del slot[:]
+            self.tick += 1
+
+        return keys
+
+
+#
+#   Transaction
+#
+
+
+class Transaction:
+    def __init__(self, req):
+        self.req = req
+        self.resp = None
+
+        self.service = req.apduService
+        self.ts = req._timestamp
+        self.last = req._timestamp
+        self.retry = 1
+
+        # how it finished, see outcomes
+        self.outcome = None
+
+    @property
+    def latency(self):
+        """Seconds from the first request to the response, or None."""
+        if self.resp is None:
+            return None
+        return self.resp._timestamp - self.ts
+
+
+#
+#   TransactionEngine
+#
+
+
+@bacpypes_debugging
+class TransactionEngine:
+    """Match confirmed requests with their responses.  Give each packet to
+    the engine in capture order, and the complete function is called with
+    each transaction when it is answered or has timed out."""
+
+    def __init__(self, complete=None, timeout=10.0, resolution=0.1):
+        if _debug:
+            TransactionEngine._debug(
+                "__init__ %r timeout=%r resolution=%r", complete, timeout, resolution
+            )
+
+        self.complete = complete
+        self.timeout = timeout
+
+        # (client, server, invoke ID) to transaction
+        self.pending = {}
+        self.wheel = TimerWheel(timeout, resolution)
+
+        # responses that do not match a pending request
+        self.unmatched = 0
+
+    def process(self, pkt):
+        """Look at the next packet."""
+        if _debug:
+            TransactionEngine._debug("process %r", pkt)
+
+        # time has moved on, the older requests may have timed out
+        self.expire(pkt._timestamp)
+
+        pdu_type = getattr(pkt, "pduType", None)
+        if pdu_type == ConfirmedRequestPDU.pduType:
+            self.request(pkt)
+        elif pdu_type in response_outcomes:
+            self.response(pkt, response_outcomes[pdu_type])
+
+    def request(self, pkt):
+        key = (pkt.pduSource, pkt.pduDestination, pkt.apduInvokeID)
+
+        txn = self.pending.get(key)
+        if txn and (txn.service == pkt.apduService):
+            if _debug:
+                TransactionEngine._debug("    - retry")
+            txn.retry += 1
+            txn.last = pkt._timestamp
+        else:
+            if txn:
+                # the client gave up and reused the invoke ID
+                if _debug:
+                    TransactionEngine._debug("    - reused invoke ID")
+                self.finish(key, "timeout")
+
+            if _debug:
+                TransactionEngine._debug("    - new request")
+            txn = Transaction(pkt)
+            self.pending[key] = txn
+
+        self.wheel.schedule(key, txn.last + self.timeout)
+
+    def response(self, pkt, outcome):
+        server_key = (pkt.pduDestination, pkt.pduSource, pkt.apduInvokeID)
+        client_key = (pkt.pduSource, pkt.pduDestination, pkt.apduInvokeID)
+
+        # an abort may come from either side, the decode cache does not
+        # keep which one so try both
+        if outcome == "abort":
+            server = getattr(pkt, "apduSrv", None)
+            if server:
+                keys = (server_key,)
+            elif server is None:
+                keys = (server_key, client_key)
+            else:
+                keys = (client_key,)
+        else:
+            keys = (server_key,)
+
+        for key in keys:
+            txn = self.pending.get(key)
+            if not txn:
+                continue
+
+            # acks and errors are for a service, a late response to an
+            # earlier request with this invoke ID is not this one
+            service = getattr(pkt, "apduService", None)
+            if (service is not None) and (service != txn.service):
+                continue
+
+            if _debug:
+                TransactionEngine._debug("    - matched with request")
+            txn.resp = pkt
+            self.finish(key, outcome)
+            break
+        else:
+            if _debug:
+                TransactionEngine._debug("    - unmatched")
+            self.unmatched += 1
+
+    def expire(self, now):
+        """Finish the requests that have not been answered in time."""
+        for key in self.wheel.advance(now):
+            txn = self.pending.get(key)
+
+            # answered, or retried and scheduled again
+            if (txn is None) or (txn.last + self.timeout > now):
+                continue
+
+            if _debug:
+                TransactionEngine._debug("    - timeout: %r", key)
+            self.finish(key, "timeout")
+
+    def finish(self, key, outcome):
+        txn = self.pending.pop(key)
+        txn.outcome = outcome
+        if self.complete:
+            self.complete(txn)
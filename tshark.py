@@ -1,4 +1,4 @@
-#!/urs/bin/python
+#!/usr/bin/python
 
 """
 tshark
@@ -9,14 +9,20 @@ parses the tshark output generated like this:
 
     $ sudo tshark -i eth0 -P -x -f 'udp port 47808'
 
-And feeds that into the decoder.
+And feeds that into the decoder.  The output is read as a stream from the
+files, or stdin when there are none or the file name is '-', so it can be
+piped directly from tshark.  Each decoded packet is written as a line of
+JSON, and with the --jobs option the packets are decoded in batches by a pool
+of worker processes.  The --sample option decodes the sample packet below.
 """
 
 import sys
 import re
 import json
+import multiprocessing
+from collections import deque
 
-from bacpypes.debugging import ModuleLogger, xtob
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
 from bacpypes.analysis import decode_packet
@@ -27,55 +33,183 @@ _log = ModuleLogger(globals())
 
 
 sample = """
-    1 0.000000000    10.0.1.93 -> 10.0.1.255   BACnet-APDU 66 Unconfirmed-REQ i-Am device,18 
+    1 0.000000000    10.0.1.93 -> 10.0.1.255   BACnet-APDU 66 Unconfirmed-REQ i-Am device,18
 
 0000  ff ff ff ff ff ff a4 4e 31 7e aa f4 08 00 45 00   .......N1~....E.
 0010  00 34 e4 6d 40 00 40 11 3e f0 0a 00 01 5d 0a 00   .4.m@.@.>....]..
-0020  01 ff ba c0 ba c0 00 20 53 5a 81 0b 00 18 01 20   ....... SZ..... 
+0020  01 ff ba c0 ba c0 00 20 53 5a 81 0b 00 18 01 20   ....... SZ.....
 0030  ff ff 00 ff 10 00 c4 02 00 00 12 22 04 00 91 00   ..........."....
 0040  21 0f                                             !.
 """
 
-tshark_re = re.compile("^[0-9]{4}  ([0-9a-f ][0-9a-f ] ){16}  ")
+# the hex offset and the bytes of a line of the dump
+tshark_re = re.compile("^([0-9a-f]{4,})  ((?:[0-9a-f ][0-9a-f ] ){16})  ")
 
+#
+#   parse_stream
+#
 
-def parse_stream(sample_text):
-    packet_data = ""
-    for line in sample_text.splitlines():
+
+def parse_stream(lines):
+    """Given an iterable of lines of tshark output, yield a bytearray of the
+    contents of each packet.  The hex bytes of each line are added to the
+    packet as they are read, a packet starts at offset zero and when the
+    offset of a line is not where the packet ends a line has been lost, so
+    the packet is dropped until the next one starts."""
+    packet_data = None
+    for line in lines:
         m = tshark_re.match(line)
         if not m:
             if packet_data:
                 yield packet_data
-                packet_data = ""
+            packet_data = None
             continue
 
-        offset = line[:4]
-        if offset == "0000":
+        offset = int(m.group(1), 16)
+        if offset == 0:
             if packet_data:
                 yield packet_data
-                packet_data = ""
+            packet_data = bytearray()
+        elif packet_data is None:
+            continue
+        elif offset != len(packet_data):
+            if _debug:
+                _log.debug("    - offset %d, expected %d", offset, len(packet_data))
+            packet_data = None
+            continue
 
-        packet_data = packet_data + line[6:53].replace(" ", "")
+        packet_data.extend(bytes.fromhex(m.group(2)))
 
     if packet_data:
         yield packet_data
 
 
+#
+#   batches
+#
+
+
+def batches(packets, size):
+    """Group the packets into lists of (number, data) tuples."""
+    batch = []
+    for number, data in enumerate(packets, 1):
+        batch.append((number, data))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+#
+#   decode_batch
+#
+
+
+@bacpypes_debugging
+def decode_batch(batch):
+    """Decode a batch of packets and return the lines of JSON, this is called
+    in a worker process when there is more than one job."""
+    if _debug:
+        decode_batch._debug("decode_batch %r", len(batch))
+
+    lines = []
+    for number, data in batch:
+        try:
+            packet = decode_packet(data)
+            if not packet:
+                continue
+        except Exception as err:
+            if _debug:
+                decode_batch._debug(
+                    "    - exception decoding packet %d: %r", number, err
+                )
+            continue
+
+        lines.append(json.dumps({"number": number, "apdu": packet.dict_contents()}))
+        lines.append("\n")
+
+    return "".join(lines)
+
+
+#
+#   decode_batches
+#
+
+
+@bacpypes_debugging
+def decode_batches(packet_batches, jobs=1):
+    """Decode the batches, in parallel when there is more than one job, and
+    yield the output of each one in order.  Only a few batches are decoded
+    ahead of the output being written."""
+    if _debug:
+        decode_batches._debug("decode_batches %r %r", packet_batches, jobs)
+
+    if jobs <= 1:
+        for batch in packet_batches:
+            yield decode_batch(batch)
+        return
+
+    with multiprocessing.Pool(jobs) as pool:
+        pending = deque()
+        for batch in packet_batches:
+            pending.append(pool.apply_async(decode_batch, (batch,)))
+            if len(pending) > 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+#
+#   read_lines
+#
+
+
+def read_lines(fnames):
+    """Yield the lines of the files one at a time, '-' is stdin."""
+    for fname in fnames:
+        if fname == "-":
+            for line in sys.stdin:
+                yield line
+        else:
+            with open(fname, "r", errors="replace") as f:
+                for line in f:
+                    yield line
+
+
+#
+#   __main__
+#
+
+
 def main():
     # parse the command line arguments
     parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sample", action="store_true", help="decode the sample packet"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="number of decoding processes"
+    )
+    parser.add_argument(
+        "-b", "--batch", type=int, default=500, help="packets per batch"
+    )
+    parser.add_argument("tshark", nargs="*", type=str, help="tshark output file(s)")
     args = parser.parse_args()
     if _debug:
         _log.debug("    - args: %r", args)
 
-    for packet_data in parse_stream(sample):
-        data = xtob(packet_data)
-        packet = decode_packet(data)
-        if not packet:
-            continue
+    if args.sample:
+        lines = sample.splitlines()
+    else:
+        lines = read_lines(args.tshark or ["-"])
 
-        x = {"apdu": packet.dict_contents()}
-        json.dump(x, sys.stdout, indent=4)
+    # write the JSON lines a batch at a time
+    packet_batches = batches(parse_stream(lines), args.batch)
+    for output in decode_batches(packet_batches, args.jobs):
+        sys.stdout.write(output)
+        sys.stdout.flush()
 
 
 if __name__ == "__main__":
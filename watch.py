@@ -0,0 +1,191 @@
+#!/usr/bin/python
+
+"""
+Watch - Tracing the capture files in a directory as they are written
+
+A capture program like daemonlogger writes into one file and starts a new
+one every so often.  The directory is scanned for pcap and pcapng files, and
+each file that is new or has grown since it was last read is traced from
+where it was left, so the analyzers keep up with the capture and their
+results stay in memory.  The positions in the files are kept in a
+checkpoint, see the checkpoint module, which can also be saved so a daemon
+that is restarted continues from where it stopped.
+
+When the inotify_simple package is installed the watcher waits for the
+directory to change, otherwise the directory is polled.
+"""
+
+import os
+import sys
+import time
+import fnmatch
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+from checkpoint import Checkpoint
+from parallel import trace_one, tracer_modules, module_name
+from pcaptrace import trace_options
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# names of the capture files in the directory
+file_patterns = ("*.pcap", "*.pcapng", "*.cap")
+
+# files that are kept next to the capture files
+_sidecar_suffixes = (".idx", ".cache", ".tmp")
+
+#
+#   DirectoryWatcher
+#
+
+
+@bacpypes_debugging
+class DirectoryWatcher:
+    """The capture files in a directory and a way to wait for them to
+    change."""
+
+    def __init__(self, directory, patterns=file_patterns, poll=5.0, delay=1.0):
+        if _debug:
+            DirectoryWatcher._debug(
+                "__init__ %r patterns=%r poll=%r delay=%r",
+                directory,
+                patterns,
+                poll,
+                delay,
+            )
+
+        self.directory = directory
+        self.patterns = patterns
+        self.poll = poll
+        self.delay = delay
+
+        # watch for files being written, closed, or moved in
+        self.inotify = None
+        if INotify:
+            self.inotify = INotify()
+            self.inotify.add_watch(
+                directory,
+                flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO,
+            )
+        if _debug:
+            DirectoryWatcher._debug("    - inotify: %r", self.inotify)
+
+    def files(self):
+        """Return the capture files in the order they were last modified, so
+        the files of a rotation are traced in order."""
+        fnames = []
+        for name in os.listdir(self.directory):
+            if name.endswith(_sidecar_suffixes):
+                continue
+            if not any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns):
+                continue
+            fname = os.path.join(self.directory, name)
+            try:
+                fnames.append((os.path.getmtime(fname), fname))
+            except OSError:
+                # removed by the rotation
+                continue
+
+        return [fname for mtime, fname in sorted(fnames)]
+
+    def wait(self, timeout):
+        """Wait for something in the directory to change, or for the poll
+        interval, but no longer than the timeout in seconds.  A file that is
+        being written changes all the time, so the changes for the delay
+        after the first one are read together."""
+        if _debug:
+            DirectoryWatcher._debug("wait %r", timeout)
+
+        if self.inotify:
+            events = self.inotify.read(
+                timeout=int(timeout * 1000), read_delay=int(self.delay * 1000)
+            )
+            if _debug:
+                DirectoryWatcher._debug("    - events: %r", events)
+        else:
+            time.sleep(min(timeout, self.poll))
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+
+
+#
+#   watch_directory
+#
+
+
+@bacpypes_debugging
+def watch_directory(watcher, tracers, args, report, report_interval=60.0):
+    """Trace the new packets in the files of the watcher as they arrive, and
+    call the report function every report interval seconds when there have
+    been new packets.  With a checkpoint file the state of the analyzer
+    modules is loaded first and saved with each report.  This runs until it
+    is interrupted."""
+    if _debug:
+        watch_directory._debug(
+            "watch_directory %r %r %r %r %r",
+            watcher,
+            tracers,
+            args,
+            report,
+            report_interval,
+        )
+
+    # the positions are always kept, the file is optional
+    checkpoint_name = getattr(args, "checkpoint", None)
+    if checkpoint_name:
+        modules, tracer_names = tracer_modules(tracers)
+        checkpoint = Checkpoint(
+            checkpoint_name, [module_name(module) for module in modules]
+        )
+        states = checkpoint.load()
+        if states:
+            for module, state in zip(modules, states):
+                module.merge(state)
+    else:
+        checkpoint = Checkpoint()
+
+    # reports are made here rather than as capture time goes by, and reading
+    # from the middle of a file cannot use the decode cache
+    options = trace_options(args)
+    options["cache"] = False
+    options["interval"] = None
+
+    traced = False
+    next_report = time.time() + report_interval
+    while True:
+        for fname in watcher.files():
+            try:
+                if checkpoint.finished(fname):
+                    continue
+                if _debug:
+                    watch_directory._debug("    - tracing: %r", fname)
+
+                position = checkpoint.position(fname)
+                trace_one(fname, tracers, checkpoint, position, **options)
+                traced = traced or (checkpoint.position(fname) != position)
+            except (OSError, RuntimeError) as err:
+                # removed, or the header has not been written yet
+                if _debug:
+                    watch_directory._debug("    - skipped %r: %r", fname, err)
+
+        now = time.time()
+        if now >= next_report:
+            if traced:
+                report()
+                if checkpoint_name:
+                    checkpoint.save([module.state() for module in modules])
+                traced = False
+            next_report = now + report_interval
+
+        sys.stdout.flush()
+        watcher.wait(max(0.0, next_report - time.time()))